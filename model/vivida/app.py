@@ -15,7 +15,17 @@ import traceback
 from typing import Dict, Any
 
 # Import v3.0 optimization
-from gbm_optimize_treatment_extended_dosage_v3 import optimize_treatment_with_dosage_grid
+from gbm_optimize_treatment_extended_dosage_v3 import (
+    optimize_treatment_with_dosage_grid, sweep_patient_features,
+    optimize_treatment_expanded, estimate_uncertainty,
+    parse_search_space, estimate_search_cost, downsample_search_space, resolve_objective,
+    current_modalities, MODALITIES, MAX_CURVE_POINTS
+)
+from gbm_optimize_treatment_sequence_v3 import optimize_treatment_sequence, parse_stages
+from gbm_optimize_treatment_dosage_v3 import (
+    param_cache, SIMILAR_PATIENTS_K, ATTRIBUTION_TOP_K, drift_monitor, record_drift
+)
+from gbm_gompertz_fit import follow_up_observations
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS
@@ -23,6 +33,80 @@ CORS(app)  # Enable CORS
 MODEL_VERSION = "3.0"
 MODEL_FEATURES = 115
 
+# Per-request search budget (model evaluations)
+MAX_EVALUATIONS_PER_REQUEST = 400
+
+# Per-request Monte Carlo budget (samples per regimen)
+MAX_UNCERTAINTY_SAMPLES = 20000
+
+# Upper bound for ?similar=N (nearest training patients returned)
+MAX_SIMILAR_PATIENTS = 50
+
+# Upper bound for ?explain=N (features listed per parameter)
+MAX_ATTRIBUTION_FEATURES = 115
+
+class SearchBudgetExceeded(Exception):
+    """Search space is larger than the per-request budget"""
+
+    def __init__(self, estimate: Dict[str, Any]):
+        super().__init__(f"search needs {estimate['evaluations']} evaluations "
+                         f"(budget: {MAX_EVALUATIONS_PER_REQUEST})")
+        self.estimate = estimate
+
+def resolve_search_space(
+    patient_data: Dict[str, Any],
+    test_all_modalities: bool,
+    dry_run: bool = False
+) -> Dict[str, Any]:
+    """
+    Build optimizer search arguments from the optional `search_space` object
+    and enforce the per-request budget
+
+    "search_space": {
+        "chemo_doses": [...], "radio_schemes": [[total_Gy, fractions], ...],
+        "modalities": [...], "on_over_budget": "reject" | "downsample"
+    }
+
+    Returns dict with 'search' (optimizer kwargs), 'cost', 'within_budget' and
+    'downsampled'. Raises ValueError on an invalid spec and SearchBudgetExceeded
+    when the search is over budget and the policy is "reject" (except for dry runs).
+    """
+    spec = patient_data.get('search_space')
+    search = parse_search_space(spec)
+
+    if not spec or 'modalities' not in spec:
+        search['modalities'] = list(MODALITIES) if test_all_modalities \
+            else current_modalities(patient_data.get('treatment', ''))
+
+    policy = (spec or {}).get('on_over_budget', 'reject')
+    if policy not in ('reject', 'downsample'):
+        raise ValueError("on_over_budget must be 'reject' or 'downsample'")
+
+    cost = estimate_search_cost(**search)
+    within_budget = cost['evaluations'] <= MAX_EVALUATIONS_PER_REQUEST
+    downsampled = False
+
+    if not within_budget:
+        if policy == 'downsample':
+            search = downsample_search_space(max_evaluations=MAX_EVALUATIONS_PER_REQUEST, **search)
+            cost = estimate_search_cost(**search)
+            downsampled = True
+        elif not dry_run:
+            raise SearchBudgetExceeded(cost)
+
+    return {'search': search, 'cost': cost, 'within_budget': within_budget, 'downsampled': downsampled}
+
+def invalid_follow_up(patient_data: Dict[str, Any]):
+    """400 response for malformed follow-up scans, None if they are valid (or absent)"""
+    try:
+        follow_up_observations(patient_data)
+    except ValueError as e:
+        return jsonify({
+            'error': 'Invalid follow-up',
+            'message': str(e)
+        }), 400
+    return None
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
@@ -31,7 +115,8 @@ def health_check():
         'service': 'GBM Treatment Optimization API v3.0',
         'version': MODEL_VERSION,
         'features': MODEL_FEATURES,
-        'model_type': 'full_features'
+        'model_type': 'full_features',
+        'param_cache': param_cache.stats()
     }), 200
 
 @app.route('/model/info', methods=['GET'])
@@ -52,10 +137,21 @@ def model_info():
             'genetic': ['mgmt_methylation', 'idh_mutation', 'egfr_amplification', 'tert_mutation', 'atrx_mutation'],
             'clinical': ['edema_volume', 'steroid_dose', 'antiseizure_meds'],
             'neurological': ['neurological_symptoms', 'has_headache', 'has_seizures', 'symptom_count'],
-            'other': ['lateralization', 'rano_response', 'family_history', 'previous_radiation']
+            'other': ['lateralization', 'rano_response', 'family_history', 'previous_radiation'],
+            'follow_up': ['tumor_size_2m', 'tumor_size_4m', 'tumor_size_6m', 'tumor_size_12m', 'follow_up']
         }
     }), 200
 
+@app.route('/drift', methods=['GET'])
+def input_drift():
+    """Drift of the request features since startup against the training distribution"""
+    if drift_monitor is None:
+        return jsonify({
+            'error': 'Drift monitoring unavailable',
+            'message': 'the model directory has no drift_reference.joblib (retrain to create it)'
+        }), 503
+    return jsonify(drift_monitor.report()), 200
+
 @app.route('/optimize', methods=['POST'])
 def optimize_treatment():
     """
@@ -101,6 +197,108 @@ def optimize_treatment():
 
         # Optional parameters
         test_all_modalities = request.args.get('test_all_modalities', 'true').lower() == 'true'
+        dry_run = request.args.get('dry_run', 'false').lower() == 'true'
+        uncertainty = request.args.get('uncertainty', 'false').lower() == 'true'
+        schedule_aware = request.args.get('schedule_aware', 'false').lower() == 'true'
+
+        if uncertainty:
+            try:
+                n_samples = int(request.args.get('samples', 10000))
+                interval = float(request.args.get('interval', 0.9))
+            except ValueError:
+                return jsonify({
+                    'error': 'Invalid uncertainty options',
+                    'message': 'samples must be an integer and interval a number'
+                }), 400
+            uncertainty_method = request.args.get('uncertainty_method', 'dispersion')
+
+            if not 1 <= n_samples <= MAX_UNCERTAINTY_SAMPLES:
+                return jsonify({
+                    'error': 'Invalid uncertainty options',
+                    'message': f'samples must be between 1 and {MAX_UNCERTAINTY_SAMPLES}'
+                }), 400
+            if uncertainty_method not in ('dispersion', 'bootstrap'):
+                return jsonify({
+                    'error': 'Invalid uncertainty options',
+                    'message': "uncertainty_method must be 'dispersion' or 'bootstrap'"
+                }), 400
+            if not 0 < interval < 1:
+                return jsonify({
+                    'error': 'Invalid uncertainty options',
+                    'message': 'interval must be between 0 and 1'
+                }), 400
+
+        # Prediction horizons / ranking objective
+        try:
+            horizons = [float(h) for h in request.args['horizons'].split(',')] \
+                if request.args.get('horizons') else None
+            objective = request.args.get('objective')
+            curve_points = int(request.args.get('curve_points', 0))
+            resolve_objective(horizons, objective)
+            if not 0 <= curve_points <= MAX_CURVE_POINTS:
+                raise ValueError(f"curve_points must be between 0 and {MAX_CURVE_POINTS}")
+        except ValueError as e:
+            return jsonify({
+                'error': 'Invalid horizons',
+                'message': str(e)
+            }), 400
+
+        # Follow-up scans (Gompertz refit)
+        invalid = invalid_follow_up(patient_data)
+        if invalid:
+            return invalid
+
+        # Similar training patients
+        try:
+            n_similar = int(request.args.get('similar', SIMILAR_PATIENTS_K))
+            if not 0 <= n_similar <= MAX_SIMILAR_PATIENTS:
+                raise ValueError
+        except ValueError:
+            return jsonify({
+                'error': 'Invalid similar option',
+                'message': f'similar must be an integer between 0 and {MAX_SIMILAR_PATIENTS}'
+            }), 400
+
+        # Feature attributions of the recommended regimen (?explain=true or ?explain=N)
+        explain = request.args.get('explain', 'false').lower()
+        try:
+            explain_top_k = {'true': ATTRIBUTION_TOP_K, 'false': 0}.get(explain)
+            if explain_top_k is None:
+                explain_top_k = int(explain)
+            if not 0 <= explain_top_k <= MAX_ATTRIBUTION_FEATURES:
+                raise ValueError
+        except ValueError:
+            return jsonify({
+                'error': 'Invalid explain option',
+                'message': f'explain must be true, false or an integer between 0 and {MAX_ATTRIBUTION_FEATURES}'
+            }), 400
+
+        # Search space + budget
+        try:
+            plan = resolve_search_space(patient_data, test_all_modalities, dry_run=dry_run)
+        except SearchBudgetExceeded as e:
+            return jsonify({
+                'error': 'Search space exceeds budget',
+                'message': str(e),
+                'search_cost': e.estimate,
+                'max_evaluations': MAX_EVALUATIONS_PER_REQUEST
+            }), 400
+        except ValueError as e:
+            return jsonify({
+                'error': 'Invalid search space',
+                'message': str(e)
+            }), 400
+
+        if dry_run:
+            return jsonify({
+                'dry_run': True,
+                'search_space': plan['search'],
+                'search_cost': plan['cost'],
+                'within_budget': plan['within_budget'],
+                'downsampled': plan['downsampled'],
+                'max_evaluations': MAX_EVALUATIONS_PER_REQUEST,
+                'model_version': MODEL_VERSION
+            }), 200
 
         # Run optimization (suppress console output)
         import sys
@@ -113,18 +311,39 @@ def optimize_treatment():
             result = optimize_treatment_with_dosage_grid(
                 patient=patient_data,
                 doctor_plan=patient_data,
-                test_all_modalities=test_all_modalities
+                horizons=horizons,
+                objective=objective,
+                curve_points=curve_points,
+                schedule_aware=schedule_aware,
+                n_similar=n_similar,
+                explain_top_k=explain_top_k,
+                **plan['search']
             )
+
+            if uncertainty:
+                stats = estimate_uncertainty(
+                    patient_data, result['all_results'], doctor_plan=patient_data,
+                    n_samples=n_samples, method=uncertainty_method, interval=interval
+                )
         finally:
             console_output = sys.stdout.getvalue()
             sys.stdout = old_stdout
 
+        record_drift(patient_data)
+
         # Add debug output if requested
         if request.args.get('debug', 'false').lower() == 'true':
             result['console_output'] = console_output
 
+        if uncertainty:
+            for entry, entry_stats in zip(result['all_results'], stats['regimens']):
+                entry['uncertainty'] = entry_stats
+            result['uncertainty'] = {k: v for k, v in stats.items() if k != 'regimens'}
+
         result['model_version'] = MODEL_VERSION
         result['model_features'] = MODEL_FEATURES
+        result['search_cost'] = plan['cost']
+        result['downsampled'] = plan['downsampled']
 
         return jsonify(result), 200
 
@@ -149,6 +368,25 @@ def optimize_summary():
 
         print(patient_data)
 
+        try:
+            plan = resolve_search_space(patient_data, test_all_modalities=True)
+        except SearchBudgetExceeded as e:
+            return jsonify({
+                'error': 'Search space exceeds budget',
+                'message': str(e),
+                'search_cost': e.estimate,
+                'max_evaluations': MAX_EVALUATIONS_PER_REQUEST
+            }), 400
+        except ValueError as e:
+            return jsonify({
+                'error': 'Invalid search space',
+                'message': str(e)
+            }), 400
+
+        invalid = invalid_follow_up(patient_data)
+        if invalid:
+            return invalid
+
         # Run optimization
         import sys
         from io import StringIO
@@ -159,11 +397,13 @@ def optimize_summary():
             result = optimize_treatment_with_dosage_grid(
                 patient=patient_data,
                 doctor_plan=patient_data,
-                test_all_modalities=True
+                **plan['search']
             )
         finally:
             sys.stdout = old_stdout
 
+        record_drift(patient_data)
+
         # Build simplified summary
         summary = {
             'model_version': MODEL_VERSION,
@@ -230,6 +470,208 @@ def optimize_summary():
             'traceback': error_trace
         }), 500
 
+@app.route('/optimize/sweep', methods=['POST'])
+def optimize_sweep():
+    """
+    What-if sweep over one or two patient features
+
+    Request Body:
+    {
+        "patient": {...},                         // same format as /optimize
+        "regimen": {...},                         // optional, e.g. best_dosage_global
+                                                  // from /optimize (default: patient's plan)
+        "sweep": [
+            {"feature": "steroid_dose", "values": [0, 4, 8, 16]},
+            {"feature": "edema_volume", "start": 0, "stop": 20, "num": 11}
+        ]
+    }
+
+    Response: axes and predicted tumor size surface (one value per sweep point)
+    """
+    try:
+        if not request.is_json:
+            return jsonify({
+                'error': 'Request must be JSON',
+                'message': 'Content-Type must be application/json'
+            }), 400
+
+        body = request.get_json()
+        patient_data = body.get('patient', {})
+
+        required_fields = ['id', 'age', 'tumor_size_before', 'kps', 'treatment']
+        missing_fields = [field for field in required_fields if field not in patient_data]
+
+        if missing_fields:
+            return jsonify({
+                'error': 'Missing required fields',
+                'missing_fields': missing_fields,
+                'required_fields': required_fields
+            }), 400
+
+        invalid = invalid_follow_up(patient_data)
+        if invalid:
+            return invalid
+
+        import sys
+        from io import StringIO
+        old_stdout = sys.stdout
+        sys.stdout = StringIO()
+
+        try:
+            result = sweep_patient_features(
+                patient=patient_data,
+                sweep=body.get('sweep', []),
+                regimen=body.get('regimen')
+            )
+        finally:
+            sys.stdout = old_stdout
+
+        result['model_version'] = MODEL_VERSION
+        return jsonify(result), 200
+
+    except ValueError as e:
+        return jsonify({
+            'error': 'Invalid sweep',
+            'message': str(e)
+        }), 400
+
+    except Exception as e:
+        error_trace = traceback.format_exc()
+        return jsonify({
+            'error': 'Sweep failed',
+            'message': str(e),
+            'traceback': error_trace,
+            'model_version': MODEL_VERSION
+        }), 500
+
+@app.route('/optimize/expanded', methods=['POST'])
+def optimize_expanded():
+    """
+    Exhaustive batched search over the expanded regimen space
+    (temozolomide/lomustine, bevacizumab add-on, hypofractionated schemes)
+
+    Request Body: same as /optimize
+
+    Response: best regimen, top regimens and search statistics
+    """
+    try:
+        if not request.is_json:
+            return jsonify({
+                'error': 'Request must be JSON',
+                'message': 'Content-Type must be application/json'
+            }), 400
+
+        patient_data = request.get_json()
+
+        required_fields = ['id', 'age', 'tumor_size_before', 'kps', 'treatment']
+        missing_fields = [field for field in required_fields if field not in patient_data]
+
+        if missing_fields:
+            return jsonify({
+                'error': 'Missing required fields',
+                'missing_fields': missing_fields,
+                'required_fields': required_fields
+            }), 400
+
+        invalid = invalid_follow_up(patient_data)
+        if invalid:
+            return invalid
+
+        import sys
+        from io import StringIO
+        old_stdout = sys.stdout
+        sys.stdout = StringIO()
+
+        try:
+            result = optimize_treatment_expanded(
+                patient=patient_data,
+                doctor_plan=patient_data
+            )
+        finally:
+            sys.stdout = old_stdout
+
+        record_drift(patient_data)
+        result['model_version'] = MODEL_VERSION
+        return jsonify(result), 200
+
+    except Exception as e:
+        error_trace = traceback.format_exc()
+        return jsonify({
+            'error': 'Optimization failed',
+            'message': str(e),
+            'traceback': error_trace,
+            'model_version': MODEL_VERSION
+        }), 500
+
+@app.route('/optimize/sequence', methods=['POST'])
+def optimize_sequence():
+    """
+    Multi-stage plan (e.g. chemoradiation -> adjuvant -> second line)
+    found by dynamic programming over tumour volume states
+
+    Request Body: same as /optimize, plus optional "stages" (see
+    parse_stages; default: standard course)
+
+    Response: plan per stage, final volume, per-stage policy and search statistics
+    """
+    try:
+        if not request.is_json:
+            return jsonify({
+                'error': 'Request must be JSON',
+                'message': 'Content-Type must be application/json'
+            }), 400
+
+        patient_data = request.get_json()
+
+        required_fields = ['id', 'age', 'tumor_size_before', 'kps', 'treatment']
+        missing_fields = [field for field in required_fields if field not in patient_data]
+
+        if missing_fields:
+            return jsonify({
+                'error': 'Missing required fields',
+                'missing_fields': missing_fields,
+                'required_fields': required_fields
+            }), 400
+
+        invalid = invalid_follow_up(patient_data)
+        if invalid:
+            return invalid
+
+        try:
+            parse_stages(patient_data.get('stages'))
+        except ValueError as e:
+            return jsonify({
+                'error': 'Invalid stages',
+                'message': str(e)
+            }), 400
+
+        import sys
+        from io import StringIO
+        old_stdout = sys.stdout
+        sys.stdout = StringIO()
+
+        try:
+            result = optimize_treatment_sequence(
+                patient=patient_data,
+                stages=patient_data.get('stages'),
+                doctor_plan=patient_data
+            )
+        finally:
+            sys.stdout = old_stdout
+
+        record_drift(patient_data)
+        result['model_version'] = MODEL_VERSION
+        return jsonify(result), 200
+
+    except Exception as e:
+        error_trace = traceback.format_exc()
+        return jsonify({
+            'error': 'Optimization failed',
+            'message': str(e),
+            'traceback': error_trace,
+            'model_version': MODEL_VERSION
+        }), 500
+
 @app.route('/validate', methods=['POST'])
 def validate_patient():
     """Validate patient data without running optimization"""
@@ -263,6 +705,11 @@ def validate_patient():
             if not isinstance(patient_data['steroid_dose'], (int, float)) or patient_data['steroid_dose'] < 0:
                 validation_errors.append('steroid_dose must be non-negative')
 
+        try:
+            follow_up_observations(patient_data)
+        except ValueError as e:
+            validation_errors.append(str(e))
+
         if missing_fields or validation_errors:
             return jsonify({
                 'valid': False,
@@ -289,8 +736,12 @@ def not_found(e):
         'available_endpoints': [
             'GET /health',
             'GET /model/info',
+            'GET /drift',
             'POST /optimize',
             'POST /optimize/summary',
+            'POST /optimize/sweep',
+            'POST /optimize/expanded',
+            'POST /optimize/sequence',
             'POST /validate'
         ]
     }), 404
@@ -312,8 +763,12 @@ if __name__ == '__main__':
     print("Endpoints:")
     print("  GET  /health              - Health check")
     print("  GET  /model/info          - Model information")
+    print("  GET  /drift               - Input drift against the training data")
     print("  POST /optimize            - Full optimization")
     print("  POST /optimize/summary    - Simplified summary")
+    print("  POST /optimize/sweep      - What-if sweep over patient features")
+    print("  POST /optimize/expanded   - Exhaustive search over expanded regimens")
+    print("  POST /optimize/sequence   - Multi-stage plan (dynamic programming)")
     print("  POST /validate            - Validate patient data")
     print()
     print("Starting server on http://localhost:5000")
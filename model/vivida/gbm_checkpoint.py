@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Checkpointed pipeline stages for the training script
+
+Each stage's result is saved as <directory>/<stage>-<key>.joblib. The key
+hashes the stage's config, the keys of the stages it reads from and the
+source of its code, so a stage is recomputed exactly when something it
+depends on changed; otherwise the checkpoint is loaded. Changing an early
+stage changes its key and with it the keys of every later stage.
+
+The code hash only covers the functions and modules passed to run(); a
+change to anything else a stage calls needs a forced rerun.
+"""
+
+import hashlib
+import inspect
+import json
+import os
+import time
+from typing import Dict, Any, Callable, Iterable, Optional, Tuple
+
+from joblib import dump, load
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+CHECKPOINT_VERSION = 1       # bump when the checkpoint layout changes
+KEY_LENGTH = 16              # hex digits of the key in file names
+
+# ============================================================================
+# KEYS
+# ============================================================================
+
+def code_fingerprint(obj) -> str:
+    """Source of a function, class or module (bytecode if the source is unavailable)"""
+    try:
+        return inspect.getsource(obj)
+    except (OSError, TypeError):
+        code = getattr(obj, '__code__', None)
+        return code.co_code.hex() if code is not None else repr(obj)
+
+def stage_key(name: str, config: Dict[str, Any], upstream: Iterable[str] = (), code: Iterable = ()) -> str:
+    """Hash of everything a stage's result depends on"""
+    h = hashlib.sha256()
+    h.update(json.dumps({'version': CHECKPOINT_VERSION, 'stage': name, 'config': config,
+                         'upstream': list(upstream)}, sort_keys=True, default=repr).encode('utf-8'))
+    for obj in code:
+        h.update(code_fingerprint(obj).encode('utf-8'))
+    return h.hexdigest()
+
+# ============================================================================
+# RUNNER
+# ============================================================================
+
+class StageRunner:
+    """
+    Runs stages, loading unchanged ones from their checkpoints
+
+    Args:
+        directory: checkpoint directory (None disables checkpointing)
+        rerun: stage names recomputed even with a matching checkpoint
+    """
+
+    def __init__(self, directory: Optional[str], rerun: Iterable[str] = ()):
+        self.directory = directory
+        self.rerun = set(rerun)
+        self.keys = {}
+        self.log = []
+
+    def _path(self, name: str, key: str) -> str:
+        return os.path.join(self.directory, f"{name}-{key[:KEY_LENGTH]}.joblib")
+
+    def _remove_stale(self, name: str, keep: str) -> None:
+        for f in os.listdir(self.directory):
+            if (f.startswith(f"{name}-") and f.endswith('.joblib') and f != os.path.basename(keep)
+                    and len(f) == len(name) + 1 + KEY_LENGTH + len('.joblib')):
+                os.remove(os.path.join(self.directory, f))
+
+    def run(
+        self,
+        name: str,
+        compute: Callable[[], Any],
+        config: Optional[Dict[str, Any]] = None,
+        upstream: Iterable[str] = (),
+        code: Iterable = (),
+        checkpoint: bool = True
+    ) -> Tuple[Any, str]:
+        """
+        Result of one stage: loaded when its key has a checkpoint, else computed and saved
+
+        Args:
+            compute: no-argument function producing the stage result (picklable)
+            config: settings the result depends on (JSON-serializable)
+            upstream: names of stages already run whose results compute() uses
+            code: functions/modules whose source is part of the key
+            checkpoint: False for stages that always run (cheap, or their own cache);
+                they still get a key for the stages after them
+        """
+        key = stage_key(name, config or {}, [self.keys[u] for u in upstream], code)
+        self.keys[name] = key
+        t_start = time.time()
+
+        if checkpoint and self.directory is not None and name not in self.rerun:
+            path = self._path(name, key)
+            if os.path.exists(path):
+                result = load(path)
+                self.log.append({'stage': name, 'key': key[:KEY_LENGTH], 'status': 'loaded',
+                                 'seconds': time.time() - t_start})
+                print(f"[checkpoint] {name}: unchanged, loaded {path} in {time.time() - t_start:.2f}s")
+                return result, key
+
+        result = compute()
+        if checkpoint and self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(name, key)
+            # Write then rename, so an interrupted run never leaves a truncated checkpoint
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            dump(result, tmp_path)
+            os.replace(tmp_path, path)
+            self._remove_stale(name, path)
+        self.log.append({'stage': name, 'key': key[:KEY_LENGTH], 'status': 'computed',
+                         'seconds': time.time() - t_start})
+        return result, key
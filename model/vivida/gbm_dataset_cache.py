@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Columnar cache of the training workbook
+
+Reading every sheet of glioblastoma_data.xlsx with read_excel takes seconds
+and a lot of memory. The first run converts the workbook (all sheets, with
+the sheet name as `stage`) into an uncompressed Feather file named after the
+workbook's SHA-256; later runs memory-map that file instead. A changed
+workbook has a different checksum, so the cache rebuilds itself and stale
+files for the same workbook are removed.
+
+Without pyarrow the workbook is read directly every time.
+"""
+
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+from typing import Dict, Any, Tuple
+
+try:
+    import pyarrow as pa
+    from pyarrow import feather
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+CACHE_VERSION = 1            # bump when the cached layout changes
+CHECKSUM_CHUNK = 1 << 20     # bytes read per hash update
+
+# ============================================================================
+# WORKBOOK
+# ============================================================================
+
+def read_workbook(path) -> pd.DataFrame:
+    """All sheets of an Excel workbook, stacked, with the sheet name as `stage`"""
+    xls = pd.ExcelFile(path)
+    frames = [pd.read_excel(xls, sh).assign(stage=str(sh)) for sh in xls.sheet_names]
+    return pd.concat(frames, ignore_index=True)
+
+def file_checksum(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHECKSUM_CHUNK), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+# ============================================================================
+# CACHE
+# ============================================================================
+
+def _cache_prefix(path: str) -> str:
+    return f"{os.path.splitext(os.path.basename(path))[0]}-v{CACHE_VERSION}-"
+
+def _restore_missing(df: pd.DataFrame) -> pd.DataFrame:
+    """Arrow returns missing values of object columns as None; read_excel gives NaN"""
+    for col in df.columns:
+        if df[col].dtype == object and df[col].isna().any():
+            df[col] = df[col].where(df[col].notna(), np.nan)
+    return df
+
+def load_workbook_cached(path: str, cache_dir: str) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """
+    The workbook as read_workbook() returns it, through the Feather cache
+
+    Returns:
+        (data frame, info) where info has 'checksum', 'cache' (file or None)
+        and 'source' ('cache', 'excel' = cache rebuilt, 'excel_uncached' = no pyarrow
+        or a column Arrow cannot type)
+    """
+    checksum = file_checksum(path)
+    info = {'checksum': checksum, 'cache': None, 'source': 'excel_uncached'}
+    if not PYARROW_AVAILABLE:
+        return read_workbook(path), info
+
+    prefix = _cache_prefix(path)
+    cache_path = os.path.join(cache_dir, f"{prefix}{checksum[:16]}.feather")
+    info['cache'] = cache_path
+
+    if os.path.exists(cache_path):
+        table = feather.read_table(cache_path, memory_map=True)
+        info['source'] = 'cache'
+        return _restore_missing(table.to_pandas()), info
+
+    df = read_workbook(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    for name in os.listdir(cache_dir):
+        if name.startswith(prefix) and name.endswith('.feather'):
+            os.remove(os.path.join(cache_dir, name))
+
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # A column mixing numbers and text has no Arrow type: keep read_excel's objects
+        info['cache'] = None
+        return df, info
+
+    # Write then rename, so an interrupted run never leaves a truncated cache
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    feather.write_feather(table, tmp_path, compression='uncompressed')
+    os.replace(tmp_path, cache_path)
+    info['source'] = 'excel'
+    return df, info
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Streaming input-drift monitoring
+
+Fixed-memory sketches of the patient features seen by the service, compared
+with reference statistics saved by the training script:
+- numeric fields: counts over the training quantile bins (Population
+  Stability Index, approximate live quantiles) plus count/mean/min/max
+- categorical fields: a count-min sketch of category frequencies, a counter
+  of categories the one-hot encoder never saw (they are silently dropped
+  by handle_unknown='ignore') and a space-saving list of the most frequent
+  unseen values
+
+Updates cost O(1) in the traffic volume and memory does not grow with it.
+"""
+
+import hashlib
+import threading
+import time
+import numpy as np
+import pandas as pd
+from typing import Dict, Any, List
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+DRIFT_BINS = 10             # reference quantile bins per numeric feature (deciles)
+CMS_WIDTH = 1024            # count-min sketch counters per row
+CMS_DEPTH = 4               # count-min sketch rows (independent hashes)
+UNSEEN_TOP_K = 10           # most frequent unseen categories kept per field
+PSI_MODERATE = 0.1          # usual PSI reading: < 0.1 stable, 0.1-0.25 moderate, > 0.25 significant
+PSI_SIGNIFICANT = 0.25
+PSI_EPSILON = 1e-4          # floor for empty bins in the PSI
+DRIFT_MIN_SAMPLES = 50      # fewer requests report 'insufficient_data'
+REPORT_QUANTILES = (0.05, 0.5, 0.95)
+
+# ============================================================================
+# REFERENCE (TRAINING SIDE)
+# ============================================================================
+
+def _bin_edges(values: np.ndarray, bins: int) -> np.ndarray:
+    """Inner bin edges: quantiles, or every distinct value for discrete features"""
+    distinct = np.unique(values)
+    if len(distinct) <= bins:
+        return distinct[1:]
+    return np.unique(np.quantile(values, np.linspace(0, 1, bins + 1)[1:-1]))
+
+def build_drift_reference(
+    numeric: pd.DataFrame,
+    categorical: pd.DataFrame,
+    bins: int = DRIFT_BINS
+) -> Dict[str, Any]:
+    """
+    Reference statistics of the training features (saved as drift_reference.joblib)
+
+    Args:
+        numeric: raw numeric features, one column per monitored field
+        categorical: raw categorical features as strings
+    """
+    reference = {'n_samples': len(numeric), 'numeric': {}, 'categorical': {}}
+
+    for col in numeric.columns:
+        v = numeric[col].to_numpy(dtype=float)
+        edges = _bin_edges(v, bins)
+        counts = np.bincount(np.searchsorted(edges, v, side='right'), minlength=len(edges) + 1)
+        reference['numeric'][col] = {
+            'edges': edges.tolist(),
+            'fractions': (counts / len(v)).tolist(),
+            'mean': float(v.mean()),
+            'min': float(v.min()),
+            'max': float(v.max()),
+            'quantiles': [float(q) for q in np.quantile(v, REPORT_QUANTILES)]
+        }
+
+    for col in categorical.columns:
+        shares = categorical[col].astype(str).value_counts(normalize=True)
+        reference['categorical'][col] = {str(k): float(s) for k, s in shares.items()}
+
+    return reference
+
+# ============================================================================
+# SKETCHES
+# ============================================================================
+
+class CountMinSketch:
+    """Count-min sketch: fixed memory, estimates never below the true count"""
+
+    def __init__(self, width: int = CMS_WIDTH, depth: int = CMS_DEPTH):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self._rows = np.arange(depth)
+
+    def _columns(self, key: str) -> np.ndarray:
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=4 * self.depth).digest()
+        return np.frombuffer(digest, dtype=np.uint32) % self.width
+
+    def add(self, key: str, count: int = 1) -> None:
+        self.table[self._rows, self._columns(key)] += count
+
+    def estimate(self, key: str) -> int:
+        return int(self.table[self._rows, self._columns(key)].min())
+
+class SpaceSaving:
+    """Space-saving heavy hitters: the top-k values in k counters (counts are upper bounds)"""
+
+    def __init__(self, capacity: int = UNSEEN_TOP_K):
+        self.capacity = capacity
+        self.counts = {}
+
+    def add(self, value: str) -> None:
+        if value in self.counts or len(self.counts) < self.capacity:
+            self.counts[value] = self.counts.get(value, 0) + 1
+            return
+        evicted = min(self.counts, key=self.counts.get)
+        self.counts[value] = self.counts.pop(evicted) + 1
+
+    def top(self) -> List[Dict[str, Any]]:
+        return [{'value': v, 'count': c}
+                for v, c in sorted(self.counts.items(), key=lambda item: -item[1])]
+
+# ============================================================================
+# MONITOR
+# ============================================================================
+
+def population_stability_index(expected, actual) -> float:
+    """PSI = sum (a - e) * ln(a / e) over bins, empty bins floored at PSI_EPSILON"""
+    e = np.maximum(np.asarray(expected, dtype=float), PSI_EPSILON)
+    a = np.maximum(np.asarray(actual, dtype=float), PSI_EPSILON)
+    return float(np.sum((a - e) * np.log(a / e)))
+
+def drift_status(psi: float, count: int) -> str:
+    if count < DRIFT_MIN_SAMPLES:
+        return 'insufficient_data'
+    if psi >= PSI_SIGNIFICANT:
+        return 'significant'
+    if psi >= PSI_MODERATE:
+        return 'moderate'
+    return 'stable'
+
+class DriftMonitor:
+    """
+    Thread-safe streaming comparison of request features with the training reference
+
+    update() takes one request's raw numeric and categorical features (fields
+    missing from the reference are ignored); report() compares the sketches
+    with the reference.
+    """
+
+    def __init__(self, reference: Dict[str, Any]):
+        self.reference = reference
+        self.numeric_names = list(reference['numeric'])
+        self.categorical_names = list(reference['categorical'])
+        self._lock = threading.Lock()
+
+        # Inner edges padded with +inf: bin = number of edges <= x, for all features at once
+        edges = [reference['numeric'][f]['edges'] for f in self.numeric_names]
+        n_edges = max((len(e) for e in edges), default=0)
+        self._edges = np.full((len(edges), n_edges), np.inf)
+        for i, e in enumerate(edges):
+            self._edges[i, :len(e)] = e
+        self._ref_min = np.array([reference['numeric'][f]['min'] for f in self.numeric_names])
+        self._ref_max = np.array([reference['numeric'][f]['max'] for f in self.numeric_names])
+        self._known = {f: set(reference['categorical'][f]) for f in self.categorical_names}
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget all traffic seen so far"""
+        with self._lock:
+            n = len(self.numeric_names)
+            self.count = 0
+            self.started_at = time.time()
+            self._bins = np.zeros((n, self._edges.shape[1] + 1), dtype=np.int64)
+            self._sum = np.zeros(n)
+            self._min = np.full(n, np.inf)
+            self._max = np.full(n, -np.inf)
+            self._out_of_range = np.zeros(n, dtype=np.int64)
+            self._cms = CountMinSketch()
+            self._unseen = {f: 0 for f in self.categorical_names}
+            self._unseen_top = {f: SpaceSaving() for f in self.categorical_names}
+
+    def update(self, numeric: Dict[str, float], categorical: Dict[str, str]) -> None:
+        """Add one request (raw feature values as built for the model)"""
+        x = np.array([float(numeric.get(f, np.nan)) for f in self.numeric_names])
+        seen = ~np.isnan(x)
+        bins = (x[:, None] >= self._edges).sum(axis=1)
+        rows = np.flatnonzero(seen)
+
+        with self._lock:
+            self.count += 1
+            self._bins[rows, bins[rows]] += 1
+            self._sum[rows] += x[rows]
+            self._min[rows] = np.minimum(self._min[rows], x[rows])
+            self._max[rows] = np.maximum(self._max[rows], x[rows])
+            self._out_of_range[rows] += (x[rows] < self._ref_min[rows]) | (x[rows] > self._ref_max[rows])
+
+            for f in self.categorical_names:
+                value = str(categorical.get(f, 'NA'))
+                self._cms.add(f"{f}\x1f{value}")
+                if value not in self._known[f]:
+                    self._unseen[f] += 1
+                    self._unseen_top[f].add(value)
+
+    def _live_quantiles(self, i: int, counts: np.ndarray) -> List[float]:
+        """Quantiles interpolated within the bins (outer bins bounded by the live min/max)"""
+        edges = self.reference['numeric'][self.numeric_names[i]]['edges']
+        bounds = np.concatenate([[self._min[i]], np.clip(edges, self._min[i], self._max[i]), [self._max[i]]])
+        cum = np.concatenate([[0], np.cumsum(counts)]) / counts.sum()
+        return [float(np.interp(q, cum, bounds)) for q in REPORT_QUANTILES]
+
+    def report(self) -> Dict[str, Any]:
+        """Per-feature drift against the reference, most drifted first"""
+        with self._lock:
+            numeric = {}
+            for i, name in enumerate(self.numeric_names):
+                ref = self.reference['numeric'][name]
+                counts = self._bins[i, :len(ref['edges']) + 1]
+                n = int(counts.sum())
+                entry = {'count': n, 'psi': None, 'status': drift_status(0.0, n),
+                         'reference_mean': ref['mean'], 'reference_range': [ref['min'], ref['max']],
+                         'reference_quantiles': ref['quantiles']}
+                if n:
+                    entry['psi'] = population_stability_index(ref['fractions'], counts / n)
+                    entry['status'] = drift_status(entry['psi'], n)
+                    entry.update({
+                        'mean': float(self._sum[i] / n),
+                        'range': [float(self._min[i]), float(self._max[i])],
+                        'quantiles': self._live_quantiles(i, counts),
+                        'out_of_range_fraction': float(self._out_of_range[i] / n)
+                    })
+                numeric[name] = entry
+
+            categorical = {}
+            for name in self.categorical_names:
+                ref = self.reference['categorical'][name]
+                n = self.count
+                entry = {'count': n, 'psi': None, 'status': drift_status(0.0, n), 'reference_shares': ref}
+                if n:
+                    shares = {k: min(self._cms.estimate(f"{name}\x1f{k}") / n, 1.0) for k in ref}
+                    unseen = self._unseen[name] / n
+                    entry['psi'] = population_stability_index(list(ref.values()) + [0.0],
+                                                              list(shares.values()) + [unseen])
+                    entry['status'] = drift_status(entry['psi'], n)
+                    entry.update({
+                        'shares': shares,
+                        'unseen_fraction': unseen,
+                        'top_unseen': self._unseen_top[name].top()
+                    })
+                categorical[name] = entry
+
+            count, started_at = self.count, self.started_at
+
+        # Each entry's status already uses its own sample count
+        ranked = sorted(
+            [(name, e['psi'], e['status']) for group in (numeric, categorical) for name, e in group.items()
+             if e['psi'] is not None],
+            key=lambda item: -item[1]
+        )
+        return {
+            'requests': count,
+            'since': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(started_at)),
+            'reference_samples': self.reference['n_samples'],
+            'thresholds': {'moderate': PSI_MODERATE, 'significant': PSI_SIGNIFICANT,
+                           'min_samples': DRIFT_MIN_SAMPLES},
+            'drifted': [{'feature': name, 'psi': psi, 'status': status}
+                        for name, psi, status in ranked if status in ('moderate', 'significant')],
+            'numeric': numeric,
+            'categorical': categorical
+        }
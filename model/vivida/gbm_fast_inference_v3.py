@@ -0,0 +1,484 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+gbm_fast_inference_v3.py
+
+Per-patient fast inference for grid evaluation (v3.0 models)
+
+Within one optimization only the treatment/dosage columns change between
+candidates; the patient-static features are identical. Tree ensembles are
+packed into flat node arrays once, then partially evaluated on the
+patient-static features: every split on a static feature is resolved and
+collapsed, leaving small trees that only branch on treatment-dependent
+features. All candidates are then evaluated against the specialized trees
+in one vectorized traversal.
+
+MLPRegressor bases are handled the same way at the first dense layer: the
+pre-activation contribution of the static inputs is computed once per
+patient and only the treatment-dependent columns are multiplied per
+candidate (IncrementalMLP).
+
+Supported: XGBRegressor (gbtree, reg:squarederror), GradientBoostingRegressor,
+RandomForestRegressor, ExtraTreesRegressor, MLPRegressor, and OutputColumn
+views (gbm_multi_output.py) of the multi-output ones. Anything else is
+evaluated with its own predict().
+"""
+
+import json
+from typing import Optional
+import numpy as np
+
+# ============================================================================
+# PACKED TREE ENSEMBLE
+# ============================================================================
+
+class PackedForest:
+    """
+    Additive tree ensemble in flat node arrays
+
+    prediction = init + scale * sum(leaf values over trees)
+
+    left/right are -1 for leaves. `strict` selects the split test:
+    x < threshold (XGBoost) or x <= threshold (scikit-learn). Inputs are
+    compared in float32 like both libraries do. `cover` (training weight
+    reaching each node) is only needed for attributions (PathTreeShap).
+    """
+
+    def __init__(self, feature, threshold, left, right, value, roots, init, scale, strict, cover=None):
+        self.feature = np.asarray(feature, dtype=np.int64)
+        self.threshold = np.asarray(threshold, dtype=np.float64)
+        self.left = np.asarray(left, dtype=np.int64)
+        self.right = np.asarray(right, dtype=np.int64)
+        self.value = np.asarray(value, dtype=np.float64)
+        self.roots = np.asarray(roots, dtype=np.int64)
+        self.init = np.asarray(init, dtype=np.float64)
+        self.scale = float(scale)
+        self.strict = bool(strict)
+        self.cover = None if cover is None else np.asarray(cover, dtype=np.float64)
+        self.depth = _max_depth(self.left, self.right, self.roots)
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.feature)
+
+    @property
+    def n_outputs(self) -> int:
+        return self.value.shape[1]
+
+    def _go_left(self, x, node):
+        if self.strict:
+            return x < self.threshold[node]
+        return x <= self.threshold[node]
+
+    def predict(self, X) -> np.ndarray:
+        """Predict all rows: (n,) for single output, (n, n_outputs) otherwise"""
+        Xf = np.asarray(X, dtype=np.float64).astype(np.float32).astype(np.float64)
+        n = Xf.shape[0]
+        rows = np.arange(n)[:, None]
+        idx = np.broadcast_to(self.roots, (n, len(self.roots))).copy()
+
+        for _ in range(self.depth):
+            left = self.left[idx]
+            internal = left >= 0
+            if not internal.any():
+                break
+            go_left = self._go_left(Xf[rows, self.feature[idx]], idx)
+            idx = np.where(internal, np.where(go_left, left, self.right[idx]), idx)
+
+        out = self.init + self.scale * self.value[idx].sum(axis=1)
+        return out[:, 0] if self.n_outputs == 1 else out
+
+    def output(self, column: int, offset: float = 0.0, factor: float = 1.0) -> 'PackedForest':
+        """Single-output forest predicting offset + factor * output `column` (shares the tree arrays)"""
+        return PackedForest(self.feature, self.threshold, self.left, self.right,
+                            factor * self.value[:, [column]], self.roots,
+                            offset + factor * self.init[[column]], self.scale, self.strict, cover=self.cover)
+
+    def specialize(self, x_row, static_mask) -> 'PackedForest':
+        """
+        Partially evaluate on fixed features
+
+        Args:
+            x_row: Full feature row; only the entries where static_mask is True are used
+            static_mask: Boolean mask over features that are fixed to x_row
+
+        Returns:
+            PackedForest that only splits on non-static features and gives the
+            same predictions as this forest for any row agreeing with x_row on
+            the static features
+        """
+        x = np.asarray(x_row, dtype=np.float64).astype(np.float32).astype(np.float64)
+        static_mask = np.asarray(static_mask, dtype=bool)
+        internal = self.left >= 0
+
+        def resolve(nodes):
+            # Follow static splits down to a leaf or a split on a dynamic feature
+            nodes = nodes.copy()
+            while True:
+                pending = internal[nodes] & static_mask[self.feature[nodes]]
+                if not pending.any():
+                    return nodes
+                at = nodes[pending]
+                go_left = self._go_left(x[self.feature[at]], at)
+                nodes[pending] = np.where(go_left, self.left[at], self.right[at])
+
+        # Trees that collapse to a single leaf are constants: fold them into init
+        new_roots = resolve(self.roots)
+        constant = ~internal[new_roots]
+        init = self.init + self.scale * self.value[new_roots[constant]].sum(axis=0)
+        new_roots = new_roots[~constant]
+
+        if not new_roots.size:
+            # Fully determined: a single zero leaf keeps the evaluator uniform
+            return PackedForest([0], [0.0], [-1], [-1], np.zeros((1, self.n_outputs)), [0],
+                                init, self.scale, self.strict,
+                                cover=None if self.cover is None else [1.0])
+
+        # Walk only the nodes reachable through dynamic splits
+        new_left = np.full(self.n_nodes, -1, dtype=np.int64)
+        new_right = np.full(self.n_nodes, -1, dtype=np.int64)
+        keep = np.zeros(self.n_nodes, dtype=bool)
+        frontier = np.unique(new_roots)
+        while frontier.size:
+            keep[frontier] = True
+            split = frontier[internal[frontier]]
+            new_left[split] = resolve(self.left[split])
+            new_right[split] = resolve(self.right[split])
+            frontier = np.unique(np.concatenate([new_left[split], new_right[split]]))
+            frontier = frontier[~keep[frontier]]
+
+        kept = np.flatnonzero(keep)
+        remap = np.full(self.n_nodes, -1, dtype=np.int64)
+        remap[kept] = np.arange(len(kept))
+        kept_internal = internal[kept]
+
+        return PackedForest(
+            feature=np.where(kept_internal, self.feature[kept], 0),
+            threshold=self.threshold[kept],
+            left=np.where(kept_internal, remap[new_left[kept]], -1),
+            right=np.where(kept_internal, remap[new_right[kept]], -1),
+            value=self.value[kept],
+            roots=remap[new_roots],
+            init=init,
+            scale=self.scale,
+            strict=self.strict,
+            cover=None if self.cover is None else self.cover[kept]
+        )
+
+def _max_depth(left, right, roots) -> int:
+    """Number of split levels (0 for stumps made of leaves only)"""
+    depth = 0
+    frontier = roots[left[roots] >= 0]
+    while frontier.size:
+        depth += 1
+        children = np.concatenate([left[frontier], right[frontier]])
+        frontier = children[left[children] >= 0]
+    return depth
+
+# ============================================================================
+# PACKING
+# ============================================================================
+
+def _concat_trees(trees, init, scale, strict) -> PackedForest:
+    """Concatenate per-tree (feature, threshold, left, right, value, cover) arrays"""
+    feature, threshold, left, right, value, cover, roots = [], [], [], [], [], [], []
+    offset = 0
+    for f, t, l, r, v, c in trees:
+        roots.append(offset)
+        feature.append(np.where(l >= 0, f, 0))
+        threshold.append(t)
+        left.append(np.where(l >= 0, l + offset, -1))
+        right.append(np.where(l >= 0, r + offset, -1))
+        value.append(v)
+        cover.append(c)
+        offset += len(f)
+
+    return PackedForest(np.concatenate(feature), np.concatenate(threshold),
+                        np.concatenate(left), np.concatenate(right),
+                        np.concatenate(value), roots, init, scale, strict,
+                        cover=np.concatenate(cover))
+
+def _sklearn_tree_arrays(estimator):
+    tree = estimator.tree_
+    return (tree.feature, tree.threshold, tree.children_left, tree.children_right,
+            tree.value.reshape(tree.node_count, -1), tree.weighted_n_node_samples)
+
+def _pack_sklearn_forest(model) -> PackedForest:
+    trees = [_sklearn_tree_arrays(est) for est in model.estimators_]
+    n_outputs = trees[0][4].shape[1]
+    return _concat_trees(trees, np.zeros(n_outputs), 1.0 / len(trees), strict=False)
+
+def _pack_sklearn_gbr(model) -> Optional[PackedForest]:
+    if model.init_ == 'zero':
+        init = np.zeros(1)
+    elif hasattr(model.init_, 'constant_'):
+        init = np.asarray(model.init_.constant_, dtype=np.float64).reshape(-1)
+    else:
+        return None
+    trees = [_sklearn_tree_arrays(est) for est in model.estimators_[:, 0]]
+    return _concat_trees(trees, init, model.learning_rate, strict=False)
+
+def _pack_xgboost(model) -> Optional[PackedForest]:
+    raw = json.loads(model.get_booster().save_raw(raw_format='json'))
+    learner = raw['learner']
+    booster = learner['gradient_booster']
+
+    if booster.get('name') != 'gbtree' or learner['objective']['name'] != 'reg:squarederror':
+        return None
+    if int(learner['learner_model_param'].get('num_target', 1)) > 1:
+        return None
+
+    base_score = float(str(learner['learner_model_param']['base_score']).strip('[]'))
+
+    trees = []
+    for tree in booster['model']['trees']:
+        left = np.asarray(tree['left_children'], dtype=np.int64)
+        right = np.asarray(tree['right_children'], dtype=np.int64)
+        # Leaf values are stored in split_conditions; thresholds are float32
+        cond = np.asarray(tree['split_conditions'], dtype=np.float32).astype(np.float64)
+        trees.append((np.asarray(tree['split_indices'], dtype=np.int64), cond, left, right,
+                      cond.reshape(-1, 1), np.asarray(tree['sum_hessian'], dtype=np.float64)))
+
+    return _concat_trees(trees, np.array([base_score]), 1.0, strict=True)
+
+def pack_tree_ensemble(model) -> Optional[PackedForest]:
+    """Pack a supported tree ensemble, or return None"""
+    name = type(model).__name__
+
+    if name == 'OutputColumn':
+        packed = pack_tree_ensemble(model.model)
+        return None if packed is None else packed.output(model.column, model.offset, model.factor)
+    if name in ('RandomForestRegressor', 'ExtraTreesRegressor'):
+        return _pack_sklearn_forest(model)
+    if name == 'GradientBoostingRegressor':
+        return _pack_sklearn_gbr(model)
+    if name == 'XGBRegressor':
+        return _pack_xgboost(model)
+    return None
+
+def _output_column(model):
+    """(model, column, offset, factor) of an OutputColumn; column is None for a plain model"""
+    if type(model).__name__ == 'OutputColumn':
+        return model.model, model.column, model.offset, model.factor
+    return model, None, 0.0, 1.0
+
+# ============================================================================
+# TREE SHAP (PATH-DEPENDENT)
+# ============================================================================
+
+class PathTreeShap:
+    """
+    Path-dependent TreeSHAP values of a single-output PackedForest
+
+    For a leaf with value v, each feature f split on along its root path has
+    Z_f = product of cover(child) / cover(parent) over the splits on f (the
+    share of training data following the path) and O_f = 1 if x follows all
+    of them, else 0. The leaf adds to feature f
+
+        v * (O_f - Z_f) * sum over S of |S|!(k-1-|S|)!/k! * prod_S O_i * prod_rest Z_i
+
+    (Lundberg et al. 2020, Algorithm 2, repeated features merged; k = distinct
+    features on the path). The Shapley weights are Beta integrals, so the sum
+    is integral_0^1 prod_{i != f} (Z_i + (O_i - Z_i) t) dt, a polynomial of
+    degree < k integrated exactly by ceil(k/2)-point Gauss-Legendre quadrature.
+
+    Paths, Z and the interval of x_f that follows the splits on f do not
+    depend on x and are built once, with leaves bucketed by k so that each
+    bucket is a dense (leaves, k) block. Explaining a row is an interval test
+    per (leaf, feature) pair plus a few array passes per bucket.
+    """
+
+    def __init__(self, forest: PackedForest, n_features: int):
+        if forest.cover is None or forest.n_outputs != 1:
+            raise ValueError("PathTreeShap needs a single-output PackedForest with node covers")
+        self.forest = forest
+        self.n_features = n_features
+        internal = forest.left >= 0
+
+        parent = np.full(forest.n_nodes, -1, dtype=np.int64)
+        is_left = np.zeros(forest.n_nodes, dtype=bool)
+        parent[forest.left[internal]] = np.flatnonzero(internal)
+        parent[forest.right[internal]] = np.flatnonzero(internal)
+        is_left[forest.left[internal]] = True
+
+        # Walk every leaf up to its root: one step per split on the path
+        leaves = np.flatnonzero(~internal)
+        step_leaf, step_node, step_left, step_logz = [], [], [], []
+        leaf_pos, node = np.arange(len(leaves)), leaves
+        while node.size:
+            up = parent[node]
+            has = up >= 0
+            leaf_pos, node, up = leaf_pos[has], node[has], up[has]
+            step_leaf.append(leaf_pos)
+            step_node.append(up)
+            step_left.append(is_left[node])
+            step_logz.append(np.log(np.maximum(forest.cover[node], 1e-12) / np.maximum(forest.cover[up], 1e-12)))
+            node = up
+        step_leaf = np.concatenate(step_leaf)
+        step_node = np.concatenate(step_node)
+        step_logz = np.concatenate(step_logz)
+
+        leaf_value = forest.value[leaves, 0] * forest.scale
+        leaf_log_share = np.bincount(step_leaf, step_logz, minlength=len(leaves))
+        self.expected_value = float(forest.init[0] + np.sum(leaf_value * np.exp(leaf_log_share)))
+
+        # Merge repeated features: one (leaf, feature) group per distinct split feature,
+        # ordered by (k, leaf) so that every k forms a dense block
+        groups, step_group = np.unique(step_leaf * n_features + forest.feature[step_node], return_inverse=True)
+        step_group = step_group.ravel()
+        group_leaf = groups // n_features
+        k_leaf = np.bincount(group_leaf, minlength=len(leaves))
+        order = np.lexsort((groups, k_leaf[group_leaf]))
+
+        # x follows every split on f along the path iff lower < x_f <= upper
+        # (lower <= x_f < upper for strict splits)
+        step_left = np.concatenate(step_left)
+        threshold = forest.threshold[step_node]
+        upper = np.full(len(groups), np.inf)
+        lower = np.full(len(groups), -np.inf)
+        np.minimum.at(upper, step_group[step_left], threshold[step_left])
+        np.maximum.at(lower, step_group[~step_left], threshold[~step_left])
+
+        self.n_groups = len(groups)
+        self.group_feature = (groups % n_features)[order].astype(np.int32)
+        self.group_lower = _float32_floor(lower[order])
+        self.group_upper = _float32_floor(upper[order])
+        self.group_z = np.exp(np.bincount(step_group, step_logz, minlength=len(groups)))[order]
+
+        self.buckets = []
+        group_k = k_leaf[group_leaf][order]
+        for k in np.unique(group_k):
+            begin, end = np.searchsorted(group_k, [k, k + 1])
+            t, w = np.polynomial.legendre.leggauss((int(k) + 1) // 2)
+            values = leaf_value[group_leaf[order[begin:end:k]]]
+            self.buckets.append((int(begin), int(end), int(k), (t + 1) / 2, w / 2, values))
+
+    def shap_values(self, x_row) -> np.ndarray:
+        """(n_features,) contributions; expected_value + sum == forest prediction"""
+        x = np.asarray(x_row, dtype=np.float64).astype(np.float32)
+        xf = x[self.group_feature]
+        if self.forest.strict:
+            o = ((xf >= self.group_lower) & (xf < self.group_upper)).astype(np.float64)
+        else:
+            o = ((xf > self.group_lower) & (xf <= self.group_upper)).astype(np.float64)
+
+        contribution = np.empty(self.n_groups)
+        for begin, end, k, t, w, values in self.buckets:
+            Z = self.group_z[begin:end].reshape(-1, k)
+            D = o[begin:end].reshape(-1, k) - Z
+            factor = t[:, None, None] * D[None]                     # (quadrature, leaves, k)
+            factor += Z[None]
+            others = np.divide(factor.prod(axis=2)[:, :, None], factor, out=factor)
+            weight = np.tensordot(w, others, axes=1)
+            contribution[begin:end] = (values[:, None] * D * weight).ravel()
+
+        return np.bincount(self.group_feature, contribution, minlength=self.n_features)
+
+def _float32_floor(a) -> np.ndarray:
+    """
+    Largest float32 <= a: float32 inputs compare the same with `<=` / `>`
+    against it as against a (strict xgboost thresholds are float32 already)
+    """
+    a = np.asarray(a, dtype=np.float64)
+    f = a.astype(np.float32)
+    return np.where(f.astype(np.float64) > a, np.nextafter(f, np.float32(-np.inf)), f)
+
+# ============================================================================
+# INCREMENTAL MLP
+# ============================================================================
+
+_MLP_ACTIVATIONS = {
+    'identity': lambda z: z,
+    'relu': lambda z: np.maximum(z, 0),
+    'tanh': np.tanh,
+    'logistic': lambda z: 1.0 / (1.0 + np.exp(-z))
+}
+
+class IncrementalMLP:
+    """
+    MLPRegressor with the static part of the first layer precomputed
+
+    first layer pre-activation = (x_static @ W0[static] + b0) + X[:, dyn] @ W0[dyn]
+
+    The bracketed term is computed once in __init__; predict() only pays for
+    the dynamic columns and the hidden layers. An OutputColumn of a
+    multi-output MLP predicts its one column, in target units.
+    """
+
+    def __init__(self, model, x_row, static_mask):
+        model, self.column, self.offset, self.factor = _output_column(model)
+        static_mask = np.asarray(static_mask, dtype=bool)
+        x = np.asarray(x_row, dtype=np.float64)
+        W0 = model.coefs_[0]
+
+        self.dynamic_idx = np.flatnonzero(~static_mask)
+        self.W0_dynamic = W0[self.dynamic_idx]
+        self.z0_static = x[static_mask] @ W0[static_mask] + model.intercepts_[0]
+        self.coefs = model.coefs_[1:]
+        self.intercepts = model.intercepts_[1:]
+        self.hidden = _MLP_ACTIVATIONS[model.activation]
+        self.output = _MLP_ACTIVATIONS[model.out_activation_]
+        self.n_outputs = model.n_outputs_
+
+    def predict(self, X) -> np.ndarray:
+        """Predict all rows: (n,) for single output, (n, n_outputs) otherwise"""
+        X = np.asarray(X, dtype=np.float64)
+        a = self.hidden(X[:, self.dynamic_idx] @ self.W0_dynamic + self.z0_static)
+
+        last = len(self.coefs) - 1
+        for i, (W, b) in enumerate(zip(self.coefs, self.intercepts)):
+            z = a @ W + b
+            a = self.output(z) if i == last else self.hidden(z)
+
+        if self.column is not None:
+            return self.offset + self.factor * a[:, self.column]
+        return a[:, 0] if self.n_outputs == 1 else a
+
+_MLP_DERIVATIVES = {
+    'identity': lambda z, a: np.ones_like(z),
+    'relu': lambda z, a: (z > 0).astype(z.dtype),
+    'tanh': lambda z, a: 1.0 - a ** 2,
+    'logistic': lambda z, a: a * (1.0 - a)
+}
+
+def mlp_integrated_gradients(model, x_row, baseline=None, steps: int = 64) -> np.ndarray:
+    """
+    Integrated-gradients attributions of a single-output MLPRegressor (or an
+    OutputColumn of a multi-output one)
+
+    Midpoint rule over `steps` points on the line from `baseline` (default:
+    zeros, the training mean of standardized inputs) to x_row; the result
+    sums to ~ f(x) - f(baseline).
+    """
+    model, column, _, factor = _output_column(model)
+    x = np.asarray(x_row, dtype=np.float64)
+    base = np.zeros_like(x) if baseline is None else np.asarray(baseline, dtype=np.float64)
+    alphas = (np.arange(steps) + 0.5) / steps
+    a = base[None, :] + alphas[:, None] * (x - base)[None, :]
+
+    # Forward pass keeping pre-activations and activations
+    layers = list(zip(model.coefs_, model.intercepts_))
+    last = len(layers) - 1
+    zs, activations = [], [a]
+    for i, (W, b) in enumerate(layers):
+        z = activations[-1] @ W + b
+        name = model.out_activation_ if i == last else model.activation
+        zs.append(z)
+        activations.append(_MLP_ACTIVATIONS[name](z))
+
+    # Backward pass to the inputs
+    grad = np.ones((steps, 1))
+    if column is not None:
+        grad = np.zeros((steps, model.n_outputs_))
+        grad[:, column] = factor
+    for i in range(last, -1, -1):
+        name = model.out_activation_ if i == last else model.activation
+        grad = (grad * _MLP_DERIVATIVES[name](zs[i], activations[i + 1])) @ layers[i][0].T
+
+    return (x - base) * grad.mean(axis=0)
+
+def supports_incremental_mlp(model) -> bool:
+    model = _output_column(model)[0]
+    return (type(model).__name__ == 'MLPRegressor'
+            and model.activation in _MLP_ACTIVATIONS
+            and model.out_activation_ in _MLP_ACTIVATIONS)
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Fast Gompertz fit for follow-up tumor measurements
+
+Bounded least-squares fit of V(t) = T0 * (K/T0)^(1 - exp(-r*t)), solved with
+a small projected Levenberg-Marquardt loop: two parameters with an analytic
+Jacobian, vectorized over patients. Used by the training script for all
+patients at once (scipy curve_fit only as a fallback for rows that do not
+converge) and at serving time to replace the r_fit/K_fit placeholders with a
+per-patient refit from observed follow-up volumes.
+"""
+
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from multiprocessing import get_context, get_all_start_methods
+from typing import Dict, Any, List, Optional, Tuple
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+R_BOUNDS = (1e-6, 0.5)      # same bounds as the training fit
+K_MAX = 20.0                # K in [T0, K_MAX]
+MIN_OBSERVATIONS = 3        # T0 + at least two follow-ups (as in training)
+LM_MAX_ITER = 100
+LM_TOL = 1e-10              # relative SSE improvement to stop at
+REFIT_CACHE_SIZE = 4096     # memoized per-request refits (keyed by the observations)
+R_START_GRID = np.geomspace(1e-3, R_BOUNDS[1], 24)  # r candidates of the log-linearized start
+FALLBACK_MAXFEV = 5000      # curve_fit budget for rows the batched fit does not converge on
+FALLBACK_POOL_MIN_ROWS = 64 # fewer fallback rows are fitted in-process
+# fork where available: spawned workers would re-run a calling script that has no __main__ guard
+FALLBACK_START_METHOD = 'fork' if 'fork' in get_all_start_methods() else 'spawn'
+FOLLOW_UP_COLUMNS = [('tumor_size_2m', 2), ('tumor_size_4m', 4), ('tumor_size_6m', 6), ('tumor_size_12m', 12)]
+
+# ============================================================================
+# MODEL
+# ============================================================================
+
+def gompertz_curve(t, T0, r, K):
+    """V(t) = T0 * (K/T0)^(1 - exp(-r*t))"""
+    return T0 * (K / T0) ** (1 - np.exp(-r * t))
+
+def _residuals_and_jacobian(p, t, y, T0, mask):
+    """Masked residuals and d(residual)/d(r, K), shapes (n, m) and (n, m, 2)"""
+    r, K = p[:, :1], p[:, 1:]
+    decay = np.exp(-r * t)
+    log_ratio = np.log(K / T0)
+    v = T0 * np.exp(log_ratio * (1 - decay))
+    res = np.where(mask, v - y, 0.0)
+    jac = np.stack([v * log_ratio * t * decay, v * (1 - decay) / K], axis=-1)
+    return res, np.where(mask[..., None], jac, 0.0)
+
+# ============================================================================
+# FIT
+# ============================================================================
+
+def loglinear_start(t: np.ndarray, y: np.ndarray, T0: np.ndarray) -> np.ndarray:
+    """
+    (n, 2) start points from the log-linearized model
+
+    log(V/T0) = c * (1 - exp(-r*t)) with c = log(K/T0) is linear in c for a
+    fixed r: c has a closed-form least-squares solution for every r in
+    R_START_GRID, and the best (r, c) pair in log space is kept. Where c
+    ends up at 0 (K = T0: a flat curve, r has no effect) r starts at its
+    lower bound, where curve_fit ends up for such rows.
+    """
+    mask = ~(np.isnan(t) | np.isnan(y)) & (y > 0)
+    z = np.where(mask, np.log(np.where(mask, y, 1.0) / T0[:, None]), 0.0)
+    g = 1 - np.exp(-R_START_GRID[None, :, None] * np.where(mask, t, 0.0)[:, None, :])
+    g *= mask[:, None, :]
+
+    c = np.einsum('ngm,nm->ng', g, z) / np.maximum(np.einsum('ngm,ngm->ng', g, g), 1e-300)
+    c = np.clip(c, 0.0, np.log(np.maximum(T0, K_MAX) / T0)[:, None])
+    sse = np.sum((c[:, :, None] * g - z[:, None, :]) ** 2, axis=2)
+    best = np.argmin(sse, axis=1)
+    c_best = c[np.arange(len(T0)), best]
+    return np.column_stack([np.where(c_best > 0, R_START_GRID[best], R_BOUNDS[0]), T0 * np.exp(c_best)])
+
+def fit_gompertz_batch(
+    times: np.ndarray,
+    sizes: np.ndarray,
+    T0: np.ndarray,
+    p0: Optional[np.ndarray] = None,
+    max_iter: int = LM_MAX_ITER,
+    tol: float = LM_TOL
+) -> Dict[str, np.ndarray]:
+    """
+    Fit (r, K) for n patients at once
+
+    Args:
+        times, sizes: (n, m) observation times (months) and volumes, NaN = missing
+                      (including the t=0 point, as curve_fit was given it)
+        T0: (n,) volume at t=0 (the curve passes through it by construction)
+        p0: (n, 2) warm start; default: loglinear_start()
+
+    Returns:
+        dict with 'r', 'K', 'rmse', 'iterations' and 'converged' arrays
+    """
+    t = np.asarray(times, dtype=float)
+    y = np.asarray(sizes, dtype=float)
+    T0 = np.asarray(T0, dtype=float)[:, None]
+    mask = ~(np.isnan(t) | np.isnan(y))
+    t, y = np.where(mask, t, 0.0), np.where(mask, y, 0.0)
+
+    lower = np.column_stack([np.full(len(T0), R_BOUNDS[0]), T0[:, 0]])
+    upper = np.column_stack([np.full(len(T0), R_BOUNDS[1]), np.maximum(T0[:, 0], K_MAX)])
+    if p0 is None:
+        p0 = loglinear_start(np.where(mask, t, np.nan), np.where(mask, y, np.nan), T0[:, 0])
+    p = np.clip(np.asarray(p0, dtype=float), lower, upper)
+
+    res, jac = _residuals_and_jacobian(p, t, y, T0, mask)
+    sse = np.sum(res ** 2, axis=1)
+    lam = np.full(len(T0), 1e-3)
+    active = np.ones(len(T0), dtype=bool)
+    iterations = np.zeros(len(T0), dtype=int)
+
+    for _ in range(max_iter):
+        # only the rows still iterating are computed
+        rows = np.flatnonzero(active)
+        if not rows.size:
+            break
+        pr, jr, rr, sr, lr = p[rows], jac[rows], res[rows], sse[rows], lam[rows]
+        lo, hi = lower[rows], upper[rows]
+
+        # Marquardt step on the 2x2 normal equations, solved in closed form
+        A = np.einsum('nmi,nmj->nij', jr, jr)
+        g = np.einsum('nmi,nm->ni', jr, rr)
+        a = A[:, 0, 0] * (1 + lr) + 1e-12
+        d = A[:, 1, 1] * (1 + lr) + 1e-12
+        b = A[:, 0, 1]
+        det = a * d - b * b
+        step = -np.column_stack([d * g[:, 0] - b * g[:, 1], a * g[:, 1] - b * g[:, 0]]) / det[:, None]
+
+        # a parameter pushed against its bound is held there; the other one gets the 1-D step
+        pinned = ((pr <= lo) & (step < 0)) | ((pr >= hi) & (step > 0))
+        step = np.where(pinned[:, [1]], np.column_stack([-g[:, 0] / a, np.zeros(len(a))]), step)
+        step = np.where(pinned[:, [0]], np.column_stack([np.zeros(len(a)), -g[:, 1] / d]), step)
+        step[pinned.all(axis=1)] = 0.0
+
+        trial = np.clip(pr + step, lo, hi)
+        res_t, jac_t = _residuals_and_jacobian(trial, t[rows], y[rows], T0[rows], mask[rows])
+        sse_t = np.sum(res_t ** 2, axis=1)
+
+        better = sse_t < sr
+        done = better & (sr - sse_t <= tol * (sr + tol))
+        # projected step vanished (e.g. K pinned at T0, where r has no effect)
+        done |= np.all(np.abs(trial - pr) <= tol * (np.abs(pr) + tol), axis=1)
+        iterations[rows] += 1
+
+        improved = rows[better]
+        p[improved], res[improved], jac[improved] = trial[better], res_t[better], jac_t[better]
+        sse[improved] = sse_t[better]
+        lam[rows] = np.where(better, lr / 3, lr * 4)
+        active[rows] = ~done & (lam[rows] < 1e10)
+
+    n_obs = np.maximum(mask.sum(axis=1), 1)
+    return {
+        'r': p[:, 0],
+        'K': p[:, 1],
+        'rmse': np.sqrt(sse / n_obs),
+        'iterations': iterations,
+        'converged': ~active
+    }
+
+def _curve_fit_row(job) -> Tuple[float, float, bool]:
+    """scipy curve_fit of one (times, sizes, T0, p0, maxfev) row: (r, K, success)"""
+    from scipy.optimize import curve_fit
+    t, y, T0, p0, maxfev = job
+    m = ~(np.isnan(t) | np.isnan(y))
+    try:
+        popt, _ = curve_fit(lambda tt, r, K: gompertz_curve(tt, T0, r, K), t[m], y[m], p0=p0,
+                            bounds=([R_BOUNDS[0], T0], [R_BOUNDS[1], max(T0, K_MAX)]), maxfev=maxfev)
+        return float(popt[0]), float(popt[1]), True
+    except (RuntimeError, ValueError):
+        return np.nan, np.nan, False
+
+def fit_gompertz_with_fallback(
+    times: np.ndarray,
+    sizes: np.ndarray,
+    T0: np.ndarray,
+    workers: Optional[int] = None,
+    maxfev: int = FALLBACK_MAXFEV,
+    max_iter: int = LM_MAX_ITER
+) -> Dict[str, np.ndarray]:
+    """
+    fit_gompertz_batch, then scipy curve_fit on the rows it did not converge on
+
+    The fallback starts from the batched fit's point and runs in a process
+    pool (`workers`, default all cores) when there are at least
+    FALLBACK_POOL_MIN_ROWS such rows. The lower-SSE result is kept. Adds a
+    'fallback' mask; 'converged' is False only where both fits failed.
+    """
+    T0 = np.asarray(T0, dtype=float)
+    fit = fit_gompertz_batch(times, sizes, T0, max_iter=max_iter)
+    fit['fallback'] = np.zeros(len(T0), dtype=bool)
+    rows = np.flatnonzero(~fit['converged'])
+    if not len(rows):
+        return fit
+
+    t, y = np.asarray(times, dtype=float), np.asarray(sizes, dtype=float)
+    jobs = [(t[i], y[i], T0[i], (fit['r'][i], fit['K'][i]), maxfev) for i in rows]
+    if len(rows) >= FALLBACK_POOL_MIN_ROWS and (workers or os.cpu_count() or 1) > 1:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context(FALLBACK_START_METHOD)) as pool:
+            results = list(pool.map(_curve_fit_row, jobs, chunksize=16))
+    else:
+        results = [_curve_fit_row(job) for job in jobs]
+
+    for i, (r, K, ok) in zip(rows, results):
+        if not ok:
+            continue
+        m = ~(np.isnan(t[i]) | np.isnan(y[i]))
+        sse = np.sum((gompertz_curve(t[i][m], T0[i], r, K) - y[i][m]) ** 2)
+        if sse <= (fit['rmse'][i] ** 2) * m.sum():
+            fit['r'][i], fit['K'][i], fit['rmse'][i] = r, K, np.sqrt(sse / m.sum())
+        fit['converged'][i] = fit['fallback'][i] = True
+    return fit
+
+def fit_gompertz_fast(times, sizes, T0: float, p0: Optional[Tuple[float, float]] = None) -> Tuple[float, float]:
+    """Single-patient fit; drop-in for fit_gompertz() (times/sizes include t=0)"""
+    fit = fit_gompertz_batch(
+        np.asarray(times, dtype=float)[None, :], np.asarray(sizes, dtype=float)[None, :],
+        np.array([T0], dtype=float), None if p0 is None else np.array([p0], dtype=float)
+    )
+    return float(fit['r'][0]), float(fit['K'][0])
+
+# ============================================================================
+# PATIENT FOLLOW-UPS
+# ============================================================================
+
+def follow_up_observations(patient: Dict[str, Any]) -> Tuple[List[float], List[float]]:
+    """
+    Observed follow-up (months, volume) pairs of a request, sorted by time
+
+    Accepts the training columns (tumor_size_2m ... tumor_size_12m) and/or a
+    `follow_up` list of {"months": 3, "tumor_size": 2.9} entries. Raises
+    ValueError for a missing or non-numeric value.
+    """
+    def number(value, what):
+        if isinstance(value, bool) or not isinstance(value, (int, float, np.integer, np.floating)):
+            raise ValueError(f"{what} must be a number, got {value!r}")
+        return float(value)
+
+    observations = {}
+    for col, t in FOLLOW_UP_COLUMNS:
+        if patient.get(col) is not None:
+            observations[float(t)] = number(patient[col], col)
+    entries = patient.get('follow_up') or []
+    if not isinstance(entries, list):
+        raise ValueError("follow_up must be a list of {months, tumor_size} entries")
+    for i, entry in enumerate(entries):
+        if not isinstance(entry, dict) or 'months' not in entry or 'tumor_size' not in entry:
+            raise ValueError(f"follow_up[{i}] must be an object with months and tumor_size")
+        observations[number(entry['months'], f"follow_up[{i}].months")] = \
+            number(entry['tumor_size'], f"follow_up[{i}].tumor_size")
+
+    for t, v in observations.items():
+        if not t > 0 or not v > 0:
+            raise ValueError(f"follow-up at {t} months must have months > 0 and tumor_size > 0")
+
+    times = sorted(observations)
+    return times, [observations[t] for t in times]
+
+def refit_from_follow_up(patient: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Per-patient Gompertz refit (r_fit, K_fit, n_obs) from follow-up scans
+
+    Returns None when the request has fewer than MIN_OBSERVATIONS points
+    (baseline included) or T0 >= K_MAX (no K within the bounds; training
+    leaves such patients unfitted too); the feature builder then keeps its
+    placeholders.
+    """
+    times, sizes = follow_up_observations(patient)
+    T0 = float(patient.get('tumor_size_before', 3.0))
+    if len(times) + 1 < MIN_OBSERVATIONS or not 0 < T0 < K_MAX:
+        return None
+    return dict(_refit(T0, tuple(times), tuple(sizes)))
+
+@lru_cache(maxsize=REFIT_CACHE_SIZE)
+def _refit(T0: float, times: Tuple[float, ...], sizes: Tuple[float, ...]) -> Dict[str, Any]:
+    fit = fit_gompertz_batch(
+        np.array([(0.0,) + times]), np.array([(T0,) + sizes]), np.array([T0])
+    )
+    return {
+        'r_fit': float(fit['r'][0]),
+        'K_fit': float(fit['K'][0]),
+        'n_obs': len(times) + 1,
+        'rmse': float(fit['rmse'][0]),
+        'iterations': int(fit['iterations'][0]),
+        'converged': bool(fit['converged'][0])
+    }
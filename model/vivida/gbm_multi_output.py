@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Base models shared by the four Gompertz-parameter targets
+
+Random forests, extra trees and MLPs fit several targets at once. Fitted on
+the standardized target matrix (so no target dominates the split criterion
+or the loss), one such model replaces the four per-target copies of that
+base model.
+
+OutputColumn presents one target's column of a shared model with the usual
+1-D predict(). The stacked-model layout {target: {'bases': [(name, model)],
+'meta': ...}} and everything that reads it stay as they are. The four
+columns reference the same fitted model, so it is pickled and loaded once.
+"""
+
+import numpy as np
+from typing import List, Tuple
+
+# ============================================================================
+# OUTPUT COLUMN
+# ============================================================================
+
+class OutputColumn:
+    """
+    One target of a multi-output regressor fitted on standardized targets
+
+    predict(X) = offset + factor * model.predict(X)[:, column]
+    """
+
+    def __init__(self, model, column: int, offset: float = 0.0, factor: float = 1.0):
+        self.model = model
+        self.column = int(column)
+        self.offset = float(offset)
+        self.factor = float(factor)
+
+    def predict(self, X) -> np.ndarray:
+        return self.offset + self.factor * self.model.predict(X)[:, self.column]
+
+# ============================================================================
+# FITTING
+# ============================================================================
+
+def fit_standardized(model, X, Y) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Fit `model` on the columns of Y standardized to mean 0, std 1
+
+    Returns:
+        (offset, factor) per column: predictions in target units are
+        offset + factor * model.predict(X)
+    """
+    Y = np.asarray(Y, dtype=np.float64)
+    offset = Y.mean(axis=0)
+    factor = Y.std(axis=0)
+    factor[factor == 0] = 1.0
+    model.fit(X, (Y - offset) / factor)
+    return offset, factor
+
+def output_columns(model, offset: np.ndarray, factor: np.ndarray) -> List[OutputColumn]:
+    """One OutputColumn per target of a model fitted by fit_standardized()"""
+    return [OutputColumn(model, i, o, f) for i, (o, f) in enumerate(zip(offset, factor))]
@@ -15,13 +15,24 @@ Compatible with models trained with gbm_train_models_enhanced_full_features.py
 
 import os
 import re
+import hashlib
+import threading
+from collections import OrderedDict
 import numpy as np
 import pandas as pd
-from typing import Dict, Any, Tuple
+from typing import Dict, Any, List, Tuple
 from joblib import load
 import json
 import warnings
 
+from gbm_fast_inference_v3 import (
+    pack_tree_ensemble, IncrementalMLP, supports_incremental_mlp,
+    PathTreeShap, mlp_integrated_gradients
+)
+from gbm_gompertz_fit import refit_from_follow_up
+from gbm_multi_output import OutputColumn
+from gbm_drift_monitor import DriftMonitor
+
 # Suppress sklearn warnings about feature names
 warnings.filterwarnings('ignore', category=UserWarning, module='sklearn')
 
@@ -32,6 +43,17 @@ MODEL_DIR = "gbm_models_output_all90_dosage_full_features"
 BASELINE_R = 0.12
 R_UNTREATED = 0.12
 SIM_MONTHS = 12
+PARAM_CACHE_SIZE = 50000  # predicted (r, K, alpha, beta) entries shared across requests
+SPECIALIZE_TREES = True   # per-patient partial evaluation of tree ensembles and the MLP first layer for grid batches
+SPECIALIZE_MIN_ROWS = 8   # smaller batches are cheaper to predict directly
+SIMILAR_PATIENTS_K = 5    # nearest training patients returned with an optimization
+ATTRIBUTION_TOP_K = 10    # features listed per parameter in attributions
+
+# Treatment schedules (schedule-aware simulation)
+DAYS_PER_MONTH = 30.4375
+CHEMO_DAYS_ON = 5         # TMZ: 5 days per cycle
+DEFAULT_CHEMO_CYCLES = 6
+DEFAULT_CHEMO_INTERVAL_DAYS = 28
 
 # ============================================================================
 # LOAD MODELS
@@ -49,9 +71,30 @@ with open(os.path.join(MODEL_DIR, "metadata.json"), "r") as f:
     BASELINE_R = metadata.get('baseline_r', BASELINE_R)
     R_UNTREATED = metadata.get('r_untreated', R_UNTREATED)
 
+# Identifies the loaded model artifacts (cache keys must not survive a retrain)
+_model_stat = os.stat(os.path.join(MODEL_DIR, "stacked_models.joblib"))
+MODEL_FINGERPRINT = f"{metadata.get('version', '2.3')}:{_model_stat.st_size}:{_model_stat.st_mtime_ns}"
+
+# Similar-patient index (optional: saved by training runs that build it)
+similar_index = None
+_similar_path = os.path.join(MODEL_DIR, "similar_patients.joblib")
+if os.path.exists(_similar_path):
+    similar_index = load(_similar_path)
+    SIMILAR_COLUMN_IDX = np.array([feature_columns.index(c) for c in similar_index['columns']])
+
+# Input-drift monitor (optional: needs the reference saved by training runs that build it)
+drift_monitor = None
+_drift_path = os.path.join(MODEL_DIR, "drift_reference.joblib")
+if os.path.exists(_drift_path):
+    drift_monitor = DriftMonitor(load(_drift_path))
+
 print(f"Loaded {len(feature_columns)} features")
 print(f"Model version: {metadata.get('version', '2.3')}")
 print(f"Full features: {metadata.get('full_features', False)}")
+if similar_index is not None:
+    print(f"Similar-patient index: {len(similar_index['patient_id'])} patients")
+if drift_monitor is not None:
+    print(f"Drift monitoring: {len(drift_monitor.numeric_names) + len(drift_monitor.categorical_names)} fields")
 
 # ============================================================================
 # PARSING FUNCTIONS
@@ -191,12 +234,64 @@ def extract_dosages_from_patient(patient: Dict[str, Any], treatment_string: str)
 # FEATURE BUILDING
 # ============================================================================
 
-def build_feature_vector(
+CATEGORICAL_FEATURES = ['gender', 'resection_extent', 'molecular_subtype',
+                        'tumor_location', 'contrast_enhancement', 'stage',
+                        'lateralization', 'rano_response']
+
+ENCODED_COLUMNS = [f"{cat}_{v}" for i, cat in enumerate(CATEGORICAL_FEATURES)
+                   for v in enc.categories_[i]]
+
+# Regimen-defining inputs (treatment flags, drugs, dosages)
+REGIMEN_FEATURES = [
+    'chemo', 'radio', 'beva', 'other_drug',
+    'chemo_dose_mg_per_m2', 'radio_total_Gy', 'radio_BED',
+    'drug_temozolomide', 'drug_lomustine', 'drug_carboplatin',
+    'drug_etoposide', 'drug_irinotecan', 'drug_bevacizumab'
+]
+
+# Every feature that changes with the regimen (REGIMEN_FEATURES + derived terms).
+# All remaining features are patient-static: identical for every candidate of a patient.
+TREATMENT_FEATURES = REGIMEN_FEATURES + [
+    'r_fit_x_chemo', 'r_fit_x_radio', 'K_fit_x_chemo', 'K_fit_x_radio',
+    'alpha_computed_x_chemo', 'beta_computed_x_radio',
+    'chemo_x_radio', 'chemo_x_tumor_size', 'radio_x_tumor_size',
+    'beva_x_chemo', 'kps_x_chemo', 'treatment_count',
+    'chemo_dose_x_tumor_size', 'chemo_dose_x_kps', 'chemo_dose_x_age',
+    'radio_BED_x_tumor_size', 'radio_BED_x_kps', 'radio_BED_x_age', 'chemo_dose_x_radio_BED',
+    'mgmt_x_chemo', 'mgmt_x_chemo_dose', 'idh_x_chemo', 'idh_x_radio', 'egfr_x_chemo',
+    'edema_x_chemo', 'edema_x_radio', 'steroid_x_chemo',
+    'symptom_count_x_chemo', 'symptom_count_x_radio',
+    'chemo_dose_squared', 'radio_BED_squared', 'chemo_dose_log', 'radio_BED_log'
+]
+
+REGIMEN_IDX = np.array([feature_columns.index(f) for f in REGIMEN_FEATURES if f in feature_columns])
+TREATMENT_IDX = np.array([feature_columns.index(f) for f in TREATMENT_FEATURES if f in feature_columns])
+STATIC_IDX = np.setdiff1d(np.arange(len(feature_columns)), TREATMENT_IDX)
+STATIC_MASK = np.isin(np.arange(len(feature_columns)), STATIC_IDX)
+
+# Multi-output bases fitted once for all targets, by id; the targets' OutputColumns read their columns
+shared_models = {id(m.model): m.model for model in stacked_models.values()
+                 for _, m in model['bases'] if isinstance(m, OutputColumn)}
+
+# Flat node arrays of the tree-based bases (None for other learners and OutputColumns);
+# a shared forest is packed once, with one output per target
+packed_bases = {target: [None if isinstance(m, OutputColumn) else pack_tree_ensemble(m) for name, m in model['bases']]
+                for target, model in stacked_models.items()}
+packed_shared = {key: pack_tree_ensemble(m) for key, m in shared_models.items()}
+
+def radio_bed(total_Gy: float, fractions: int) -> float:
+    """Biologically effective dose (alpha/beta = 10 Gy)"""
+    if total_Gy <= 0 or fractions <= 0:
+        return 0.0
+    d = total_Gy / fractions
+    return fractions * d * (1 + d / 10.0)
+
+def _numeric_features(
     patient: Dict[str, Any],
     treatment_string: str,
     dosages: Dict[str, float]
-) -> pd.Series:
-    """Build feature vector for ML model with ALL features"""
+) -> Dict[str, float]:
+    """Raw (unscaled) numeric features for one patient/regimen pair"""
 
     # Parse treatment flags
     flags = parse_treatment_flags(treatment_string)
@@ -204,8 +299,7 @@ def build_feature_vector(
     # Parse neurological symptoms
     neuro = parse_neurological_symptoms(patient)
 
-    # Build numeric features
-    numeric = {
+    return {
         # Original features
         'age': float(patient.get('age', 50)),
         'tumor_size_before': float(patient.get('tumor_size_before', 3.0)),
@@ -257,8 +351,9 @@ def build_feature_vector(
         'previous_radiation': int(patient.get('previous_radiation', 0))
     }
 
-    # Categorical features
-    categorical = {
+def _categorical_features(patient: Dict[str, Any]) -> Dict[str, str]:
+    """Raw categorical features for one patient"""
+    return {
         'gender': str(patient.get('gender', 'M')),
         'resection_extent': str(patient.get('resection_extent', 'subtotal')),
         'molecular_subtype': str(patient.get('molecular_subtype', 'classical')),
@@ -271,94 +366,194 @@ def build_feature_vector(
         'rano_response': str(patient.get('rano_response', 'stable_disease'))
     }
 
-    # OneHot encode categoricals
-    cat_df = pd.DataFrame([categorical])
-    enc_arr = enc.transform(cat_df)
-    enc_cols = [f"{cat}_{v}" for i, cat in enumerate(['gender', 'resection_extent', 'molecular_subtype',
-                                                        'tumor_location', 'contrast_enhancement', 'stage',
-                                                        'lateralization', 'rano_response'])
-                for v in enc.categories_[i]]
-    encoded = dict(zip(enc_cols, enc_arr[0]))
-
-    # Combine
-    combined = {**numeric, **encoded}
-
-    # Add fitted params placeholders
+def _patient_refits(patients: List[Dict[str, Any]]):
+    """Per-row (r_fit, K_fit, n_obs) refit from follow-up scans, or None if no row has any"""
+    fits = {}
+    for p in patients:
+        if id(p) not in fits:
+            fits[id(p)] = refit_from_follow_up(p)
+    if all(fit is None for fit in fits.values()):
+        return None
+
+    rows = [fits[id(p)] for p in patients]
+    r_fit = np.array([0.0 if fit is None else fit['r_fit'] for fit in rows])
+    K_fit = np.array([np.nan if fit is None else fit['K_fit'] for fit in rows])
+    n_obs = np.array([5 if fit is None else fit['n_obs'] for fit in rows])
+    return r_fit, K_fit, n_obs
+
+def _add_derived_features(combined: Dict[str, Any], refits=None) -> None:
+    """Add fitted parameters, interactions and non-linear terms (in place)
+
+    `combined` maps column names to arrays (or scalars for constant columns).
+    `refits` are per-row follow-up fits from _patient_refits(); rows without
+    one keep the placeholders (r=0, K=2*T0, n_obs=5).
+    """
+
+    # Fitted params (placeholders unless refit from follow-up scans)
     combined['r_fit'] = 0.0
-    combined['K_fit'] = numeric['tumor_size_before'] * 2.0
+    combined['K_fit'] = combined['tumor_size_before'] * 2.0
     combined['n_obs'] = 5
+    if refits is not None:
+        r_fit, K_fit, n_obs = refits
+        combined['r_fit'] = r_fit
+        combined['K_fit'] = np.where(np.isnan(K_fit), combined['K_fit'], K_fit)
+        combined['n_obs'] = n_obs
 
     # Add alpha/beta computed (will be predicted)
     combined['alpha_computed'] = 0.05
     combined['beta_computed'] = 0.03
 
     # Add interactions (same as in training)
-    T0 = numeric['tumor_size_before']
+    T0 = combined['tumor_size_before']
     K = combined['K_fit']
 
-    combined['r_fit_x_chemo'] = combined['r_fit'] * numeric['chemo']
-    combined['r_fit_x_radio'] = combined['r_fit'] * numeric['radio']
-    combined['K_fit_x_chemo'] = K * numeric['chemo']
-    combined['K_fit_x_radio'] = K * numeric['radio']
-    combined['alpha_computed_x_chemo'] = combined['alpha_computed'] * numeric['chemo']
-    combined['beta_computed_x_radio'] = combined['beta_computed'] * numeric['radio']
-
-    combined['chemo_x_radio'] = numeric['chemo'] * numeric['radio']
-    combined['chemo_x_tumor_size'] = numeric['chemo'] * T0
-    combined['radio_x_tumor_size'] = numeric['radio'] * T0
-    combined['beva_x_chemo'] = numeric['beva'] * numeric['chemo']
-    combined['kps_x_chemo'] = numeric['kps'] * numeric['chemo']
-    combined['treatment_count'] = numeric['chemo'] + numeric['radio'] + numeric['beva']
-
-    combined['chemo_dose_x_tumor_size'] = numeric['chemo_dose_mg_per_m2'] * T0
-    combined['chemo_dose_x_kps'] = numeric['chemo_dose_mg_per_m2'] * numeric['kps']
-    combined['chemo_dose_x_age'] = numeric['chemo_dose_mg_per_m2'] * numeric['age']
-    combined['radio_BED_x_tumor_size'] = numeric['radio_BED'] * T0
-    combined['radio_BED_x_kps'] = numeric['radio_BED'] * numeric['kps']
-    combined['radio_BED_x_age'] = numeric['radio_BED'] * numeric['age']
-    combined['chemo_dose_x_radio_BED'] = numeric['chemo_dose_mg_per_m2'] * numeric['radio_BED']
+    combined['r_fit_x_chemo'] = combined['r_fit'] * combined['chemo']
+    combined['r_fit_x_radio'] = combined['r_fit'] * combined['radio']
+    combined['K_fit_x_chemo'] = K * combined['chemo']
+    combined['K_fit_x_radio'] = K * combined['radio']
+    combined['alpha_computed_x_chemo'] = combined['alpha_computed'] * combined['chemo']
+    combined['beta_computed_x_radio'] = combined['beta_computed'] * combined['radio']
+
+    combined['chemo_x_radio'] = combined['chemo'] * combined['radio']
+    combined['chemo_x_tumor_size'] = combined['chemo'] * T0
+    combined['radio_x_tumor_size'] = combined['radio'] * T0
+    combined['beva_x_chemo'] = combined['beva'] * combined['chemo']
+    combined['kps_x_chemo'] = combined['kps'] * combined['chemo']
+    combined['treatment_count'] = combined['chemo'] + combined['radio'] + combined['beva']
+
+    combined['chemo_dose_x_tumor_size'] = combined['chemo_dose_mg_per_m2'] * T0
+    combined['chemo_dose_x_kps'] = combined['chemo_dose_mg_per_m2'] * combined['kps']
+    combined['chemo_dose_x_age'] = combined['chemo_dose_mg_per_m2'] * combined['age']
+    combined['radio_BED_x_tumor_size'] = combined['radio_BED'] * T0
+    combined['radio_BED_x_kps'] = combined['radio_BED'] * combined['kps']
+    combined['radio_BED_x_age'] = combined['radio_BED'] * combined['age']
+    combined['chemo_dose_x_radio_BED'] = combined['chemo_dose_mg_per_m2'] * combined['radio_BED']
 
     # NEW: Genetic × treatment interactions
-    combined['mgmt_x_chemo'] = numeric['mgmt_methylation'] * numeric['chemo']
-    combined['mgmt_x_chemo_dose'] = numeric['mgmt_methylation'] * numeric['chemo_dose_mg_per_m2']
-    combined['idh_x_chemo'] = numeric['idh_mutation'] * numeric['chemo']
-    combined['idh_x_radio'] = numeric['idh_mutation'] * numeric['radio']
-    combined['egfr_x_chemo'] = numeric['egfr_amplification'] * numeric['chemo']
+    combined['mgmt_x_chemo'] = combined['mgmt_methylation'] * combined['chemo']
+    combined['mgmt_x_chemo_dose'] = combined['mgmt_methylation'] * combined['chemo_dose_mg_per_m2']
+    combined['idh_x_chemo'] = combined['idh_mutation'] * combined['chemo']
+    combined['idh_x_radio'] = combined['idh_mutation'] * combined['radio']
+    combined['egfr_x_chemo'] = combined['egfr_amplification'] * combined['chemo']
 
     # NEW: Clinical × treatment interactions
-    combined['edema_x_chemo'] = numeric['edema_volume'] * numeric['chemo']
-    combined['edema_x_radio'] = numeric['edema_volume'] * numeric['radio']
-    combined['steroid_x_chemo'] = numeric['steroid_dose'] * numeric['chemo']
-    combined['symptom_count_x_chemo'] = numeric['symptom_count'] * numeric['chemo']
-    combined['symptom_count_x_radio'] = numeric['symptom_count'] * numeric['radio']
+    combined['edema_x_chemo'] = combined['edema_volume'] * combined['chemo']
+    combined['edema_x_radio'] = combined['edema_volume'] * combined['radio']
+    combined['steroid_x_chemo'] = combined['steroid_dose'] * combined['chemo']
+    combined['symptom_count_x_chemo'] = combined['symptom_count'] * combined['chemo']
+    combined['symptom_count_x_radio'] = combined['symptom_count'] * combined['radio']
 
     # Non-linear terms
-    combined['age_squared'] = numeric['age'] ** 2
+    combined['age_squared'] = combined['age'] ** 2
     combined['tumor_size_squared'] = T0 ** 2
     combined['tumor_size_log'] = np.log1p(T0)
     combined['r_fit_squared'] = combined['r_fit'] ** 2
     combined['K_fit_log'] = np.log1p(K)
-    combined['chemo_dose_squared'] = numeric['chemo_dose_mg_per_m2'] ** 2
-    combined['radio_BED_squared'] = numeric['radio_BED'] ** 2
-    combined['chemo_dose_log'] = np.log1p(numeric['chemo_dose_mg_per_m2'])
-    combined['radio_BED_log'] = np.log1p(numeric['radio_BED'])
+    combined['chemo_dose_squared'] = combined['chemo_dose_mg_per_m2'] ** 2
+    combined['radio_BED_squared'] = combined['radio_BED'] ** 2
+    combined['chemo_dose_log'] = np.log1p(combined['chemo_dose_mg_per_m2'])
+    combined['radio_BED_log'] = np.log1p(combined['radio_BED'])
 
     # NEW: Non-linear for new features
-    combined['edema_squared'] = numeric['edema_volume'] ** 2
-    combined['steroid_squared'] = numeric['steroid_dose'] ** 2
-    combined['symptom_count_squared'] = numeric['symptom_count'] ** 2
+    combined['edema_squared'] = combined['edema_volume'] ** 2
+    combined['steroid_squared'] = combined['steroid_dose'] ** 2
+    combined['symptom_count_squared'] = combined['symptom_count'] ** 2
+
+def build_feature_matrix(
+    patients: List[Dict[str, Any]],
+    treatment_strings: List[str],
+    dosages_list: List[Dict[str, float]]
+) -> pd.DataFrame:
+    """Build scaled feature matrix for a batch of patient/regimen rows"""
+    n = len(patients)
+    numeric = pd.DataFrame([_numeric_features(p, t, d)
+                            for p, t, d in zip(patients, treatment_strings, dosages_list)])
+
+    # OneHot encode categoricals (one encoder call for the whole batch)
+    cat_df = pd.DataFrame([_categorical_features(p) for p in patients])
+    encoded = enc.transform(cat_df)
+
+    # Columns as plain arrays (encoded columns win on duplicate names)
+    combined = {name: numeric[name].to_numpy() for name in numeric.columns}
+    combined.update({name: encoded[:, i] for i, name in enumerate(ENCODED_COLUMNS)})
+    _add_derived_features(combined, _patient_refits(patients))
+
+    # All features in correct order (missing ones are 0)
+    values = np.empty((n, len(feature_columns)))
+    for j, name in enumerate(feature_columns):
+        values[:, j] = combined.get(name, 0.0)
 
-    # Ensure all features exist
-    for feat in feature_columns:
-        if feat not in combined:
-            combined[feat] = 0.0
+    # Scale
+    scaled = scaler.transform(values)
+    return pd.DataFrame(scaled, columns=feature_columns)
+
+def build_feature_vector(
+    patient: Dict[str, Any],
+    treatment_string: str,
+    dosages: Dict[str, float]
+) -> pd.Series:
+    """Build feature vector for ML model with ALL features"""
+    return build_feature_matrix([patient], [treatment_string], [dosages]).iloc[0]
 
-    # Create series in correct order
-    feat_series = pd.Series([combined.get(f, 0.0) for f in feature_columns], index=feature_columns)
+# ============================================================================
+# PARAMETER CACHE
+# ============================================================================
 
-    # Scale
-    scaled = scaler.transform(feat_series.values.reshape(1, -1))
-    return pd.Series(scaled[0], index=feature_columns)
+class ParamCache:
+    """
+    Thread-safe LRU memo of predicted Gompertz parameters
+
+    Key: (hash of the patient-static features, regimen tuple, model fingerprint).
+    Shared across requests, so re-optimizing a patient with a different or
+    overlapping search space only predicts the candidates not seen before.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key_for_row(row: np.ndarray) -> Tuple:
+        static_hash = hashlib.blake2b(np.ascontiguousarray(row[STATIC_IDX]).tobytes(), digest_size=16).digest()
+        return static_hash, tuple(row[REGIMEN_IDX].tolist()), MODEL_FINGERPRINT
+
+    def get(self, key) -> Any:
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0
+            }
+
+param_cache = ParamCache(PARAM_CACHE_SIZE)
 
 # ============================================================================
 # PREDICTION
@@ -366,28 +561,290 @@ def build_feature_vector(
 
 def predict_params_from_features_row(feat_row: pd.Series) -> Dict[str, float]:
     """Predict Gompertz parameters from feature vector"""
-    X_input = feat_row.values.reshape(1, -1)
+    params = predict_params_batch(feat_row.values.reshape(1, -1))
+    return {name: float(values[0]) for name, values in params.items()}
+
+def predict_params_batch(X, use_cache: bool = True, evaluators=None) -> Dict[str, np.ndarray]:
+    """Predict Gompertz parameters for every row of a scaled feature matrix
+
+    Rows already in the shared parameter cache are not re-predicted.
+    `evaluators` from specialize_bases() may be passed when every row
+    shares the static features they were specialized to.
+    """
+    X_input = np.asarray(X, dtype=float)
+    n = X_input.shape[0]
+    out = np.empty((n, 4))
+
+    if use_cache:
+        keys = [ParamCache.key_for_row(row) for row in X_input]
+        cached = [param_cache.get(k) for k in keys]
+        missing = [i for i, v in enumerate(cached) if v is None]
+        for i, v in enumerate(cached):
+            if v is not None:
+                out[i] = v
+    else:
+        missing = list(range(n))
+
+    if missing:
+        X_miss = X_input[missing]
+        if evaluators is None and (SPECIALIZE_TREES and len(missing) >= SPECIALIZE_MIN_ROWS
+                and np.all(X_miss[:, STATIC_IDX] == X_miss[0, STATIC_IDX])):
+            evaluators = specialize_bases(X_miss[0])
+
+        base_preds = _base_predictions(X_miss, evaluators)
+        out[missing] = np.column_stack([stacked_models[target]['meta'].predict(base_preds[target])
+                                        for target in ('r_target', 'K_target', 'alpha_target', 'beta_target')])
+        if use_cache:
+            for i in missing:
+                param_cache.put(keys[i], out[i].copy())
+
+    return {
+        'r': out[:, 0],
+        'K': out[:, 1],
+        'alpha': out[:, 2],
+        'beta': out[:, 3]
+    }
 
-    r_pred = _predict_single_target(X_input, 'r_target')
-    K_pred = _predict_single_target(X_input, 'K_target')
-    alpha_pred = _predict_single_target(X_input, 'alpha_target')
-    beta_pred = _predict_single_target(X_input, 'beta_target')
+def specialize_bases(x_row: np.ndarray) -> Dict[str, List[Any]]:
+    """
+    Specialize the bases to one patient's static features
+
+    Returns {'bases': per target a list aligned with the bases, 'shared':
+    per shared model id}, each entry a specialized PackedForest, an
+    IncrementalMLP, or None where the model is evaluated with predict().
+    Target bases that are OutputColumns are None: their shared model is
+    specialized once.
+    """
+    def specialize(m, packed):
+        if packed is not None:
+            return packed.specialize(x_row, STATIC_MASK)
+        if supports_incremental_mlp(m):
+            return IncrementalMLP(m, x_row, STATIC_MASK)
+        return None
 
     return {
-        'r': float(r_pred),
-        'K': float(K_pred),
-        'alpha': float(alpha_pred),
-        'beta': float(beta_pred)
+        'bases': {target: [None if isinstance(m, OutputColumn) else specialize(m, packed)
+                           for (name, m), packed in zip(model['bases'], packed_bases[target])]
+                  for target, model in stacked_models.items()},
+        'shared': {key: specialize(m, packed_shared[key]) for key, m in shared_models.items()}
     }
 
-def _predict_single_target(X_input, target):
-    """Predict single target using stacking"""
-    model = stacked_models[target]
-    bases = model['bases']
-    meta = model['meta']
+def predict_params_samples(
+    X,
+    n_samples: int,
+    method: str = 'dispersion',
+    seed: int = None,
+    evaluators=None
+) -> Dict[str, np.ndarray]:
+    """
+    Sample Gompertz parameters for every row from the spread of the base models
+
+    Methods:
+        dispersion: stacked prediction + N(0, 1) x the spread of the base
+                    predictions around their |meta weight|-weighted mean
+        bootstrap:  meta-model applied to base predictions resampled with
+                    replacement
+
+    The same random draws are used for every row (common random numbers),
+    so rows can be compared sample by sample.
+
+    Returns:
+        {'r': (n_rows, n_samples), 'K': ..., 'alpha': ..., 'beta': ...}
+    """
+    X_input = np.asarray(X, dtype=float)
+    rng = np.random.default_rng(seed)
+    all_base_preds = _base_predictions(X_input, evaluators)
+    out = {}
+
+    for name, target in (('r', 'r_target'), ('K', 'K_target'),
+                         ('alpha', 'alpha_target'), ('beta', 'beta_target')):
+        meta = stacked_models[target]['meta']
+        base_preds = all_base_preds[target]
+        n_rows, n_bases = base_preds.shape
+
+        if method == 'dispersion':
+            w = np.abs(np.ravel(meta.coef_)) if hasattr(meta, 'coef_') else np.ones(n_bases)
+            w = w / w.sum()
+            center = base_preds @ w
+            spread = np.sqrt(((base_preds - center[:, None]) ** 2) @ w)
+            z = rng.standard_normal(n_samples)
+            out[name] = meta.predict(base_preds)[:, None] + spread[:, None] * z[None, :]
+        elif method == 'bootstrap':
+            idx = rng.integers(0, n_bases, size=(n_samples, n_bases))
+            resampled = base_preds[:, idx].reshape(-1, n_bases)
+            out[name] = meta.predict(resampled).reshape(n_rows, n_samples)
+        else:
+            raise ValueError(f"Unknown sampling method '{method}' (use 'dispersion' or 'bootstrap')")
+
+    return out
+
+def _base_predictions(X_input, evaluators=None, targets=None) -> Dict[str, np.ndarray]:
+    """
+    (n_rows, n_bases) predictions of each target's base models (default: all targets)
+
+    Every shared multi-output model is predicted once and its columns are
+    handed to the targets' OutputColumns.
+    """
+    targets = list(stacked_models) if targets is None else targets
+    shared_out = {}
+    out = {}
+    for target in targets:
+        bases = stacked_models[target]['bases']
+        fast = evaluators['bases'][target] if evaluators else [None] * len(bases)
+        columns = []
+        for (name, m), f in zip(bases, fast):
+            if isinstance(m, OutputColumn):
+                key = id(m.model)
+                if key not in shared_out:
+                    shared_fast = evaluators['shared'][key] if evaluators else None
+                    shared_out[key] = shared_fast.predict(X_input) if shared_fast is not None else m.model.predict(X_input)
+                columns.append(m.offset + m.factor * shared_out[key][:, m.column])
+            else:
+                columns.append(f.predict(X_input) if f is not None else m.predict(X_input))
+        out[target] = np.column_stack(columns)
+    return out
 
-    base_preds = np.array([m.predict(X_input)[0] for name, m in bases]).reshape(1, -1)
-    return meta.predict(base_preds)[0]
+# ============================================================================
+# SIMILAR PATIENTS
+# ============================================================================
+
+def find_similar_patients(x_row: np.ndarray, k: int = SIMILAR_PATIENTS_K) -> List[Dict[str, Any]]:
+    """
+    k nearest training patients to a scaled feature row (any candidate row
+    of the patient: only patient-descriptive columns are compared)
+
+    Returns [] when the model directory has no similar-patient index.
+    """
+    if similar_index is None or k <= 0:
+        return []
+
+    x = np.asarray(x_row, dtype=float)[SIMILAR_COLUMN_IDX]
+    dist, idx = similar_index['tree'].query(x[None, :], k=min(k, len(similar_index['patient_id'])))
+
+    neighbours = []
+    for d, i in zip(dist[0], idx[0]):
+        volumes = similar_index['trajectories'][i]
+        neighbours.append({
+            'patient_id': similar_index['patient_id'][i],
+            'distance': float(d),
+            **similar_index['info'][i],
+            'trajectory': {
+                'months': similar_index['trajectory_months'],
+                'volume': [None if np.isnan(v) else float(v) for v in volumes]
+            }
+        })
+    return neighbours
+
+# ============================================================================
+# DRIFT MONITORING
+# ============================================================================
+
+def record_drift(patient: Dict[str, Any]) -> None:
+    """Add a request's patient features to the drift sketches (no-op without a reference)"""
+    if drift_monitor is None:
+        return
+    treatment = str(patient.get('treatment', ''))
+    numeric = _numeric_features(patient, treatment, extract_dosages_from_patient(patient, treatment))
+    drift_monitor.update(numeric, _categorical_features(patient))
+
+# ============================================================================
+# ATTRIBUTION
+# ============================================================================
+
+PARAM_TARGETS = (('r', 'r_target'), ('K', 'K_target'), ('alpha', 'alpha_target'), ('beta', 'beta_target'))
+
+# Serving fills these with fixed values (see _add_derived_features), so their
+# attributions say how far the placeholder is from the training mean, not
+# anything about the patient; they are kept out of the ranking
+PLACEHOLDER_FEATURES = ('alpha_computed', 'beta_computed', 'alpha_computed_x_chemo', 'beta_computed_x_radio')
+REFIT_PLACEHOLDER_FEATURES = ('r_fit', 'K_fit', 'n_obs', 'r_fit_x_chemo', 'r_fit_x_radio',
+                              'K_fit_x_chemo', 'K_fit_x_radio', 'r_fit_squared', 'K_fit_log')
+
+def _explained_forests(target: str) -> List[Any]:
+    """The target's packed forests, with its single-output column of each shared forest"""
+    forests = []
+    for (name, m), packed in zip(stacked_models[target]['bases'], packed_bases[target]):
+        if isinstance(m, OutputColumn) and packed_shared[id(m.model)] is not None:
+            packed = packed_shared[id(m.model)].output(m.column, m.offset, m.factor)
+        forests.append(packed)
+    return forests
+
+_explainers = None
+_explainers_lock = threading.Lock()
+
+def _get_explainers() -> Dict[str, List[Any]]:
+    """Per target, a PathTreeShap per tree base (None for other bases); built on first use"""
+    global _explainers
+    with _explainers_lock:
+        if _explainers is None:
+            _explainers = {
+                target: [PathTreeShap(packed, len(feature_columns))
+                         if packed is not None and packed.cover is not None and packed.n_outputs == 1 else None
+                         for packed in _explained_forests(target)]
+                for target in stacked_models
+            }
+    return _explainers
+
+def explain_params(
+    x_row: np.ndarray,
+    top_k: int = ATTRIBUTION_TOP_K,
+    refitted: bool = False
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Feature attributions of the predicted (r, K, alpha, beta) for one scaled row
+
+    Tree bases are explained with exact path-dependent TreeSHAP, the MLP base
+    with integrated gradients from the all-zero (training mean) row; both are
+    combined with the linear meta-model's weights, so per parameter
+    base_value + sum of all contributions == prediction (up to `residual`,
+    the integration error of the MLP term or an unexplained base).
+
+    Placeholder features (PLACEHOLDER_FEATURES, plus REFIT_PLACEHOLDER_FEATURES
+    unless the row was `refitted` from follow-up scans) are not ranked; their
+    summed contribution is reported as placeholder_features.
+
+    Returns per parameter: prediction, base_value, the top_k contributions
+    ({feature, value (unscaled), contribution}, by |contribution|),
+    other_features (sum of the other ranked features), placeholder_features
+    and residual.
+    """
+    x = np.asarray(x_row, dtype=float)
+    raw = x * scaler.scale_ + scaler.mean_
+    explainers = _get_explainers()
+    placeholders = set(PLACEHOLDER_FEATURES) | (set() if refitted else set(REFIT_PLACEHOLDER_FEATURES))
+    ranked = np.array([f not in placeholders for f in feature_columns])
+    out = {}
+
+    for name, target in PARAM_TARGETS:
+        meta = stacked_models[target]['meta']
+        weights = np.ravel(meta.coef_)
+        base_value = float(np.ravel(meta.intercept_)[0])
+        phi = np.zeros(len(feature_columns))
+
+        for (base_name, m), explainer, w in zip(stacked_models[target]['bases'], explainers[target], weights):
+            if explainer is not None:
+                base_value += w * explainer.expected_value
+                phi += w * explainer.shap_values(x)
+            elif supports_incremental_mlp(m):
+                base_value += w * float(m.predict(np.zeros((1, len(x))))[0])
+                phi += w * mlp_integrated_gradients(m, x)
+            else:
+                # Unexplained base: its deviation from the mean row ends up in the residual
+                base_value += w * float(m.predict(np.zeros((1, len(x))))[0])
+
+        prediction = float(meta.predict(_base_predictions(x[None, :], targets=[target])[target])[0])
+        order = np.argsort(-np.abs(phi), kind='stable')
+        top = order[ranked[order]][:max(top_k, 0)]
+        out[name] = {
+            'prediction': prediction,
+            'base_value': base_value,
+            'contributions': [{'feature': feature_columns[j], 'value': float(raw[j]),
+                               'contribution': float(phi[j])} for j in top],
+            'other_features': float(phi[ranked].sum() - phi[top].sum()),
+            'placeholder_features': float(phi[~ranked].sum()),
+            'residual': prediction - base_value - float(phi.sum())
+        }
+    return out
 
 # ============================================================================
 # SIMULATION
@@ -418,6 +875,273 @@ def simulate_gompertz_with_treatment(
 
     return float(V[-1]), V
 
+def simulate_gompertz_batch(
+    T0,
+    params: Dict[str, np.ndarray],
+    chemo,
+    radio,
+    months: int = 12,
+    dt: float = 0.01
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Simulate Gompertz growth with treatment for many candidates at once
+
+    Same Euler scheme as simulate_gompertz_with_treatment, vectorized across
+    candidates (one row per candidate). T0, chemo and radio may be scalars or
+    per-candidate arrays.
+    """
+    r = np.asarray(params['r'], dtype=float)
+    n = r.shape[0]
+    K = np.asarray(params['K'], dtype=float)
+    alpha = np.asarray(params['alpha'], dtype=float)
+    beta = np.asarray(params['beta'], dtype=float)
+    chemo = np.broadcast_to(np.asarray(chemo, dtype=float), (n,))
+    radio = np.broadcast_to(np.asarray(radio, dtype=float), (n,))
+
+    T0 = np.maximum(np.broadcast_to(np.asarray(T0, dtype=float), (n,)), 0.1)
+    K = np.maximum(K, T0 * 1.1)
+
+    t_steps = int(months / dt)
+    V = np.zeros((n, t_steps))
+    V[:, 0] = T0
+
+    # Loop invariants (same operation order as the scalar version)
+    chemo_kill = alpha * chemo
+    radio_kill = beta * radio
+
+    for i in range(1, t_steps):
+        V_curr = np.maximum(V[:, i-1], 0.01)
+        dV = r * V_curr * np.log(K / V_curr) - chemo_kill * V_curr - radio_kill * V_curr
+        np.maximum(V_curr + dV * dt, 0.01, out=V[:, i])
+
+    return V[:, -1].copy(), V
+
+def horizon_index(months: float, dt: float = 0.01) -> int:
+    """Curve index of the volume reported at `months` (last Euler sample)"""
+    return int(months / dt) - 1
+
+def simulate_gompertz_horizons(
+    T0,
+    params: Dict[str, np.ndarray],
+    chemo,
+    radio,
+    horizons: List[float],
+    curve_points: int = 0,
+    dt: float = 0.01
+) -> Dict[str, np.ndarray]:
+    """Volumes at several horizons from one batch simulation
+
+    Simulates up to the longest horizon once and reads every horizon off the
+    same curve, so the volume at h months is identical to simulating with
+    months=h. The AUC (cm3 x months, trapezoidal) covers the longest horizon.
+
+    Returns:
+        {'volumes': (n, len(horizons)), 'auc': (n,)} plus, with curve_points,
+        'curve_t' (curve_points,) and 'curve' (n, curve_points) downsampled
+        evenly over the simulated span
+    """
+    idx = [horizon_index(h, dt) for h in horizons]
+    if min(idx) < 0:
+        raise ValueError(f"horizons must be at least {dt} months")
+
+    _, V = simulate_gompertz_batch(T0, params, chemo, radio, months=max(horizons), dt=dt)
+    last = max(idx)
+    auc = dt * (V[:, :last + 1].sum(axis=1) - 0.5 * (V[:, 0] + V[:, last]))
+
+    out = {'volumes': V[:, idx], 'auc': auc}
+    if curve_points:
+        points = np.unique(np.linspace(0, last, curve_points).round().astype(int))
+        out['curve_t'] = (points * dt).round(6)
+        out['curve'] = V[:, points]
+    return out
+
+def gompertz_final_volume(
+    T0,
+    params: Dict[str, np.ndarray],
+    chemo,
+    radio,
+    months: int = 12,
+    dt: float = 0.01
+) -> np.ndarray:
+    """Closed-form final volume of the constant-kill Gompertz model
+
+    With u = log(V) the model is linear: du/dt = r * (log K - u) - k, so
+    u(t) = u0 + phi(t) * (r * (log K - u0) - k) with phi = (1 - exp(-r t)) / r
+    (phi = t for r = 0). Evaluated at the last Euler sample time
+    (t_steps - 1) * dt with the same T0/K/0.01 floors; agrees with
+    simulate_gompertz_batch up to the Euler discretisation error (~0.05% for
+    fitted parameters, growing with r and the kill rate). All inputs
+    broadcast, e.g. (n_regimens, 1) flags against (n_regimens, n_samples)
+    parameter samples.
+    """
+    r = np.asarray(params['r'], dtype=float)
+    T0 = np.maximum(np.asarray(T0, dtype=float), 0.1)
+    K = np.maximum(np.asarray(params['K'], dtype=float), T0 * 1.1)
+    kill = np.asarray(params['alpha'], dtype=float) * chemo + np.asarray(params['beta'], dtype=float) * radio
+
+    t = (int(months / dt) - 1) * dt
+    rt = r * t
+    small = np.abs(rt) < 1e-12
+    phi = np.where(small, t, -np.expm1(-rt) / np.where(small, 1.0, r))
+
+    u0 = np.log(T0)
+    return np.maximum(np.exp(u0 + phi * (r * (np.log(K) - u0) - kill)), 0.01)
+
+# ============================================================================
+# SCHEDULE-AWARE SIMULATION
+# ============================================================================
+
+def treatment_schedule(
+    chemo: int,
+    radio: int,
+    radio_fractions: int = 30,
+    chemo_cycles: int = DEFAULT_CHEMO_CYCLES,
+    chemo_interval_days: float = DEFAULT_CHEMO_INTERVAL_DAYS,
+    chemo_days_on: int = CHEMO_DAYS_ON
+) -> Dict[str, Tuple[Tuple[float, float], ...]]:
+    """
+    Treatment days as (start_day, end_day) intervals, both starting on day 0
+
+    Radiotherapy: one fraction per weekday (Mon-Fri), weekends off.
+    Chemotherapy: `chemo_days_on` days at the start of every cycle.
+    """
+    radio_days = ()
+    if radio and radio_fractions > 0:
+        weeks, rest = divmod(int(radio_fractions), 5)
+        radio_days = tuple((7.0 * w, 7.0 * w + 5) for w in range(weeks))
+        if rest:
+            radio_days += ((7.0 * weeks, 7.0 * weeks + rest),)
+
+    chemo_days = ()
+    if chemo and chemo_cycles > 0:
+        on = min(chemo_days_on, chemo_interval_days)
+        chemo_days = tuple((float(c * chemo_interval_days), float(c * chemo_interval_days + on))
+                           for c in range(int(chemo_cycles)))
+
+    return {'chemo': chemo_days, 'radio': radio_days}
+
+def _schedule_exposure(intervals_list, bounds) -> np.ndarray:
+    """(n, segments) on/off matrix; interval ends must be segment bounds"""
+    unique = {iv: None for iv in intervals_list}
+    for iv in unique:
+        row = np.zeros(len(bounds) - 1, dtype=bool)
+        for start, end in iv:
+            row[np.searchsorted(bounds, start):np.searchsorted(bounds, end)] = True
+        unique[iv] = row
+    return np.array([unique[iv] for iv in intervals_list]).reshape(len(intervals_list), len(bounds) - 1)
+
+def simulate_gompertz_schedule(
+    T0,
+    params: Dict[str, np.ndarray],
+    schedules: List[Dict[str, Tuple[Tuple[float, float], ...]]],
+    times: List[float],
+    normalize_months: float = SIM_MONTHS
+) -> np.ndarray:
+    """Gompertz growth with treatment delivered on the scheduled days only
+
+    The fitted alpha/beta are average kill rates over the horizon, so each
+    regimen's kill is concentrated on its treatment days: the intensity is
+    scaled so that the cumulative kill within `normalize_months` equals that
+    of the constant-rate model. The schedule changes when the kill happens,
+    not how much (the dose effect is already in alpha/beta).
+
+    Kill rates are piecewise constant between schedule events, where the
+    model has an exact solution (see gompertz_final_volume); it is applied
+    segment by segment with the usual 0.01 floor, vectorized across
+    candidates. The cost depends on the number of events (tens), not on a
+    time step.
+
+    Args:
+        schedules: One treatment_schedule() per candidate
+        times: Output times in months
+
+    Returns:
+        (n, len(times)) volumes
+    """
+    knots, V = _simulate_schedule_knots(T0, params, schedules, times, normalize_months)
+    return V[:, np.searchsorted(knots, [t * DAYS_PER_MONTH for t in times])]
+
+def _simulate_schedule_knots(T0, params, schedules, times, normalize_months):
+    """Volumes at every segment bound (days) up to the last output time
+
+    The kill normalization always spans the full `normalize_months`, so a
+    volume does not depend on which other output times are requested.
+    """
+    r = np.asarray(params['r'], dtype=float)
+    n = r.shape[0]
+    T0 = np.maximum(np.broadcast_to(np.asarray(T0, dtype=float), (n,)), 0.1)
+    K = np.maximum(np.asarray(params['K'], dtype=float), T0 * 1.1)
+    log_K = np.log(K)
+
+    end_day = max(times) * DAYS_PER_MONTH
+    norm_day = normalize_months * DAYS_PER_MONTH
+    events = {0.0, norm_day, *(t * DAYS_PER_MONTH for t in times)}
+    for sched in schedules:
+        for start, end in sched['chemo'] + sched['radio']:
+            events.update((start, end))
+    bounds = np.array(sorted(d for d in events if d <= max(end_day, norm_day)))
+    seg = np.diff(bounds) / DAYS_PER_MONTH
+    in_norm = bounds[1:] <= norm_day
+
+    kill = np.zeros((n, len(seg)))
+    for key, rate in (('chemo', params['alpha']), ('radio', params['beta'])):
+        on = _schedule_exposure([sched[key] for sched in schedules], bounds)
+        on_months = (on * (seg * in_norm)).sum(axis=1)
+        intensity = np.asarray(rate, dtype=float) * normalize_months / np.where(on_months > 0, on_months, 1.0)
+        kill += on * np.where(on_months > 0, intensity, 0.0)[:, None]
+
+    # Simulate only up to the last output time
+    n_bounds = np.searchsorted(bounds, end_day) + 1
+    bounds, seg, kill = bounds[:n_bounds], seg[:n_bounds - 1], kill[:, :n_bounds - 1]
+
+    log_floor = np.log(0.01)
+    u = np.log(T0)
+    U = np.empty((n, len(bounds)))
+    U[:, 0] = u
+
+    for j, dt in enumerate(seg):
+        # Exact solution over the segment; the path is monotone, so clamping
+        # the end point is the same as flooring along the way
+        rt = r * dt
+        small = np.abs(rt) < 1e-12
+        phi = np.where(small, dt, -np.expm1(-rt) / np.where(small, 1.0, r))
+        u = np.maximum(u + phi * (r * (log_K - u) - kill[:, j]), log_floor)
+        U[:, j + 1] = u
+
+    return bounds, np.exp(U)
+
+def simulate_schedule_horizons(
+    T0,
+    params: Dict[str, np.ndarray],
+    schedules: List[Dict[str, Tuple[Tuple[float, float], ...]]],
+    horizons: List[float],
+    curve_points: int = 0
+) -> Dict[str, np.ndarray]:
+    """Schedule-aware counterpart of simulate_gompertz_horizons (same keys)
+
+    Horizons are exact times here (no Euler sample offset). The AUC is
+    trapezoidal over all schedule events plus a weekly grid.
+    """
+    if min(horizons) <= 0:
+        raise ValueError("horizons must be positive")
+
+    last = max(horizons)
+    curve_t = np.linspace(0, last, curve_points) if curve_points else np.array([])
+    weekly = np.arange(0, last * DAYS_PER_MONTH, 7.0) / DAYS_PER_MONTH
+    times = sorted(set(horizons) | set(curve_t.tolist()) | set(weekly.tolist()))
+
+    knots, V = _simulate_schedule_knots(T0, params, schedules, times, SIM_MONTHS)
+    t = knots / DAYS_PER_MONTH
+    auc = ((V[:, 1:] + V[:, :-1]) * 0.5 * np.diff(t)).sum(axis=1)
+
+    def at(months):
+        return V[:, np.searchsorted(knots, [m * DAYS_PER_MONTH for m in months])]
+
+    out = {'volumes': at(horizons), 'auc': auc}
+    if curve_points:
+        out['curve_t'] = curve_t.round(6)
+        out['curve'] = at(curve_t)
+    return out
+
 print("="*80)
 print("ENHANCED OPTIMIZATION MODULE v3.0 LOADED")
 print("="*80)
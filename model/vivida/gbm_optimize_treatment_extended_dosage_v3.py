@@ -32,8 +32,385 @@ from gbm_optimize_treatment_dosage_v3 import (
     stacked_models, BASELINE_R, R_UNTREATED, SIM_MONTHS,
     parse_treatment_flags, extract_dosages_from_patient,
     build_feature_vector, predict_params_from_features_row,
-    simulate_gompertz_with_treatment
+    simulate_gompertz_with_treatment,
+    build_feature_matrix, predict_params_batch, simulate_gompertz_batch,
+    simulate_gompertz_horizons, horizon_index, treatment_schedule, simulate_schedule_horizons,
+    DEFAULT_CHEMO_CYCLES, DEFAULT_CHEMO_INTERVAL_DAYS,
+    find_similar_patients, SIMILAR_PATIENTS_K, explain_params, ATTRIBUTION_TOP_K,
+    radio_bed, predict_params_samples, gompertz_final_volume
 )
+from gbm_gompertz_fit import refit_from_follow_up
+
+# ============================================================================
+# CONFIG
+# ============================================================================
+MAX_SWEEP_POINTS = 2500
+
+# Patient fields that can be varied in a what-if sweep
+SWEEPABLE_FEATURES = [
+    'age', 'tumor_size_before', 'kps',
+    'edema_volume', 'steroid_dose', 'symptom_count',
+    'mgmt_methylation', 'idh_mutation', 'egfr_amplification',
+    'tert_mutation', 'atrx_mutation', 'antiseizure_meds',
+    'family_history', 'previous_radiation'
+]
+
+# Reporting horizons and ranking objectives
+MAX_HORIZON_MONTHS = 60
+MAX_CURVE_POINTS = 500
+
+# Monte Carlo uncertainty
+UNCERTAINTY_SAMPLES = 10000
+UNCERTAINTY_INTERVAL = 0.9
+UNCERTAINTY_SEED = 0
+
+# ============================================================================
+# SEARCH SPACE
+# ============================================================================
+
+MODALITIES = ['radiation', 'chemotherapy', 'chemoradiotherapy']
+
+DEFAULT_CHEMO_DOSES = [50, 75, 100, 125, 150]
+DEFAULT_RADIO_SCHEMES = [(40, 15), (50, 25), (60, 30), (66, 33)]
+
+# Expanded search space (agent x add-on x dose levels)
+EXPANDED_CHEMO_AGENTS = {
+    'temozolomide': [50, 60, 70, 75, 80, 90, 100, 110, 120, 125, 130, 140, 150, 160, 180, 200],
+    'lomustine': [80, 90, 100, 110, 120, 130]
+}
+EXPANDED_RADIO_SCHEMES = [(25, 5), (34, 10), (40, 15), (50, 25), (54, 30), (60, 30), (66, 33)]
+BEVACIZUMAB_OPTIONS = [False, True]
+
+EXPANDED_BATCH_ROWS = 4096  # regimens scored per batch (the default space is one batch)
+EXPANDED_TOP_RESULTS = 10
+
+# Cost model: rough latency per evaluated regimen (batched) + fixed request overhead
+EST_MS_PER_EVALUATION = 1.0
+EST_MS_OVERHEAD = 100.0
+
+def parse_search_space(spec: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Validate a client search space
+
+    {
+        "chemo_doses": [50, 100, 150],            // mg/m2
+        "radio_schemes": [[60, 30], [40, 15]],    // [total_Gy, fractions]
+        "modalities": ["chemoradiotherapy"]
+    }
+
+    Missing keys fall back to the defaults. Returns keyword arguments for
+    optimize_treatment_with_dosage_grid / estimate_search_cost.
+    """
+    spec = spec or {}
+    if not isinstance(spec, dict):
+        raise ValueError("search_space must be an object")
+
+    chemo_doses = spec.get('chemo_doses', DEFAULT_CHEMO_DOSES)
+    if not isinstance(chemo_doses, list) or not chemo_doses:
+        raise ValueError("chemo_doses must be a non-empty list")
+    if not all(isinstance(d, (int, float)) and 0 < d <= 500 for d in chemo_doses):
+        raise ValueError("chemo_doses must be numbers in (0, 500] mg/m2")
+
+    radio_schemes = spec.get('radio_schemes', DEFAULT_RADIO_SCHEMES)
+    if not isinstance(radio_schemes, list) or not radio_schemes:
+        raise ValueError("radio_schemes must be a non-empty list")
+    parsed_schemes = []
+    for scheme in radio_schemes:
+        if (not isinstance(scheme, (list, tuple)) or len(scheme) != 2
+                or not isinstance(scheme[0], (int, float)) or not isinstance(scheme[1], int)
+                or not 0 < scheme[0] <= 100 or not 0 < scheme[1] <= 60):
+            raise ValueError("radio_schemes entries must be [total_Gy in (0, 100], fractions in 1..60]")
+        parsed_schemes.append((scheme[0], int(scheme[1])))
+
+    modalities = spec.get('modalities', MODALITIES)
+    if not isinstance(modalities, list) or not modalities or any(m not in MODALITIES for m in modalities):
+        raise ValueError(f"modalities must be a non-empty subset of {MODALITIES}")
+
+    return {
+        'chemo_dose_range': sorted(set(chemo_doses)),
+        'radio_dose_configs': sorted(set(parsed_schemes)),
+        'modalities': [m for m in MODALITIES if m in modalities]
+    }
+
+def current_modalities(treatment_string: str) -> List[str]:
+    """Treatment type(s) matching the current plan"""
+    flags = parse_treatment_flags(treatment_string)
+    if flags['chemo'] and flags['radio']:
+        return ['chemoradiotherapy']
+    if flags['chemo']:
+        return ['chemotherapy']
+    if flags['radio']:
+        return ['radiation']
+    return []
+
+def build_search_candidates(
+    chemo_dose_range: List[float],
+    radio_dose_configs: List[Tuple[float, int]],
+    modalities: List[str]
+) -> List[Dict[str, Any]]:
+    """Enumerate the regimens of a search space (radiation, chemo, combination order)"""
+    candidates = []
+
+    if 'radiation' in modalities:
+        for total_Gy, fractions in radio_dose_configs:
+            candidates.append({'treatment_type': 'radiation', 'chemo_dose_mg_per_m2': 0.0,
+                               'radio_total_Gy': total_Gy, 'radio_fractions': fractions})
+
+    if 'chemotherapy' in modalities:
+        for dose in chemo_dose_range:
+            candidates.append({'treatment_type': 'chemotherapy', 'chemo_dose_mg_per_m2': dose,
+                               'radio_total_Gy': 0.0, 'radio_fractions': 0})
+
+    if 'chemoradiotherapy' in modalities:
+        for c_dose in chemo_dose_range:
+            for r_total, r_frac in radio_dose_configs:
+                candidates.append({'treatment_type': 'chemoradiotherapy', 'chemo_dose_mg_per_m2': c_dose,
+                                   'radio_total_Gy': r_total, 'radio_fractions': r_frac})
+
+    return candidates
+
+def estimate_search_cost(
+    chemo_dose_range: List[float],
+    radio_dose_configs: List[Tuple[float, int]],
+    modalities: List[str],
+    include_doctor_plan: bool = True
+) -> Dict[str, Any]:
+    """Estimate the number of model evaluations (and latency) of a search before running it"""
+    by_modality = {
+        'radiation': len(radio_dose_configs) if 'radiation' in modalities else 0,
+        'chemotherapy': len(chemo_dose_range) if 'chemotherapy' in modalities else 0,
+        'chemoradiotherapy': len(chemo_dose_range) * len(radio_dose_configs) if 'chemoradiotherapy' in modalities else 0
+    }
+    evaluations = sum(by_modality.values()) + int(include_doctor_plan)
+
+    return {
+        'evaluations': evaluations,
+        'by_modality': by_modality,
+        'estimated_ms': round(EST_MS_OVERHEAD + evaluations * EST_MS_PER_EVALUATION, 1)
+    }
+
+def _thin(values: List, n: int) -> List:
+    """Keep n evenly spaced values (always keeping both ends)"""
+    if n >= len(values):
+        return list(values)
+    if n <= 1:
+        return [values[len(values) // 2]]
+    idx = np.unique(np.round(np.linspace(0, len(values) - 1, n)).astype(int))
+    return [values[i] for i in idx]
+
+def downsample_search_space(
+    chemo_dose_range: List[float],
+    radio_dose_configs: List[Tuple[float, int]],
+    modalities: List[str],
+    max_evaluations: int
+) -> Dict[str, Any]:
+    """Thin dose lists evenly until the search fits into max_evaluations"""
+    n_chemo, n_radio = len(chemo_dose_range), len(radio_dose_configs)
+
+    while n_chemo > 1 or n_radio > 1:
+        cost = estimate_search_cost(_thin(chemo_dose_range, n_chemo),
+                                    _thin(radio_dose_configs, n_radio), modalities)
+        if cost['evaluations'] <= max_evaluations:
+            break
+        # Shrink the longer axis first
+        if n_chemo >= n_radio and n_chemo > 1:
+            n_chemo -= 1
+        else:
+            n_radio -= 1
+
+    return {
+        'chemo_dose_range': _thin(chemo_dose_range, n_chemo),
+        'radio_dose_configs': _thin(radio_dose_configs, n_radio),
+        'modalities': list(modalities)
+    }
+
+def resolve_objective(
+    horizons: Optional[List[float]] = None,
+    objective: Any = None,
+    months: int = SIM_MONTHS,
+    dt: float = 0.01
+) -> Tuple[List[float], Any]:
+    """
+    Validate reporting horizons and the ranking objective
+
+    objective: None (volume at `months`, i.e. pred_12m), a horizon in months
+    (volume at that horizon) or 'auc' (area under the volume curve up to the
+    longest horizon). Every horizon must cover at least one simulation step
+    of `dt` months, whether or not the schedule-aware simulation is used.
+
+    Returns:
+        (sorted horizons including `months` and the objective horizon, objective)
+    """
+    if isinstance(objective, str) and objective.lower() != 'auc':
+        try:
+            objective = float(objective)
+        except ValueError:
+            raise ValueError("objective must be a horizon in months or 'auc'")
+    elif isinstance(objective, str):
+        objective = 'auc'
+
+    values = [months] + list(horizons or [])
+    if objective not in (None, 'auc'):
+        values.append(objective)
+
+    resolved = []
+    for h in values:
+        h = float(h)
+        if not 0 < h <= MAX_HORIZON_MONTHS:
+            raise ValueError(f"horizons must be between 0 and {MAX_HORIZON_MONTHS} months")
+        if horizon_index(h, dt) < 0:
+            raise ValueError(f"horizons must be at least {dt} months")
+        resolved.append(int(h) if h.is_integer() else h)
+
+    if objective not in (None, 'auc'):
+        objective = resolved[-1]
+    return sorted(set(resolved)), objective
+
+def horizon_key(months: float) -> str:
+    """Key of a horizon in `pred_by_horizon` ('6', '24', '1.5')"""
+    return f"{months:g}"
+
+def chemo_cycle_settings(plan: Dict[str, Any]) -> Tuple[int, float]:
+    """(cycles, interval_days) of a plan's chemotherapy, TMZ 6 x 28 days by default"""
+    chemo = plan.get('chemotherapy', {}) if isinstance(plan.get('chemotherapy'), dict) else {}
+    return (int(chemo.get('cycles', DEFAULT_CHEMO_CYCLES)),
+            float(chemo.get('interval_days', DEFAULT_CHEMO_INTERVAL_DAYS)))
+
+def plan_radio_fractions(plan: Dict[str, Any]) -> int:
+    """Number of RT fractions of a plan (from fractions or total / fraction dose, 30 by default)"""
+    rt = plan.get('radiotherapy', {}) if isinstance(plan.get('radiotherapy'), dict) else {}
+    if rt.get('fractions'):
+        return int(rt['fractions'])
+    if rt.get('total_dose_Gy') and rt.get('fraction_dose_Gy'):
+        return int(round(float(rt['total_dose_Gy']) / float(rt['fraction_dose_Gy'])))
+    return 30
+
+def simulate_regimens(
+    T0: float,
+    params: Dict[str, np.ndarray],
+    chemo,
+    radio,
+    months: int = SIM_MONTHS,
+    horizons: Optional[List[float]] = None,
+    curve_points: int = 0,
+    schedules: Optional[List[Dict[str, Any]]] = None
+) -> Dict[str, Any]:
+    """
+    Simulate a batch of regimens
+
+    Uses the constant-rate Euler simulator, or the schedule-aware one when
+    `schedules` (one treatment_schedule() per row) is given.
+
+    Returns:
+        {'pred': (n,) volume at `months`} plus, with horizons / curve_points /
+        schedules, 'horizons', 'volumes', 'auc' and optionally 'curve_t'/'curve'
+    """
+    if schedules is None and not horizons and not curve_points:
+        pred, _ = simulate_gompertz_batch(T0, params, chemo, radio, months=months)
+        return {'pred': pred}
+
+    horizons = sorted(set([months] + list(horizons or [])))
+    if schedules is None:
+        sim = simulate_gompertz_horizons(T0, params, chemo, radio, horizons, curve_points=curve_points)
+    else:
+        sim = simulate_schedule_horizons(T0, params, schedules, horizons, curve_points=curve_points)
+    sim['horizons'] = horizons
+    sim['pred'] = sim['volumes'][:, horizons.index(months)]
+    return sim
+
+def evaluate_candidates(
+    patient: Dict[str, Any],
+    candidates: List[Dict[str, Any]],
+    months: int = SIM_MONTHS,
+    evaluators: Optional[Dict[str, List[Any]]] = None,
+    horizons: Optional[List[float]] = None,
+    curve_points: int = 0,
+    schedule_aware: bool = False
+) -> List[Dict[str, Any]]:
+    """Predict and simulate all candidate regimens for one patient in one batch
+
+    Candidates may carry a full `treatment` string (e.g. with an agent or
+    add-on); otherwise `treatment_type` is used as the treatment string.
+    With `horizons` (months) or `curve_points`, every entry also gets
+    `pred_by_horizon`, `auc` and optionally a downsampled `curve`, all read
+    from the same simulation. With `schedule_aware`, treatment is applied on
+    the scheduled days only: each candidate's RT fractions on weekdays and
+    the patient's chemotherapy cycles.
+    """
+    if not candidates:
+        return []
+
+    T0 = float(patient.get('tumor_size_before', 3.0))
+    dosages_list = [{
+        'chemo_dose_mg_per_m2': c['chemo_dose_mg_per_m2'],
+        'radio_total_Gy': c['radio_total_Gy'],
+        'radio_BED': radio_bed(c['radio_total_Gy'], c['radio_fractions'])
+    } for c in candidates]
+    treatments = [c.get('treatment', c['treatment_type']) for c in candidates]
+
+    X = build_feature_matrix([patient] * len(candidates), treatments, dosages_list)
+    params = predict_params_batch(X, evaluators=evaluators)
+    chemo = np.array([parse_treatment_flags(t)['chemo'] for t in treatments])
+    radio = np.array([parse_treatment_flags(t)['radio'] for t in treatments])
+
+    schedules = None
+    if schedule_aware:
+        cycles, interval_days = chemo_cycle_settings(patient)
+        schedules = [treatment_schedule(chemo[i], radio[i], c['radio_fractions'], cycles, interval_days)
+                     for i, c in enumerate(candidates)]
+
+    sim = simulate_regimens(T0, params, chemo, radio, months, horizons, curve_points, schedules)
+
+    results = []
+    for i, c in enumerate(candidates):
+        entry = _result_entry(c, {name: float(values[i]) for name, values in params.items()},
+                              float(sim['pred'][i]))
+        if horizons or curve_points:
+            entry['pred_by_horizon'] = {horizon_key(h): float(v)
+                                        for h, v in zip(sim['horizons'], sim['volumes'][i])}
+            entry['auc'] = float(sim['auc'][i])
+        if curve_points:
+            entry['curve'] = {'t_months': sim['curve_t'].tolist(), 'volume': sim['curve'][i].tolist()}
+        results.append(entry)
+    return results
+
+def objective_value(entry: Dict[str, Any], objective: Any = None) -> float:
+    """Ranking value of an evaluated regimen (lower is better)"""
+    if objective is None:
+        return entry['pred_12m']
+    if objective == 'auc':
+        return entry['auc']
+    return entry['pred_by_horizon'][horizon_key(objective)]
+
+def explain_regimen(patient: Dict[str, Any], entry: Dict[str, Any], top_k: int) -> Dict[str, Any]:
+    """Attributions (see explain_params) of an evaluated regimen's parameters"""
+    dosages = {
+        'chemo_dose_mg_per_m2': entry['chemo_dose_mg_per_m2'],
+        'radio_total_Gy': entry['radio_total_Gy'],
+        'radio_BED': radio_bed(entry['radio_total_Gy'], entry['radio_fractions'])
+    }
+    X = build_feature_matrix([patient], [entry.get('treatment', entry['treatment_type'])], [dosages])
+    return explain_params(X.values[0], top_k, refitted=refit_from_follow_up(patient) is not None)
+
+def _result_entry(candidate: Dict[str, Any], params: Dict[str, float], pred: float) -> Dict[str, Any]:
+    """Result dict of one evaluated regimen (format of `all_results`)"""
+    c = candidate
+    entry = {
+        'treatment_type': c['treatment_type'],
+        'chemo_dose_mg_per_m2': c['chemo_dose_mg_per_m2'],
+        'radio_total_Gy': c['radio_total_Gy'],
+        'radio_fractions': c['radio_fractions'],
+        'radio_fraction_dose_Gy': c['radio_total_Gy'] / c['radio_fractions'] if c['radio_fractions'] else 0.0,
+        'BED': radio_bed(c['radio_total_Gy'], c['radio_fractions']),
+        'pred_12m': pred,
+        'alpha_calculated': params['alpha'],
+        'beta_calculated': params['beta'],
+        'params': params
+    }
+    for key in ('treatment', 'chemo_agent', 'bevacizumab'):
+        if key in c:
+            entry[key] = c[key]
+    return entry
 
 # ============================================================================
 # OPTIMIZATION WITH DOSAGE GRID SEARCH
@@ -42,9 +419,16 @@ from gbm_optimize_treatment_dosage_v3 import (
 def optimize_treatment_with_dosage_grid(
     patient: Dict[str, Any],
     doctor_plan: Dict[str, Any] = None,
-    chemo_dose_range: List[float] = [50, 75, 100, 125, 150],
-    radio_dose_configs: List[Tuple[float, int]] = [(40, 15), (50, 25), (60, 30), (66, 33)],
-    test_all_modalities: bool = True
+    chemo_dose_range: List[float] = None,
+    radio_dose_configs: List[Tuple[float, int]] = None,
+    test_all_modalities: bool = True,
+    modalities: List[str] = None,
+    horizons: List[float] = None,
+    objective: Any = None,
+    curve_points: int = 0,
+    schedule_aware: bool = False,
+    n_similar: int = SIMILAR_PATIENTS_K,
+    explain_top_k: int = 0
 ) -> Dict[str, Any]:
     """
     Extended optimization with v3.0 full feature support
@@ -56,145 +440,104 @@ def optimize_treatment_with_dosage_grid(
         chemo_dose_range: Chemotherapy doses to test (mg/m²)
         radio_dose_configs: Radiotherapy configs [(total_Gy, fractions), ...]
         test_all_modalities: Test all treatment types or only current
+        modalities: Explicit treatment types to test (overrides test_all_modalities)
+        horizons: Extra prediction horizons in months (e.g. [3, 6, 24])
+        objective: Ranking objective: None (12-month volume), a horizon in
+                   months or 'auc' (see resolve_objective)
+        curve_points: Points of the downsampled volume curve per regimen (0 = none)
+        schedule_aware: Simulate treatment on the scheduled days only (weekday RT
+                        fractions, chemotherapy cycles from the patient's plan)
+                        instead of constant kill rates
+        n_similar: Number of most similar training patients to return (0 = none)
+        explain_top_k: Features per parameter in the attributions of the
+                       recommended regimen's (r, K, alpha, beta) (0 = none)
 
     Returns:
         dict with optimization results
     """
-    current_treatment = patient.get('treatment', '')
-    flags = parse_treatment_flags(current_treatment)
+    multi_horizon = bool(horizons or objective is not None or curve_points)
+    if multi_horizon:
+        horizons, objective = resolve_objective(horizons, objective, SIM_MONTHS)
+        if not 0 <= curve_points <= MAX_CURVE_POINTS:
+            raise ValueError(f"curve_points must be between 0 and {MAX_CURVE_POINTS}")
 
-    all_results = []
+    def score(entry):
+        return objective_value(entry, objective)
+
+    if chemo_dose_range is None:
+        chemo_dose_range = DEFAULT_CHEMO_DOSES
+    if radio_dose_configs is None:
+        radio_dose_configs = DEFAULT_RADIO_SCHEMES
+
+    current_treatment = patient.get('treatment', '')
     T0 = float(patient.get('tumor_size_before', 3.0))
 
     # Determine which modalities to test
-    if test_all_modalities:
-        test_chemo_only = True
-        test_radio_only = True
-        test_combination = True
+    if modalities is not None:
+        print(f"\n[i] Mode: testing {', '.join(modalities)}")
+    elif test_all_modalities:
+        modalities = list(MODALITIES)
         print("\n[i] Mode: testing ALL treatment types")
     else:
-        test_chemo_only = flags['chemo'] and not flags['radio']
-        test_radio_only = flags['radio'] and not flags['chemo']
-        test_combination = flags['chemo'] and flags['radio']
+        modalities = current_modalities(current_treatment)
         print(f"\n[i] Mode: optimizing current type ({current_treatment})")
 
+    candidates = build_search_candidates(chemo_dose_range, radio_dose_configs, modalities)
+    all_results = evaluate_candidates(patient, candidates, horizons=horizons if multi_horizon else None,
+                                      curve_points=curve_points, schedule_aware=schedule_aware)
+    if schedule_aware:
+        cycles, interval_days = chemo_cycle_settings(patient)
+        print(f"[i] Schedule-aware simulation: RT on weekdays, chemo {cycles} cycles / {interval_days:g} days")
+    if objective is not None:
+        label = 'area under curve' if objective == 'auc' else f'volume at {horizon_key(objective)} months'
+        print(f"[i] Ranking objective: {label}")
+    follow_up_fit = refit_from_follow_up(patient)
+    if follow_up_fit:
+        print(f"[i] Gompertz refit from {follow_up_fit['n_obs']} observations: "
+              f"r={follow_up_fit['r_fit']:.4f}, K={follow_up_fit['K_fit']:.2f} cm3 "
+              f"(RMSE {follow_up_fit['rmse']:.2f})")
+
     # 1. RADIATION ONLY
-    if test_radio_only:
+    if 'radiation' in modalities:
         print("\n=== RADIATION ONLY ===")
-        for total_Gy, fractions in radio_dose_configs:
-            dosages = {
-                'chemo_dose_mg_per_m2': 0.0,
-                'radio_total_Gy': total_Gy,
-                'radio_BED': fractions * (total_Gy/fractions) * (1 + (total_Gy/fractions) / 10.0)
-            }
-
-            feat = build_feature_vector(patient, "radiation", dosages=dosages)
-            params = predict_params_from_features_row(feat)
-
-            pred_12m, curve = simulate_gompertz_with_treatment(
-                T0, params, chemo=0, radio=1, months=SIM_MONTHS
-            )
-
-            result = {
-                'treatment_type': 'radiation',
-                'chemo_dose_mg_per_m2': 0.0,
-                'radio_total_Gy': total_Gy,
-                'radio_fractions': fractions,
-                'radio_fraction_dose_Gy': total_Gy / fractions,
-                'BED': dosages['radio_BED'],
-                'pred_12m': pred_12m,
-                'alpha_calculated': params['alpha'],
-                'beta_calculated': params['beta'],
-                'params': params
-            }
-            all_results.append(result)
-
-            print(f"  {total_Gy} Gy / {fractions} fr (BED={dosages['radio_BED']:.1f}) -> "
-                  f"beta={params['beta']:.4f}, prediction: {pred_12m:.2f} cm3")
+        for r in all_results:
+            if r['treatment_type'] == 'radiation':
+                print(f"  {r['radio_total_Gy']} Gy / {r['radio_fractions']} fr (BED={r['BED']:.1f}) -> "
+                      f"beta={r['beta_calculated']:.4f}, prediction: {r['pred_12m']:.2f} cm3")
 
     # 2. CHEMOTHERAPY ONLY
-    if test_chemo_only:
+    if 'chemotherapy' in modalities:
         print("\n=== CHEMOTHERAPY ONLY ===")
-        for dose in chemo_dose_range:
-            dosages = {
-                'chemo_dose_mg_per_m2': dose,
-                'radio_total_Gy': 0.0,
-                'radio_BED': 0.0
-            }
-
-            feat = build_feature_vector(patient, "chemotherapy", dosages=dosages)
-            params = predict_params_from_features_row(feat)
-
-            pred_12m, curve = simulate_gompertz_with_treatment(
-                T0, params, chemo=1, radio=0, months=SIM_MONTHS
-            )
-
-            result = {
-                'treatment_type': 'chemotherapy',
-                'chemo_dose_mg_per_m2': dose,
-                'radio_total_Gy': 0.0,
-                'radio_fractions': 0,
-                'radio_fraction_dose_Gy': 0.0,
-                'BED': 0.0,
-                'pred_12m': pred_12m,
-                'alpha_calculated': params['alpha'],
-                'beta_calculated': params['beta'],
-                'params': params
-            }
-            all_results.append(result)
-
-            print(f"  TMZ {dose} mg/m2 -> alpha={params['alpha']:.4f}, prediction: {pred_12m:.2f} cm3")
+        for r in all_results:
+            if r['treatment_type'] == 'chemotherapy':
+                print(f"  TMZ {r['chemo_dose_mg_per_m2']} mg/m2 -> alpha={r['alpha_calculated']:.4f}, "
+                      f"prediction: {r['pred_12m']:.2f} cm3")
 
     # 3. COMBINATION THERAPY
-    if test_combination:
+    if 'chemoradiotherapy' in modalities:
         print("\n=== COMBINATION THERAPY ===")
-        for c_dose in chemo_dose_range:
-            for r_total, r_frac in radio_dose_configs:
-                dosages = {
-                    'chemo_dose_mg_per_m2': c_dose,
-                    'radio_total_Gy': r_total,
-                    'radio_BED': r_frac * (r_total/r_frac) * (1 + (r_total/r_frac) / 10.0)
-                }
-
-                feat = build_feature_vector(patient, "chemoradiotherapy", dosages=dosages)
-                params = predict_params_from_features_row(feat)
-
-                pred_12m, curve = simulate_gompertz_with_treatment(
-                    T0, params, chemo=1, radio=1, months=SIM_MONTHS
-                )
-
-                result = {
-                    'treatment_type': 'chemoradiotherapy',
-                    'chemo_dose_mg_per_m2': c_dose,
-                    'radio_total_Gy': r_total,
-                    'radio_fractions': r_frac,
-                    'radio_fraction_dose_Gy': r_total / r_frac,
-                    'BED': dosages['radio_BED'],
-                    'pred_12m': pred_12m,
-                    'alpha_calculated': params['alpha'],
-                    'beta_calculated': params['beta'],
-                    'params': params
-                }
-                all_results.append(result)
 
         # Show best 3 combinations
         combo_sorted = sorted([r for r in all_results if r['treatment_type'] == 'chemoradiotherapy'],
-                             key=lambda x: x['pred_12m'])[:3]
+                             key=score)[:3]
         for r in combo_sorted:
             print(f"  TMZ {r['chemo_dose_mg_per_m2']:.0f} mg/m2 + RT {r['radio_total_Gy']:.0f} Gy/{r['radio_fractions']} fr -> "
                   f"prediction: {r['pred_12m']:.2f} cm3")
 
     # Find global best
-    best = min(all_results, key=lambda x: x['pred_12m'])
+    best = min(all_results, key=score)
 
     # ========================================================================
     # DOCTOR'S PLAN ANALYSIS
     # ========================================================================
     doctor_pred = None
+    doctor_score = None
+    doctor_horizons = None
     doctor_dosages = None
     doctor_treatment_type = None
     local_best = None
     improvement = 0.0
+    local_improvement = 0.0
 
     if doctor_plan:
         print("\n" + "="*80)
@@ -229,6 +572,29 @@ def optimize_treatment_with_dosage_grid(
         doctor_pred, _ = simulate_gompertz_with_treatment(
             T0, doctor_params, doctor_flags['chemo'], doctor_flags['radio'], months=SIM_MONTHS
         )
+        doctor_score = doctor_pred
+
+        if multi_horizon or schedule_aware:
+            schedules = None
+            if schedule_aware:
+                cycles, interval_days = chemo_cycle_settings(doctor_plan)
+                schedules = [treatment_schedule(doctor_flags['chemo'], doctor_flags['radio'],
+                                                plan_radio_fractions(doctor_plan), cycles, interval_days)]
+            sim = simulate_regimens(
+                T0, {name: np.array([value]) for name, value in doctor_params.items()},
+                doctor_flags['chemo'], doctor_flags['radio'],
+                horizons=horizons if multi_horizon else None, schedules=schedules
+            )
+            if schedule_aware:
+                doctor_pred = doctor_score = float(sim['pred'][0])
+
+            if multi_horizon:
+                doctor_horizons = {
+                    'pred_12m': doctor_pred,
+                    'pred_by_horizon': {horizon_key(h): float(v) for h, v in zip(sim['horizons'], sim['volumes'][0])},
+                    'auc': float(sim['auc'][0])
+                }
+                doctor_score = objective_value(doctor_horizons, objective)
 
         print(f"\nPredicted tumor size (12 months): {doctor_pred:.2f} cm3")
 
@@ -271,6 +637,9 @@ def optimize_treatment_with_dosage_grid(
 
     print(f"\n  PREDICTION:")
     print(f"    Tumor size (12 months): {best['pred_12m']:.2f} cm3")
+    for h, v in best.get('pred_by_horizon', {}).items():
+        if h != horizon_key(SIM_MONTHS):
+            print(f"    Tumor size ({h} months): {v:.2f} cm3")
 
     # ========================================================================
     # DUAL RECOMMENDATIONS (GLOBAL + LOCAL)
@@ -295,10 +664,10 @@ def optimize_treatment_with_dosage_grid(
         if doctor_treatment_type:
             same_type_results = [r for r in all_results if r['treatment_type'] == doctor_treatment_type]
             if same_type_results:
-                local_best = min(same_type_results, key=lambda x: x['pred_12m'])
+                local_best = min(same_type_results, key=score)
 
-        # Global improvement
-        improvement = (doctor_pred - best['pred_12m']) / doctor_pred * 100
+        # Global improvement (in the ranking objective)
+        improvement = (doctor_score - score(best)) / doctor_score * 100
 
         print(f"\n1. GLOBAL OPTIMIZATION (best among all treatment types):")
         print(f"   Current plan prediction: {doctor_pred:.2f} cm3")
@@ -306,8 +675,8 @@ def optimize_treatment_with_dosage_grid(
         print(f"   Difference: {improvement:.1f}%")
 
         # Local optimization
-        if local_best and local_best['pred_12m'] != doctor_pred:
-            local_improvement = (doctor_pred - local_best['pred_12m']) / doctor_pred * 100
+        if local_best and score(local_best) != doctor_score:
+            local_improvement = (doctor_score - score(local_best)) / doctor_score * 100
             print(f"\n2. LOCAL OPTIMIZATION (best within '{doctor_treatment_type}'):")
             print(f"   Current plan prediction: {doctor_pred:.2f} cm3")
             print(f"   Optimized plan prediction: {local_best['pred_12m']:.2f} cm3")
@@ -368,7 +737,7 @@ def optimize_treatment_with_dosage_grid(
         print("-"*80)
 
         if local_best:
-            local_improvement = (doctor_pred - local_best['pred_12m']) / doctor_pred * 100
+            local_improvement = (doctor_score - score(local_best)) / doctor_score * 100
 
             if local_improvement < 0.5:
                 print(f"\n[OK] Current dosages are optimal for '{doctor_treatment_type}'")
@@ -451,12 +820,370 @@ def optimize_treatment_with_dosage_grid(
     # Add local optimization info
     if doctor_pred is not None and local_best:
         result['best_dosage_local'] = local_best
-        result['local_improvement'] = (doctor_pred - local_best['pred_12m']) / doctor_pred * 100
+        result['local_improvement'] = (doctor_score - score(local_best)) / doctor_score * 100
         result['global_improvement'] = improvement
         result['doctor_treatment_type'] = doctor_treatment_type
 
+    if schedule_aware:
+        result['simulator'] = 'schedule'
+
+    if follow_up_fit:
+        result['follow_up_fit'] = follow_up_fit
+
+    if n_similar > 0:
+        patient_row = build_feature_matrix(
+            [patient], [current_treatment], [extract_dosages_from_patient(patient, current_treatment)]
+        ).values[0]
+        result['similar_patients'] = find_similar_patients(patient_row, n_similar)
+
+    if explain_top_k > 0:
+        result['attributions'] = explain_regimen(patient, best, explain_top_k)
+        print(f"\n[i] Top features of the recommended regimen's parameters:")
+        for name, attribution in result['attributions'].items():
+            top = ', '.join(f"{c['feature']} {c['contribution']:+.4g}" for c in attribution['contributions'][:3])
+            print(f"  {name} = {attribution['prediction']:.4g} (base {attribution['base_value']:.4g}): {top}")
+
+    if multi_horizon:
+        result['horizons'] = horizons
+        result['objective'] = 'pred_12m' if objective is None else (
+            'auc' if objective == 'auc' else f"pred_{horizon_key(objective)}m")
+        if doctor_horizons:
+            result['doctor_plan_by_horizon'] = doctor_horizons['pred_by_horizon']
+            result['doctor_plan_auc'] = doctor_horizons['auc']
+
     return result
 
+# ============================================================================
+# EXPANDED SEARCH
+# ============================================================================
+
+def build_expanded_families(
+    chemo_agents: Dict[str, List[float]],
+    radio_schemes: List[Tuple[float, int]],
+    modalities: List[str],
+    bevacizumab_options: List[bool]
+) -> List[Dict[str, Any]]:
+    """
+    Regimen families of the expanded space: one per modality/agent/add-on
+
+    Each family holds its sorted dose axes; a regimen is one
+    (chemo dose, radio scheme) pair of a family. Temozolomide keeps the
+    plain modality as treatment string, like the dosage grid.
+    """
+    schemes = sorted(radio_schemes, key=lambda s: (radio_bed(*s), s[0]))
+    families = []
+    for modality in modalities:
+        with_chemo = modality in ('chemotherapy', 'chemoradiotherapy')
+        with_radio = modality in ('radiation', 'chemoradiotherapy')
+        for agent in (chemo_agents if with_chemo else [None]):
+            for beva in bevacizumab_options:
+                parts = [modality]
+                if agent and agent != 'temozolomide':
+                    parts.append(agent)
+                if beva:
+                    parts.append('bevacizumab')
+                families.append({
+                    'treatment_type': modality,
+                    'treatment': ' '.join(parts),
+                    'chemo_agent': agent,
+                    'bevacizumab': beva,
+                    'doses': sorted(chemo_agents[agent]) if with_chemo else [0.0],
+                    'schemes': schemes if with_radio else [(0.0, 0)]
+                })
+    return families
+
+def optimize_treatment_expanded(
+    patient: Dict[str, Any],
+    doctor_plan: Dict[str, Any] = None,
+    chemo_agents: Dict[str, List[float]] = None,
+    radio_schemes: List[Tuple[float, int]] = None,
+    modalities: List[str] = None,
+    bevacizumab_options: List[bool] = None,
+    months: int = SIM_MONTHS
+) -> Dict[str, Any]:
+    """
+    Best regimen of the expanded space, every regimen scored
+
+    All regimens are predicted and simulated in batches of up to
+    EXPANDED_BATCH_ROWS (the default space of 366 regimens is a single
+    batch) against bases specialized to the patient. Scoring it all is
+    exact for any model and faster than pruning: the tree ensembles are not
+    monotone in dose, so no cheap bound is safe, and one batched call costs
+    less than evaluating block corners first.
+
+    Args:
+        patient: Patient data
+        doctor_plan: Current treatment plan (for comparison)
+        chemo_agents: {agent: chemo doses (mg/m2)}
+        radio_schemes: Radiotherapy configs [(total_Gy, fractions), ...]
+        modalities: Treatment types to search
+        bevacizumab_options: Search with and/or without bevacizumab add-on
+        months: Simulation horizon
+
+    Returns:
+        dict with best regimen, top regimens and search statistics
+    """
+    families = build_expanded_families(
+        chemo_agents or EXPANDED_CHEMO_AGENTS,
+        radio_schemes or EXPANDED_RADIO_SCHEMES,
+        modalities or MODALITIES,
+        BEVACIZUMAB_OPTIONS if bevacizumab_options is None else bevacizumab_options
+    )
+    candidates = [{
+        'treatment_type': family['treatment_type'],
+        'treatment': family['treatment'],
+        'chemo_agent': family['chemo_agent'],
+        'bevacizumab': family['bevacizumab'],
+        'chemo_dose_mg_per_m2': dose,
+        'radio_total_Gy': total_Gy,
+        'radio_fractions': fractions
+    } for family in families for dose in family['doses'] for total_Gy, fractions in family['schemes']]
+    T0 = float(patient.get('tumor_size_before', 3.0))
+
+    # Each batch shares the patient's static features, so predict_params_batch specializes the bases to it
+    evaluated = []
+    for start in range(0, len(candidates), EXPANDED_BATCH_ROWS):
+        evaluated += evaluate_candidates(patient, candidates[start:start + EXPANDED_BATCH_ROWS], months)
+
+    stats = {
+        'space_size': len(candidates),
+        'evaluated': len(evaluated),
+        'batches': -(-len(candidates) // EXPANDED_BATCH_ROWS)
+    }
+    ranked = sorted(evaluated, key=lambda x: x['pred_12m'])
+    best = ranked[0]
+
+    print(f"[i] Expanded search: {stats['evaluated']} regimens in {stats['batches']} batch(es)")
+    print(f"[i] Best: {best['treatment']} (chemo {best['chemo_dose_mg_per_m2']} mg/m2, "
+          f"RT {best['radio_total_Gy']} Gy/{best['radio_fractions']} fr) -> {best['pred_12m']:.2f} cm3")
+
+    result = {
+        'patient_id': patient.get('id', patient.get('patient_id', 'UNKNOWN')),
+        'best_dosage_global': best,
+        'top_results': ranked[:EXPANDED_TOP_RESULTS],
+        'doctor_plan_prediction': None,
+        'search_stats': stats
+    }
+
+    if doctor_plan:
+        doctor_dosages = extract_dosages_from_patient(doctor_plan, doctor_plan.get('treatment', ''))
+        doctor_feat = build_feature_vector(doctor_plan, doctor_plan.get('treatment', ''), dosages=doctor_dosages)
+        doctor_params = predict_params_from_features_row(doctor_feat)
+        doctor_flags = parse_treatment_flags(doctor_plan.get('treatment', ''))
+        doctor_pred, _ = simulate_gompertz_with_treatment(
+            T0, doctor_params, doctor_flags['chemo'], doctor_flags['radio'], months=months
+        )
+        result['doctor_plan_prediction'] = doctor_pred
+        result['global_improvement'] = (doctor_pred - best['pred_12m']) / doctor_pred * 100
+        print(f"[i] Current plan: {doctor_pred:.2f} cm3 ({result['global_improvement']:.1f}% improvement)")
+
+    return result
+
+# ============================================================================
+# UNCERTAINTY
+# ============================================================================
+
+def estimate_uncertainty(
+    patient: Dict[str, Any],
+    regimens: List[Dict[str, Any]],
+    doctor_plan: Optional[Dict[str, Any]] = None,
+    n_samples: int = UNCERTAINTY_SAMPLES,
+    method: str = 'dispersion',
+    interval: float = UNCERTAINTY_INTERVAL,
+    months: int = SIM_MONTHS,
+    seed: int = UNCERTAINTY_SEED
+) -> Dict[str, Any]:
+    """
+    Monte Carlo spread of the predicted volume for a list of regimens
+
+    Gompertz parameters are sampled from the base-model spread (see
+    predict_params_samples) for all regimens and the doctor's plan at once,
+    and every sample is evaluated with the closed-form solution, so the
+    whole run is a handful of array operations. Regimens and the doctor's
+    plan share the draws, which makes prob_beats_doctor a paired comparison.
+
+    Args:
+        patient: Patient data
+        regimens: Entries of `all_results` (or plans in request format)
+        doctor_plan: Current plan to compare against (optional)
+        n_samples: Samples per regimen
+        method: 'dispersion' or 'bootstrap'
+        interval: Central interval mass (0.9 -> 5th-95th percentile)
+        months: Simulation horizon
+        seed: Random seed (fixed by default, so results are reproducible)
+
+    Returns:
+        dict with one stats entry per regimen and for the doctor's plan
+    """
+    if not 0 < interval < 1:
+        raise ValueError("interval must be in (0, 1)")
+
+    rows = [resolve_regimen(r, patient) for r in regimens]
+    if doctor_plan:
+        rows.append(resolve_regimen(doctor_plan, patient))
+
+    treatments = [t for t, _, _ in rows]
+    X = build_feature_matrix([patient] * len(rows), treatments, [d for _, d, _ in rows])
+    samples = predict_params_samples(X, n_samples, method=method, seed=seed)
+
+    flags = [parse_treatment_flags(t) for t in treatments]
+    chemo = np.array([f['chemo'] for f in flags], dtype=float)[:, None]
+    radio = np.array([f['radio'] for f in flags], dtype=float)[:, None]
+    T0 = float(patient.get('tumor_size_before', 3.0))
+    V = gompertz_final_volume(T0, samples, chemo, radio, months=months)
+
+    q = (1 - interval) / 2
+    lower, median, upper = np.quantile(V, [q, 0.5, 1 - q], axis=1)
+    mean = V.mean(axis=1)
+
+    def stats(i):
+        return {
+            'mean': float(mean[i]),
+            'median': float(median[i]),
+            'lower': float(lower[i]),
+            'upper': float(upper[i])
+        }
+
+    result = {
+        'method': method,
+        'n_samples': n_samples,
+        'interval': interval,
+        'months': months,
+        'regimens': [stats(i) for i in range(len(regimens))],
+        'doctor_plan': None
+    }
+
+    if doctor_plan:
+        beats = (V[:-1] < V[-1]).mean(axis=1)
+        for i, entry in enumerate(result['regimens']):
+            entry['prob_beats_doctor'] = float(beats[i])
+        result['doctor_plan'] = stats(len(regimens))
+
+    return result
+
+# ============================================================================
+# WHAT-IF SWEEP
+# ============================================================================
+
+def resolve_regimen(
+    regimen: Optional[Dict[str, Any]],
+    patient: Dict[str, Any]
+) -> Tuple[str, Dict[str, float], int]:
+    """
+    Resolve a regimen spec into (treatment_string, dosages, radio_fractions)
+
+    Accepts either an entry of `all_results` / `best_dosage_global`
+    (treatment_type + dose fields) or a plan in the request format
+    (treatment + chemotherapy/radiotherapy blocks). Defaults to the
+    patient's own plan.
+    """
+    if not regimen:
+        regimen = patient
+
+    if 'treatment_type' in regimen:
+        treatment_string = regimen['treatment_type']
+        total_Gy = float(regimen.get('radio_total_Gy', 0))
+        fractions = int(regimen.get('radio_fractions', 0))
+        dosages = {
+            'chemo_dose_mg_per_m2': float(regimen.get('chemo_dose_mg_per_m2', 0)),
+            'radio_total_Gy': total_Gy,
+            'radio_BED': radio_bed(total_Gy, fractions)
+        }
+        return treatment_string, dosages, fractions
+
+    treatment_string = regimen.get('treatment', patient.get('treatment', ''))
+    dosages = extract_dosages_from_patient(regimen, treatment_string)
+    fractions = int(regimen.get('radiotherapy', {}).get('fractions', 30)) if dosages['radio_total_Gy'] > 0 else 0
+    return treatment_string, dosages, fractions
+
+def _sweep_axis_values(spec: Dict[str, Any]) -> np.ndarray:
+    """Values of one sweep axis: explicit `values` or `start`/`stop`/`num`"""
+    if 'values' in spec:
+        values = np.asarray(spec['values'], dtype=float)
+    elif 'start' in spec and 'stop' in spec:
+        values = np.linspace(float(spec['start']), float(spec['stop']), int(spec.get('num', 10)))
+    else:
+        raise ValueError(f"sweep axis '{spec.get('feature')}' needs 'values' or 'start'/'stop'/'num'")
+
+    if values.ndim != 1 or len(values) == 0:
+        raise ValueError(f"sweep axis '{spec.get('feature')}' has no values")
+    return values
+
+def sweep_patient_features(
+    patient: Dict[str, Any],
+    sweep: List[Dict[str, Any]],
+    regimen: Optional[Dict[str, Any]] = None,
+    months: int = SIM_MONTHS
+) -> Dict[str, Any]:
+    """
+    What-if sweep: response surface of the prediction over 1-2 patient features
+
+    All sweep points are built through the feature pipeline as one matrix,
+    predicted in one batch per base model and simulated in one vectorized pass.
+
+    Args:
+        patient: Patient data (the values that are not swept)
+        sweep: Axes, e.g. [{"feature": "steroid_dose", "values": [0, 4, 8]},
+               {"feature": "kps", "start": 50, "stop": 100, "num": 6}]
+        regimen: Regimen to evaluate (defaults to the patient's own plan)
+        months: Simulation horizon
+
+    Returns:
+        dict with axes and the predicted surface (shape = axis lengths)
+    """
+    if not sweep or len(sweep) > 2:
+        raise ValueError("sweep must contain one or two features")
+
+    axes = []
+    for spec in sweep:
+        feature = spec.get('feature')
+        if feature not in SWEEPABLE_FEATURES:
+            raise ValueError(f"feature '{feature}' cannot be swept (allowed: {', '.join(SWEEPABLE_FEATURES)})")
+        axes.append((feature, _sweep_axis_values(spec)))
+
+    if len(axes) == 2 and axes[0][0] == axes[1][0]:
+        raise ValueError("sweep features must be different")
+
+    shape = tuple(len(values) for _, values in axes)
+    n_points = int(np.prod(shape))
+    if n_points > MAX_SWEEP_POINTS:
+        raise ValueError(f"sweep has {n_points} points (max {MAX_SWEEP_POINTS})")
+
+    treatment_string, dosages, fractions = resolve_regimen(regimen, patient)
+    flags = parse_treatment_flags(treatment_string)
+
+    # Full sweep matrix (row-major over the axes)
+    grids = np.meshgrid(*[values for _, values in axes], indexing='ij')
+    points = []
+    for idx in range(n_points):
+        p = dict(patient)
+        for (feature, _), grid in zip(axes, grids):
+            p[feature] = grid.flat[idx].item()
+        points.append(p)
+
+    X = build_feature_matrix(points, [treatment_string] * n_points, [dosages] * n_points)
+    params = predict_params_batch(X)
+    T0 = np.array([float(p.get('tumor_size_before', 3.0)) for p in points])
+    pred, _ = simulate_gompertz_batch(T0, params, flags['chemo'], flags['radio'], months=months)
+
+    print(f"[i] Sweep: {' x '.join(f for f, _ in axes)} -> {n_points} points")
+
+    return {
+        'patient_id': patient.get('id', patient.get('patient_id', 'UNKNOWN')),
+        'regimen': {
+            'treatment': treatment_string,
+            'chemo_dose_mg_per_m2': dosages['chemo_dose_mg_per_m2'],
+            'radio_total_Gy': dosages['radio_total_Gy'],
+            'radio_fractions': fractions,
+            'BED': dosages['radio_BED']
+        },
+        'months': months,
+        'axes': [{'feature': f, 'values': values.tolist()} for f, values in axes],
+        'n_points': n_points,
+        'prediction': pred.reshape(shape).tolist(),
+        'params': {name: values.reshape(shape).tolist() for name, values in params.items()}
+    }
+
 # ============================================================================
 # MAIN
 # ============================================================================
@@ -469,6 +1196,16 @@ def main():
                        help='Test all treatment modalities (not just current plan)')
     parser.add_argument('--current-only', action='store_true',
                        help='Only optimize current treatment type (default: test all)')
+    parser.add_argument('--horizons', type=lambda v: [float(h) for h in v.split(',')],
+                       help='Extra prediction horizons in months, e.g. 3,6,24')
+    parser.add_argument('--objective',
+                       help="Rank by the volume at a horizon in months or by 'auc' (default: 12-month volume)")
+    parser.add_argument('--curve-points', type=int, default=0,
+                       help='Include a downsampled volume curve with this many points')
+    parser.add_argument('--schedule-aware', action='store_true',
+                       help='Simulate weekday RT fractions and chemotherapy cycles instead of constant kill rates')
+    parser.add_argument('--explain', type=int, nargs='?', const=ATTRIBUTION_TOP_K, default=0,
+                       help=f'Attribute the recommended regimen\'s parameters to the top N features (default N: {ATTRIBUTION_TOP_K})')
     args = parser.parse_args()
 
     # Load patient
@@ -482,7 +1219,12 @@ def main():
     result = optimize_treatment_with_dosage_grid(
         patient=patient,
         doctor_plan=patient,
-        test_all_modalities=test_all
+        test_all_modalities=test_all,
+        horizons=args.horizons,
+        objective=args.objective,
+        curve_points=args.curve_points,
+        schedule_aware=args.schedule_aware,
+        explain_top_k=args.explain
     )
 
     # Save output if requested
@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+gbm_optimize_treatment_sequence_v3.py
+
+Multi-stage treatment planning (v3.0 models)
+
+A plan is a sequence of stages, e.g. chemoradiation -> adjuvant TMZ ->
+second line, each with its own duration and regimen options. Which option
+is best in a later stage depends on the tumour volume that stage starts
+from, so the planner runs dynamic programming over a log-spaced grid of
+volume states instead of enumerating every sequence:
+
+    value_N(v) = v
+    value_k(v) = min over options o of value_k+1(simulate(v, o, months_k))
+
+Stage transitions (every grid state x option) are simulated in one batch
+per stage and memoized by (option, duration), so options shared between
+stages are simulated once. Gompertz parameters are predicted once per
+option from the patient's baseline features; the stage start volume only
+enters the simulation. The returned plan is rolled forward from the exact
+initial volume, and `policy` gives the best option of every stage as a
+function of its start volume (e.g. switch to lomustine above x cm3).
+
+Usage:
+    python gbm_optimize_treatment_sequence_v3.py patient.json
+"""
+
+import json
+import argparse
+from typing import Dict, Any, List, Tuple, Optional
+import numpy as np
+
+from gbm_optimize_treatment_dosage_v3 import (
+    parse_treatment_flags, build_feature_matrix, predict_params_batch,
+    simulate_gompertz_batch, radio_bed, specialize_bases, SPECIALIZE_TREES, SPECIALIZE_MIN_ROWS
+)
+from gbm_optimize_treatment_extended_dosage_v3 import (
+    MODALITIES, DEFAULT_CHEMO_DOSES, DEFAULT_RADIO_SCHEMES, EXPANDED_CHEMO_AGENTS,
+    MAX_HORIZON_MONTHS, build_expanded_families, resolve_regimen
+)
+
+# ============================================================================
+# CONFIG
+# ============================================================================
+DP_STATES = 64              # log-spaced tumour volume states
+DP_MIN_VOLUME = 0.01        # simulator floor
+MAX_STAGES = 6
+MAX_OPTIONS_PER_STAGE = 200
+
+# Standard course: concurrent chemoradiation, adjuvant TMZ, second line
+DEFAULT_STAGES = [
+    {
+        'name': 'concurrent',
+        'months': 1.5,
+        'modalities': ['chemoradiotherapy', 'radiation'],
+        'chemo_agents': {'temozolomide': [75]},
+        'radio_schemes': [[40, 15], [60, 30], [66, 33]]
+    },
+    {
+        'name': 'adjuvant',
+        'months': 6,
+        'modalities': ['chemotherapy'],
+        'chemo_agents': {'temozolomide': [100, 150, 200]},
+        'allow_observation': True
+    },
+    {
+        'name': 'second_line',
+        'months': 4.5,
+        'modalities': ['chemotherapy'],
+        'chemo_agents': {'temozolomide': [150], 'lomustine': [90, 110, 130]},
+        'bevacizumab': [False, True],
+        'allow_observation': True
+    }
+]
+
+OBSERVATION = {
+    'treatment_type': 'observation', 'treatment': '', 'chemo_agent': None, 'bevacizumab': False,
+    'chemo_dose_mg_per_m2': 0.0, 'radio_total_Gy': 0.0, 'radio_fractions': 0
+}
+
+# ============================================================================
+# STAGES
+# ============================================================================
+
+def parse_stages(specs: Optional[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """
+    Validate stage specs and enumerate their options
+
+    [
+        {
+            "name": "adjuvant",
+            "months": 6,
+            "modalities": ["chemotherapy"],                 // subset of MODALITIES
+            "chemo_agents": {"temozolomide": [150, 200]},   // agent -> doses (mg/m2)
+            "radio_schemes": [[60, 30]],                    // [total_Gy, fractions]
+            "bevacizumab": [false, true],
+            "allow_observation": true                       // no treatment in this stage
+        },
+        ...
+    ]
+
+    Missing keys fall back to the dosage-grid defaults (TMZ, standard RT
+    schemes, no bevacizumab, no observation). Raises ValueError.
+    """
+    specs = DEFAULT_STAGES if specs is None else specs
+    if not isinstance(specs, list) or not 0 < len(specs) <= MAX_STAGES:
+        raise ValueError(f"stages must be a list of 1 to {MAX_STAGES} stages")
+
+    stages = []
+    for i, spec in enumerate(specs):
+        if not isinstance(spec, dict):
+            raise ValueError("every stage must be an object")
+        name = str(spec.get('name', f'stage_{i + 1}'))
+
+        months = spec.get('months')
+        if not isinstance(months, (int, float)) or not 0 < months <= MAX_HORIZON_MONTHS:
+            raise ValueError(f"stage '{name}': months must be in (0, {MAX_HORIZON_MONTHS}]")
+
+        modalities = spec.get('modalities', MODALITIES)
+        if not isinstance(modalities, list) or any(m not in MODALITIES for m in modalities):
+            raise ValueError(f"stage '{name}': modalities must be a subset of {MODALITIES}")
+
+        agents = spec.get('chemo_agents', {'temozolomide': DEFAULT_CHEMO_DOSES})
+        if (not isinstance(agents, dict) or not agents
+                or any(a not in EXPANDED_CHEMO_AGENTS for a in agents)
+                or any(not isinstance(d, list) or not d
+                       or not all(isinstance(x, (int, float)) and 0 < x <= 500 for x in d)
+                       for d in agents.values())):
+            raise ValueError(f"stage '{name}': chemo_agents must map {list(EXPANDED_CHEMO_AGENTS)} "
+                             f"to non-empty dose lists in (0, 500] mg/m2")
+
+        schemes = spec.get('radio_schemes', DEFAULT_RADIO_SCHEMES)
+        if (not isinstance(schemes, list) or not schemes
+                or any(not isinstance(s, (list, tuple)) or len(s) != 2
+                       or not all(isinstance(x, (int, float)) for x in s)
+                       or not 0 < s[0] <= 100 or not 0 < s[1] <= 60 or not float(s[1]).is_integer()
+                       for s in schemes)):
+            raise ValueError(f"stage '{name}': radio_schemes entries must be [total_Gy in (0, 100], whole fractions in 1..60]")
+
+        beva = spec.get('bevacizumab', [False])
+        if not isinstance(beva, list) or not beva or any(not isinstance(b, bool) for b in beva):
+            raise ValueError(f"stage '{name}': bevacizumab must be a list of booleans")
+
+        families = build_expanded_families(agents, sorted({(s[0], int(s[1])) for s in schemes}),
+                                           [m for m in MODALITIES if m in modalities], sorted(set(beva)))
+        options = [{
+            'treatment_type': f['treatment_type'],
+            'treatment': f['treatment'],
+            'chemo_agent': f['chemo_agent'],
+            'bevacizumab': f['bevacizumab'],
+            'chemo_dose_mg_per_m2': dose,
+            'radio_total_Gy': total_Gy,
+            'radio_fractions': fractions
+        } for f in families for dose in f['doses'] for total_Gy, fractions in f['schemes']]
+        if spec.get('allow_observation', False):
+            options.append(dict(OBSERVATION))
+
+        if not options:
+            raise ValueError(f"stage '{name}' has no options")
+        if len(options) > MAX_OPTIONS_PER_STAGE:
+            raise ValueError(f"stage '{name}' has {len(options)} options (max {MAX_OPTIONS_PER_STAGE})")
+
+        stages.append({'name': name, 'months': float(months), 'options': options})
+
+    if sum(s['months'] for s in stages) > MAX_HORIZON_MONTHS:
+        raise ValueError(f"stages must span at most {MAX_HORIZON_MONTHS} months")
+    return stages
+
+def _option_key(option: Dict[str, Any]) -> Tuple:
+    return (option['treatment'], option['chemo_dose_mg_per_m2'],
+            option['radio_total_Gy'], option['radio_fractions'])
+
+# ============================================================================
+# TRANSITIONS
+# ============================================================================
+
+class StageTransitions:
+    """
+    Memoized stage transitions for one patient
+
+    params(): predicted Gompertz parameters per option (one batch for all
+    options not seen before). end_volumes(): volume after `months` of an
+    option from every start volume, memoized by (option, months) on the
+    state grid.
+    """
+
+    def __init__(self, patient: Dict[str, Any], options: List[Dict[str, Any]]):
+        self.patient = patient
+        self.index = {}
+        self.params = {}
+        self._grid_cache = {}
+        self.simulated = 0
+        self._predict(options)
+
+    def _predict(self, options: List[Dict[str, Any]]):
+        new = []
+        for option in options:
+            key = _option_key(option)
+            if key not in self.index:
+                self.index[key] = len(self.index)
+                new.append(option)
+        if not new:
+            return
+
+        X = build_feature_matrix(
+            [self.patient] * len(new),
+            [o['treatment'] for o in new],
+            [{'chemo_dose_mg_per_m2': o['chemo_dose_mg_per_m2'], 'radio_total_Gy': o['radio_total_Gy'],
+              'radio_BED': radio_bed(o['radio_total_Gy'], o['radio_fractions'])} for o in new]
+        )
+        evaluators = None
+        if SPECIALIZE_TREES and len(new) >= SPECIALIZE_MIN_ROWS:
+            evaluators = specialize_bases(X.values[0])
+        predicted = predict_params_batch(X, evaluators=evaluators)
+
+        flags = [parse_treatment_flags(o['treatment']) for o in new]
+        predicted['chemo'] = np.array([f['chemo'] for f in flags], dtype=float)
+        predicted['radio'] = np.array([f['radio'] for f in flags], dtype=float)
+        self.params = {name: np.concatenate([self.params[name], values]) if self.params else values
+                       for name, values in predicted.items()}
+
+    def rows(self, options: List[Dict[str, Any]]) -> np.ndarray:
+        return np.array([self.index[_option_key(o)] for o in options])
+
+    def simulate(self, starts: np.ndarray, rows: np.ndarray, months: float) -> np.ndarray:
+        """End volumes for paired (start volume, option row) arrays in one batch"""
+        p = {name: values[rows] for name, values in self.params.items()}
+        end, _ = simulate_gompertz_batch(starts, p, p['chemo'], p['radio'], months=months)
+        self.simulated += len(rows)
+        return end
+
+    def end_volumes(self, grid: np.ndarray, options: List[Dict[str, Any]], months: float) -> np.ndarray:
+        """(n_states, n_options) end volumes from every grid state"""
+        rows = self.rows(options)
+        missing = [r for r in dict.fromkeys(rows.tolist()) if (r, months) not in self._grid_cache]
+        if missing:
+            n = len(grid)
+            end = self.simulate(np.tile(grid, len(missing)), np.repeat(missing, n), months)
+            for i, r in enumerate(missing):
+                self._grid_cache[(r, months)] = end[i * n:(i + 1) * n]
+        return np.column_stack([self._grid_cache[(r, months)] for r in rows])
+
+# ============================================================================
+# PLANNER
+# ============================================================================
+
+def _policy_ranges(grid: np.ndarray, choice: np.ndarray, options: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Compress a per-state choice into volume ranges with the same option"""
+    ranges = []
+    start = 0
+    for i in range(1, len(grid) + 1):
+        if i == len(grid) or choice[i] != choice[start]:
+            ranges.append({
+                'from_volume': float(grid[start]),
+                'to_volume': float(grid[i - 1]),
+                'regimen': _regimen(options[choice[start]])
+            })
+            start = i
+    return ranges
+
+def _regimen(option: Dict[str, Any]) -> Dict[str, Any]:
+    entry = {
+        'treatment_type': option['treatment_type'],
+        'treatment': option['treatment'],
+        'chemo_agent': option['chemo_agent'],
+        'bevacizumab': option['bevacizumab'],
+        'chemo_dose_mg_per_m2': option['chemo_dose_mg_per_m2'],
+        'radio_total_Gy': option['radio_total_Gy'],
+        'radio_fractions': option['radio_fractions']
+    }
+    if option['radio_fractions']:
+        entry['BED'] = radio_bed(option['radio_total_Gy'], option['radio_fractions'])
+    return entry
+
+def optimize_treatment_sequence(
+    patient: Dict[str, Any],
+    stages: Optional[List[Dict[str, Any]]] = None,
+    doctor_plan: Optional[Dict[str, Any]] = None,
+    n_states: int = DP_STATES
+) -> Dict[str, Any]:
+    """
+    Best sequence of stage regimens, minimizing the volume at the end of the last stage
+
+    Args:
+        patient: Patient data
+        stages: Stage specs (see parse_stages), DEFAULT_STAGES if None
+        doctor_plan: Current plan, simulated over the same total duration for comparison
+        n_states: Size of the volume grid
+
+    Returns:
+        dict with the plan (one entry per stage), final volume, per-stage policy and stats
+    """
+    stages = parse_stages(stages)
+    T0 = max(float(patient.get('tumor_size_before', 3.0)), 0.1)
+    total_months = sum(s['months'] for s in stages)
+
+    print(f"\n[i] Sequential planning: {' -> '.join(s['name'] for s in stages)} ({total_months:g} months)")
+
+    transitions = StageTransitions(patient, [o for s in stages for o in s['options']])
+
+    # Volume grid: from the floor to above anything reachable
+    K_max = float(np.max(transitions.params['K']))
+    v_max = max(T0, K_max) * 1.1 ** len(stages) * 2
+    grid = np.geomspace(DP_MIN_VOLUME, v_max, n_states)
+    log_grid = np.log(grid)
+
+    # Backward pass: values[k] = best final volume from each state at the start of stage k
+    values = [None] * len(stages) + [grid]
+    policies = [None] * len(stages)
+    for k in range(len(stages) - 1, -1, -1):
+        stage = stages[k]
+        end = transitions.end_volumes(grid, stage['options'], stage['months'])
+        q = np.interp(np.log(end), log_grid, values[k + 1])
+        policies[k] = np.argmin(q, axis=1)
+        values[k] = q.min(axis=1)
+
+    # Forward pass from the exact initial volume
+    plan = []
+    v = T0
+    for k, stage in enumerate(stages):
+        options = stage['options']
+        end = transitions.simulate(np.full(len(options), v), transitions.rows(options), stage['months'])
+        if k + 1 < len(stages):
+            best = int(np.argmin(np.interp(np.log(end), log_grid, values[k + 1])))
+        else:
+            best = int(np.argmin(end))
+        plan.append({
+            'stage': stage['name'],
+            'months': stage['months'],
+            'start_volume': float(v),
+            'end_volume': float(end[best]),
+            'regimen': _regimen(options[best])
+        })
+        v = float(end[best])
+        print(f"  {stage['name']}: {options[best]['treatment'] or 'observation'} "
+              f"(chemo {options[best]['chemo_dose_mg_per_m2']:g} mg/m2, "
+              f"RT {options[best]['radio_total_Gy']:g} Gy/{options[best]['radio_fractions']} fr) "
+              f"-> {v:.2f} cm3")
+
+    n_sequences = int(np.prod([len(s['options']) for s in stages], dtype=float))
+    result = {
+        'patient_id': patient.get('id', patient.get('patient_id', 'UNKNOWN')),
+        'plan': plan,
+        'final_volume': v,
+        'total_months': total_months,
+        'policy': [{'stage': s['name'], 'ranges': _policy_ranges(grid, policies[k], s['options'])}
+                   for k, s in enumerate(stages)],
+        'search_stats': {
+            'sequences': n_sequences,
+            'options': len(transitions.index),
+            'states': n_states,
+            'simulated_transitions': transitions.simulated
+        },
+        'doctor_plan_prediction': None
+    }
+
+    if doctor_plan:
+        treatment, dosages, _ = resolve_regimen(doctor_plan, patient)
+        X = build_feature_matrix([patient], [treatment], [dosages])
+        params = predict_params_batch(X)
+        flags = parse_treatment_flags(treatment)
+        doctor_pred, _ = simulate_gompertz_batch(T0, params, flags['chemo'], flags['radio'], months=total_months)
+        result['doctor_plan_prediction'] = float(doctor_pred[0])
+        result['improvement'] = (result['doctor_plan_prediction'] - v) / result['doctor_plan_prediction'] * 100
+        print(f"[i] Doctor's plan over {total_months:g} months: {result['doctor_plan_prediction']:.2f} cm3, "
+              f"sequence: {v:.2f} cm3 ({result['improvement']:.1f}%)")
+
+    return result
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description='GBM multi-stage treatment planning v3.0')
+    parser.add_argument('patient_json', help='Path to patient JSON file')
+    parser.add_argument('--stages', help='JSON file with stage specs (default: standard course)')
+    parser.add_argument('--output', '-o', help='Output JSON file (optional)')
+    args = parser.parse_args()
+
+    with open(args.patient_json, 'r', encoding='utf-8') as f:
+        patient = json.load(f)
+
+    stages = None
+    if args.stages:
+        with open(args.stages, 'r', encoding='utf-8') as f:
+            stages = json.load(f)
+
+    result = optimize_treatment_sequence(patient, stages=stages, doctor_plan=patient)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"\n[i] Results saved to: {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+gbm_score_cohort_v3.py
+
+Cohort batch scoring (v3.0 models)
+
+Runs the dosage-grid optimizer for every patient of a cohort and writes one
+summary record per patient. Patients are split into fixed chunks that are
+scored across a process pool; each worker loads the models once (pool
+initializer) and scores whole chunks, so per-task overhead is one pickle of
+a chunk. Every finished chunk is written atomically as its own part file
+next to a manifest, so an interrupted run resumes by skipping the parts that
+already exist:
+
+    out_dir/
+        _manifest.json
+        part-00000.ndjson    (or .parquet, needs pyarrow)
+        part-00001.ndjson
+        ...
+
+Read back with `cat out_dir/part-*.ndjson` or pd.read_parquet(out_dir).
+
+Input: a directory of patient JSON files, a JSON file (one patient or a
+list), NDJSON, CSV or Excel (every data sheet; the sheet name becomes
+`stage`, as in training; sheets without the patient columns, such as the
+description sheet, are skipped). Table columns map to patient fields;
+dotted columns are nested (`chemotherapy.dose_mg_per_m2`), empty cells are
+omitted. Table rows without a patient id or tumor_size_before are reported
+as error records instead of being scored.
+
+Usage:
+    python gbm_score_cohort_v3.py cohort.xlsx -o scores/ --workers 8
+    python gbm_score_cohort_v3.py test_patients -o scores/ --format parquet
+"""
+
+import os
+import sys
+import io
+import json
+import time
+import argparse
+import importlib.util
+import contextlib
+import warnings
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+import pandas as pd
+
+# ============================================================================
+# CONFIG
+# ============================================================================
+DEFAULT_CHUNK_SIZE = 32
+OUTPUT_FORMATS = ('ndjson', 'parquet')
+DEFAULT_FORMAT = 'ndjson'  # needs no extra package; parquet needs pyarrow
+REQUIRED_COLUMNS = ('patient_id', 'tumor_size_before')  # a table row without them is no patient
+MANIFEST_FILE = '_manifest.json'  # leading underscore: skipped by pd.read_parquet(out_dir)
+
+# Summary columns (fixed so every part file has the same schema)
+SUMMARY_COLUMNS = {
+    'patient_id': 'string',
+    'status': 'string',
+    'error': 'string',
+    'doctor_treatment_type': 'string',
+    'doctor_pred_12m': 'float64',
+    'best_treatment_type': 'string',
+    'best_chemo_dose_mg_per_m2': 'float64',
+    'best_radio_total_Gy': 'float64',
+    'best_radio_fractions': 'float64',
+    'best_pred_12m': 'float64',
+    'global_improvement': 'float64',
+    'local_treatment_type': 'string',
+    'local_chemo_dose_mg_per_m2': 'float64',
+    'local_radio_total_Gy': 'float64',
+    'local_radio_fractions': 'float64',
+    'local_pred_12m': 'float64',
+    'local_improvement': 'float64',
+    'tested_regimens': 'float64',
+    'follow_up_r_fit': 'float64',
+    'follow_up_K_fit': 'float64',
+    'seconds': 'float64',
+    'result_json': 'string'
+}
+
+# ============================================================================
+# INPUT
+# ============================================================================
+
+def _row_to_patient(row: Dict[str, Any], index: int) -> Dict[str, Any]:
+    """Table row -> patient dict (empty cells dropped, dotted columns nested)"""
+    patient = {}
+    for column, value in row.items():
+        if value is None or (isinstance(value, float) and np.isnan(value)):
+            continue
+        if isinstance(value, np.generic):
+            value = value.item()
+        *parents, leaf = str(column).split('.')
+        target = patient
+        for parent in parents:
+            target = target.setdefault(parent, {})
+        target[leaf] = value
+
+    missing = [column for column in REQUIRED_COLUMNS
+               if column not in patient and not (column == 'patient_id' and 'id' in patient)]
+    if 'id' not in patient:
+        patient['id'] = str(patient.get('patient_id', f"row_{index}"))
+    if missing:
+        patient['input_error'] = f"row {index}: missing {', '.join(missing)}"
+    return patient
+
+def read_data_sheets(path: str) -> pd.DataFrame:
+    """Sheets of a workbook that have the patient columns, stacked, with the sheet name as `stage`"""
+    xls = pd.ExcelFile(path)
+    frames = []
+    for sheet in xls.sheet_names:
+        frame = pd.read_excel(xls, sheet)
+        if all(column in frame.columns for column in REQUIRED_COLUMNS):
+            frames.append(frame.assign(stage=str(sheet)))
+        else:
+            print(f"[i] Skipping sheet '{sheet}' (no {'/'.join(REQUIRED_COLUMNS)} columns)")
+    if not frames:
+        raise ValueError(f"No sheet of {path} has the columns {', '.join(REQUIRED_COLUMNS)}")
+    return pd.concat(frames, ignore_index=True)
+
+def read_patients(source: str) -> List[Dict[str, Any]]:
+    """Load a cohort from a directory, JSON, NDJSON, CSV or Excel file"""
+    if os.path.isdir(source):
+        patients = []
+        for name in sorted(os.listdir(source)):
+            if name.endswith('.json'):
+                patients.extend(read_patients(os.path.join(source, name)))
+        return patients
+
+    ext = os.path.splitext(source)[1].lower()
+    if ext in ('.ndjson', '.jsonl'):
+        with open(source, 'r', encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+    if ext == '.json':
+        with open(source, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return data if isinstance(data, list) else [data]
+    if ext == '.csv':
+        frame = pd.read_csv(source)
+    elif ext in ('.xlsx', '.xls'):
+        frame = read_data_sheets(source)
+    else:
+        raise ValueError(f"Unsupported input: {source} (directory, .json, .ndjson, .csv or .xlsx)")
+
+    return [_row_to_patient(row, i) for i, row in enumerate(frame.to_dict('records'))]
+
+# ============================================================================
+# WORKER
+# ============================================================================
+
+_optimize = None
+
+def _init_worker() -> None:
+    """Load the models once per process (console output of the import suppressed)"""
+    global _optimize
+    warnings.filterwarnings('ignore')
+    with contextlib.redirect_stdout(io.StringIO()):
+        from gbm_optimize_treatment_extended_dosage_v3 import optimize_treatment_with_dosage_grid
+    _optimize = optimize_treatment_with_dosage_grid
+
+def _regimen_fields(prefix: str, entry: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    entry = entry or {}
+    return {
+        f'{prefix}_treatment_type': entry.get('treatment_type'),
+        f'{prefix}_chemo_dose_mg_per_m2': entry.get('chemo_dose_mg_per_m2'),
+        f'{prefix}_radio_total_Gy': entry.get('radio_total_Gy'),
+        f'{prefix}_radio_fractions': entry.get('radio_fractions'),
+        f'{prefix}_pred_12m': entry.get('pred_12m')
+    }
+
+def summarize_result(patient_id: str, result: Dict[str, Any], seconds: float,
+                     full: bool = False) -> Dict[str, Any]:
+    """One flat record per patient"""
+    follow_up_fit = result.get('follow_up_fit') or {}
+    record = {
+        'patient_id': patient_id,
+        'status': 'ok',
+        'error': None,
+        'doctor_treatment_type': result.get('doctor_treatment_type'),
+        'doctor_pred_12m': result.get('doctor_plan_prediction'),
+        **_regimen_fields('best', result.get('best_dosage_global')),
+        'global_improvement': result.get('global_improvement'),
+        **_regimen_fields('local', result.get('best_dosage_local')),
+        'local_improvement': result.get('local_improvement'),
+        'tested_regimens': result['optimization_summary']['tested_regimens'],
+        'follow_up_r_fit': follow_up_fit.get('r_fit'),
+        'follow_up_K_fit': follow_up_fit.get('K_fit'),
+        'seconds': seconds,
+        'result_json': json.dumps(result, ensure_ascii=False, default=float) if full else None
+    }
+    return record
+
+def score_chunk(patients: List[Dict[str, Any]], options: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Score a chunk of patients in this process; failures become error records"""
+    if _optimize is None:
+        _init_worker()
+
+    records = []
+    for patient in patients:
+        patient_id = str(patient.get('id', ''))
+        if 'input_error' in patient:
+            records.append({'patient_id': patient_id, 'status': 'error',
+                            'error': f"InputError: {patient['input_error']}", 'seconds': 0.0})
+            continue
+        start = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = _optimize(
+                    patient=patient,
+                    doctor_plan=patient,
+                    test_all_modalities=not options.get('current_only', False),
+                    schedule_aware=options.get('schedule_aware', False),
+                    n_similar=0
+                )
+            records.append(summarize_result(patient_id, result, time.perf_counter() - start,
+                                            full=options.get('full', False)))
+        except Exception as e:
+            records.append({'patient_id': patient_id, 'status': 'error',
+                            'error': f"{type(e).__name__}: {e}", 'seconds': time.perf_counter() - start})
+    return records
+
+def _score_chunk_task(index: int, patients: List[Dict[str, Any]], options: Dict[str, Any]):
+    return index, score_chunk(patients, options)
+
+# ============================================================================
+# OUTPUT
+# ============================================================================
+
+def part_path(out_dir: str, index: int, fmt: str) -> str:
+    return os.path.join(out_dir, f"part-{index:05d}.{fmt}")
+
+def write_part(records: List[Dict[str, Any]], path: str, fmt: str) -> None:
+    """Write one chunk atomically (temp file + rename)"""
+    tmp = path + '.tmp'
+    if fmt == 'parquet':
+        frame = pd.DataFrame(records, columns=list(SUMMARY_COLUMNS)).astype(SUMMARY_COLUMNS)
+        frame.to_parquet(tmp, index=False)
+    else:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            for record in records:
+                row = {column: record.get(column) for column in SUMMARY_COLUMNS}
+                f.write(json.dumps(row, ensure_ascii=False, default=float) + '\n')
+    os.replace(tmp, path)
+
+def prepare_output(out_dir: str, manifest: Dict[str, Any], resume: bool) -> List[int]:
+    """Create/check the output directory; returns the chunk indices already written"""
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, MANIFEST_FILE)
+
+    if os.path.exists(manifest_path):
+        if not resume:
+            raise ValueError(f"{out_dir} already has a scoring run (use --resume or another directory)")
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+        if previous != manifest:
+            raise ValueError(f"{out_dir} was written with different inputs or options; cannot resume")
+    else:
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+
+    return [i for i in range(manifest['n_chunks'])
+            if os.path.exists(part_path(out_dir, i, manifest['format']))]
+
+# ============================================================================
+# DRIVER
+# ============================================================================
+
+def score_cohort(
+    patients: List[Dict[str, Any]],
+    out_dir: str,
+    workers: int = 1,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    fmt: str = DEFAULT_FORMAT,
+    options: Optional[Dict[str, Any]] = None,
+    resume: bool = False,
+    source: str = ''
+) -> Dict[str, Any]:
+    """
+    Score a cohort into out_dir, chunk by chunk
+
+    Returns dict with counts ('patients', 'chunks', 'skipped_chunks', 'errors')
+    and throughput ('seconds', 'patients_per_second').
+    """
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"format must be one of {OUTPUT_FORMATS}")
+    if fmt == 'parquet' and importlib.util.find_spec('pyarrow') is None:
+        raise ValueError("parquet output needs pyarrow (pip install pyarrow); use the ndjson format instead")
+    if chunk_size < 1 or workers < 1:
+        raise ValueError("chunk_size and workers must be >= 1")
+    options = options or {}
+
+    chunks = [patients[i:i + chunk_size] for i in range(0, len(patients), chunk_size)]
+    manifest = {
+        'source': source,
+        'n_patients': len(patients),
+        'patient_ids_head': [str(p.get('id', '')) for p in patients[:5]],
+        'chunk_size': chunk_size,
+        'n_chunks': len(chunks),
+        'format': fmt,
+        'options': options
+    }
+    done = set(prepare_output(out_dir, manifest, resume))
+    todo = [i for i in range(len(chunks)) if i not in done]
+    if done:
+        print(f"[i] Resuming: {len(done)}/{len(chunks)} chunks already written")
+
+    start = time.perf_counter()
+    scored = errors = 0
+
+    def finish(index, records):
+        nonlocal scored, errors
+        write_part(records, part_path(out_dir, index, fmt), fmt)
+        scored += len(records)
+        errors += sum(r['status'] == 'error' for r in records)
+        elapsed = time.perf_counter() - start
+        print(f"[i] Chunk {index + 1}/{len(chunks)} written "
+              f"({scored} patients, {scored / elapsed:.1f} patients/s)")
+
+    if workers == 1 or len(todo) <= 1:
+        for i in todo:
+            finish(i, score_chunk(chunks[i], options))
+    else:
+        # spawn: clean workers (no inherited BLAS/OpenMP state) on every platform
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                 initializer=_init_worker) as pool:
+            futures = [pool.submit(_score_chunk_task, i, chunks[i], options) for i in todo]
+            for future in as_completed(futures):
+                finish(*future.result())
+
+    elapsed = time.perf_counter() - start
+    return {
+        'patients': len(patients),
+        'scored': scored,
+        'chunks': len(chunks),
+        'skipped_chunks': len(done),
+        'errors': errors,
+        'seconds': elapsed,
+        'patients_per_second': scored / elapsed if elapsed > 0 else 0.0
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='GBM cohort batch scoring v3.0')
+    parser.add_argument('source', help='Patients: directory of JSON files, .json, .ndjson, .csv or .xlsx')
+    parser.add_argument('--output', '-o', required=True, help='Output directory (part files + manifest)')
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default=DEFAULT_FORMAT,
+                       help=f'Part file format (default: {DEFAULT_FORMAT}; parquet needs pyarrow)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                       help='Worker processes (default: all cores)')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                       help=f'Patients per task and part file (default: {DEFAULT_CHUNK_SIZE})')
+    parser.add_argument('--resume', action='store_true',
+                       help='Continue an interrupted run in the same output directory')
+    parser.add_argument('--current-only', action='store_true',
+                       help='Only optimize each patient\'s current treatment type (default: test all)')
+    parser.add_argument('--schedule-aware', action='store_true',
+                       help='Simulate weekday RT fractions and chemotherapy cycles')
+    parser.add_argument('--full', action='store_true',
+                       help='Also store the full optimizer result as JSON (result_json column)')
+    args = parser.parse_args()
+
+    patients = read_patients(args.source)
+    print(f"[i] Loaded {len(patients)} patients from {args.source}")
+
+    # One BLAS/OpenMP thread per worker process; parallelism comes from the pool
+    if args.workers > 1:
+        for var in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS'):
+            os.environ.setdefault(var, '1')
+
+    options = {'current_only': args.current_only, 'schedule_aware': args.schedule_aware, 'full': args.full}
+    try:
+        stats = score_cohort(patients, args.output, workers=args.workers, chunk_size=args.chunk_size,
+                             fmt=args.format, options=options, resume=args.resume,
+                             source=os.path.abspath(args.source))
+    except ValueError as e:
+        sys.exit(f"Error: {e}")
+
+    print(f"\n[OK] Scored {stats['scored']} patients in {stats['seconds']:.1f} s "
+          f"({stats['patients_per_second']:.1f} patients/s, {stats['errors']} errors)")
+    print(f"[i] Results: {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -13,78 +13,120 @@
 #
 # TOTAL: ~120+ features instead of 76
 
-import os, time, warnings, re
-from typing import List, Tuple, Dict, Any
+import os, sys, io, time, warnings, re, argparse, itertools
+from typing import List, Tuple, Dict, Any, Optional
 import numpy as np
 import pandas as pd
-from scipy.optimize import curve_fit
+import sklearn
 from sklearn.preprocessing import OneHotEncoder, StandardScaler
-from sklearn.ensemble import GradientBoostingRegressor, RandomForestRegressor, ExtraTreesRegressor
-from sklearn.linear_model import Ridge
+from sklearn.ensemble import GradientBoostingRegressor, HistGradientBoostingRegressor, RandomForestRegressor, ExtraTreesRegressor
+from sklearn.linear_model import Ridge, LinearRegression
 from sklearn.model_selection import KFold
 from sklearn.metrics import r2_score, mean_absolute_error
 from sklearn.neural_network import MLPRegressor
-from joblib import dump
+from sklearn.neighbors import BallTree
+from joblib import dump, load, Parallel, delayed
+from threadpoolctl import threadpool_limits
 import json
+import gbm_drift_monitor
+import gbm_gompertz_fit
+import gbm_multi_output
+from gbm_checkpoint import StageRunner
+from gbm_dataset_cache import load_workbook_cached, file_checksum
+from gbm_multi_output import OutputColumn, fit_standardized, output_columns
+from gbm_drift_monitor import build_drift_reference
+from gbm_gompertz_fit import fit_gompertz_with_fallback, K_MAX as GOMPERTZ_K_MAX, FOLLOW_UP_COLUMNS
 warnings.filterwarnings("ignore")
 
 # ------------------ CONFIG ------------------
 INPUT_XLSX = "glioblastoma_data.xlsx"
 OUTDIR = "gbm_models_output_all90_dosage_full_features"
+DATA_CACHE_DIR = "data_cache"  # Feather copy of INPUT_XLSX, rebuilt when the workbook changes
+CHECKPOINT_DIR = "checkpoints" # per-stage results, reused while their inputs, config and code are unchanged
 CV_FOLDS = 5
-GOMPERTZ_MAXFEV = 5000
+GOMPERTZ_MAXFEV = 5000    # curve_fit budget of the fallback for rows the batched fit does not converge on
+GOMPERTZ_WORKERS = None   # processes for that fallback (None = all cores)
 N_EST_GBR = 200
 N_EST_RF = 180
 N_EST_ET = 150
 MLP_HIDDEN = (256, 128, 64)
 STACKER_ALPHA = 0.1
-USE_XGBOOST = True
+STACKER_ALPHAS = (0.001, 0.01, 0.1, 1.0, 10.0)  # Ridge strengths compared by --meta-only
+OOF_FILE = "oof_predictions.joblib"             # OOF matrices, folds and timings saved in OUTDIR
+BASE_LEARNERS = ('xgb', 'gbr', 'rf', 'et', 'mlp')  # stacked base models (BASE_LEARNER_REGISTRY names), in meta-input order
+MULTI_OUTPUT_LEARNERS = ()  # base models of BASE_LEARNERS fitted once for all four targets, e.g. ('rf', 'et', 'mlp')
+BASE_PARAMS = {           # base-model settings (the search below explores alternatives)
+    'xgb': {'n_estimators': 200, 'max_depth': 6, 'learning_rate': 0.05, 'subsample': 0.8},
+    'gbr': {'n_estimators': N_EST_GBR, 'max_depth': 5, 'learning_rate': 0.05, 'subsample': 0.8},
+    'hgb': {'max_iter': 200, 'max_depth': 6, 'learning_rate': 0.05, 'early_stopping': False},
+    'rf': {'n_estimators': N_EST_RF, 'max_depth': 15, 'min_samples_split': 4},
+    'et': {'n_estimators': N_EST_ET, 'max_depth': 15, 'min_samples_split': 4},
+    'mlp': {'hidden_layer_sizes': MLP_HIDDEN, 'max_iter': 500, 'early_stopping': True}
+}
+SEARCH_SPACE = {          # --search: values tried per base model and target
+    'xgb': {'n_estimators': [100, 200, 400], 'max_depth': [4, 6, 8], 'learning_rate': [0.05, 0.1]},
+    'gbr': {'n_estimators': [100, 200, 400], 'max_depth': [3, 5]},
+    'hgb': {'max_iter': [100, 200, 400], 'max_depth': [4, 6, None], 'learning_rate': [0.05, 0.1]},
+    'rf': {'n_estimators': [90, 180, 360], 'max_depth': [10, 15, None]},
+    'et': {'n_estimators': [75, 150, 300], 'max_depth': [10, 15, None]},
+    'mlp': {'hidden_layer_sizes': [(128, 64), (256, 128, 64)], 'alpha': [1e-4, 1e-3]}
+}
+SEARCH_ETA = 3            # successive halving: the best 1/ETA of each rung is promoted
+SEARCH_BUDGET_SECONDS = 1800  # wall-clock limit of --search (override with --budget)
+TRAIN_CORES = None        # core budget for the base-model fits, shared by workers and their threads (None = all cores)
+RANDOM_SEED = 42          # seeds the target noise generator
+SIMILAR_INFO_COLS = ['stage', 'age', 'gender', 'kps', 'treatment', 'resection_extent',
+                     'mgmt_methylation', 'idh_mutation', 'rano_response',
+                     'survival_months', 'time_to_progression']
 # --------------------------------------------
 
-os.makedirs(OUTDIR, exist_ok=True)
-np.random.seed(42)
-t0 = time.time()
-
-print("="*80)
-print("GBM TREATMENT OPTIMIZATION - ENHANCED TRAINING v3.0")
-print("="*80)
-print(f"NEW: All available features (neurological, genetic, clinical)")
-print(f"Output directory: {OUTDIR}")
-print("="*80)
-
 # ---------- helpers ----------
-def parse_treatment_flags(tstr):
-    """Extract binary treatment flags with SPECIFIC drug detection"""
-    t = str(tstr).lower() if not pd.isna(tstr) else ""
-
-    # Main categories
-    flags = {
-        'chemo': int('temozolomide' in t or 'tmz' in t or 'chem' in t),
-        'radio': int('radiation' in t or 'radiotherapy' in t or 'rt' in t or 'radiother' in t),
-        'beva': int('bevacizumab' in t or 'beva' in t),
-        'other_drug': int(('lomustine' in t or 'ccnu' in t or 'carboplatin' in t or 'etoposide' in t or 'irinotecan' in t))
-    }
-
-    # Specific drug types
-    flags['drug_temozolomide'] = int('temozolomide' in t or 'tmz' in t)
-    flags['drug_lomustine'] = int('lomustine' in t or 'ccnu' in t)
-    flags['drug_carboplatin'] = int('carboplatin' in t)
-    flags['drug_etoposide'] = int('etoposide' in t)
-    flags['drug_irinotecan'] = int('irinotecan' in t)
-    flags['drug_bevacizumab'] = int('bevacizumab' in t or 'beva' in t)
-
-    return flags
-
-def parse_dosage_features(tstr) -> Dict[str, float]:
-    """Extract concrete dosages from treatment string"""
-    t = str(tstr).lower() if not pd.isna(tstr) else ""
-
-    result = {
-        'chemo_dose_mg_per_m2': 0.0,
-        'radio_total_Gy': 0.0,
-        'radio_fractions': 0.0,
-        'radio_BED': 0.0
-    }
+def _lower_text(col: pd.Series) -> pd.Series:
+    """Lower-cased strings of a column, missing values as empty strings"""
+    return col.astype(object).where(col.notna(), '').astype(str).str.lower()
+
+def _contains(s: pd.Series, *words) -> pd.Series:
+    """Rows containing any of the (literal) words"""
+    return s.str.contains('|'.join(re.escape(w) for w in words), regex=True)
+
+def parse_treatment_flags(treatments: pd.Series) -> pd.DataFrame:
+    """Extract binary treatment flags with SPECIFIC drug detection (whole column)"""
+    t = _lower_text(treatments)
+    temozolomide = _contains(t, 'temozolomide', 'tmz')
+    lomustine = _contains(t, 'lomustine', 'ccnu')
+    carboplatin = _contains(t, 'carboplatin')
+    etoposide = _contains(t, 'etoposide')
+    irinotecan = _contains(t, 'irinotecan')
+    bevacizumab = _contains(t, 'bevacizumab', 'beva')
+
+    flags = pd.DataFrame({
+        # Main categories
+        'chemo': temozolomide | _contains(t, 'chem'),
+        'radio': _contains(t, 'radiation', 'radiotherapy', 'rt', 'radiother'),
+        'beva': bevacizumab,
+        'other_drug': lomustine | carboplatin | etoposide | irinotecan,
+
+        # Specific drug types
+        'drug_temozolomide': temozolomide,
+        'drug_lomustine': lomustine,
+        'drug_carboplatin': carboplatin,
+        'drug_etoposide': etoposide,
+        'drug_irinotecan': irinotecan,
+        'drug_bevacizumab': bevacizumab
+    })
+    return flags.astype(int)
+
+def _first_match(t: pd.Series, patterns) -> pd.DataFrame:
+    """Groups of the first pattern (in order) that matches each row, NaN where none does"""
+    found = None
+    for pattern in patterns:
+        groups = t.str.extract(pattern, expand=True)
+        found = groups if found is None else found.combine_first(groups)
+    return found.astype(float)
+
+def parse_dosage_features(treatments: pd.Series) -> pd.DataFrame:
+    """Extract concrete dosages from treatment strings (whole column)"""
+    t = _lower_text(treatments)
 
     # Extract chemotherapy dose
     chemo_patterns = [
@@ -93,11 +135,7 @@ def parse_dosage_features(tstr) -> Dict[str, float]:
         r'temozolomide\s+(\d+)',
         r'tmz\s+(\d+)'
     ]
-    for pattern in chemo_patterns:
-        match = re.search(pattern, t)
-        if match:
-            result['chemo_dose_mg_per_m2'] = float(match.group(1))
-            break
+    chemo = _first_match(t, chemo_patterns)
 
     # Extract radiotherapy dose and fractions
     radio_patterns = [
@@ -106,70 +144,48 @@ def parse_dosage_features(tstr) -> Dict[str, float]:
         r'radiation\s+(\d+)\s*gy.*?(\d+)\s*fr',
         r'(\d+)\s*gy.*?(\d+)\s*fraction'
     ]
-    for pattern in radio_patterns:
-        match = re.search(pattern, t)
-        if match:
-            result['radio_total_Gy'] = float(match.group(1))
-            result['radio_fractions'] = float(match.group(2))
-            break
+    radio = _first_match(t, radio_patterns)
+
+    result = pd.DataFrame({
+        'chemo_dose_mg_per_m2': chemo[0].fillna(0.0),
+        'radio_total_Gy': radio[0].fillna(0.0),
+        'radio_fractions': radio[1].fillna(0.0)
+    })
 
     # Calculate BED (Biologically Effective Dose)
-    if result['radio_total_Gy'] > 0 and result['radio_fractions'] > 0:
-        n = result['radio_fractions']
-        d = result['radio_total_Gy'] / n
-        # BED = n * d * (1 + d/(α/β)), where α/β = 10 Gy for GBM
-        result['radio_BED'] = n * d * (1 + d / 10.0)
+    # BED = n * d * (1 + d/(α/β)), where α/β = 10 Gy for GBM
+    n = result['radio_fractions']
+    has_radio = (result['radio_total_Gy'] > 0) & (n > 0)
+    d = result['radio_total_Gy'] / n.where(has_radio, 1.0)
+    result['radio_BED'] = (n * d * (1 + d / 10.0)).where(has_radio, 0.0)
 
     return result
 
-def parse_neurological_symptoms(symptom_str) -> Dict[str, int]:
+def parse_neurological_symptoms(symptoms: pd.Series) -> pd.DataFrame:
     """
-    NEW FUNCTION: Parse neurological symptoms into binary flags
+    NEW FUNCTION: Parse neurological symptoms into binary flags (whole column)
 
     Input: "headache, motor_deficit, seizures"
-    Output: {
-        'has_headache': 1,
-        'has_motor_deficit': 1,
-        'has_seizures': 1,
-        'has_sensory_deficit': 0,
-        'has_cognitive_decline': 0,
-        'has_speech_disturbance': 0,
-        'has_visual_disturbance': 0,
-        'symptom_count': 3
-    }
+    Output row: has_headache=1, has_motor_deficit=1, has_seizures=1,
+    has_sensory_deficit=0, has_cognitive_decline=0, has_speech_disturbance=0,
+    has_visual_disturbance=0, symptom_count=3
     """
-    s = str(symptom_str).lower() if not pd.isna(symptom_str) else ""
-
-    symptoms = {
-        'has_headache': int('headache' in s),
-        'has_motor_deficit': int('motor_deficit' in s or 'motor deficit' in s),
-        'has_seizures': int('seizure' in s),
-        'has_sensory_deficit': int('sensory_deficit' in s or 'sensory deficit' in s),
-        'has_cognitive_decline': int('cognitive' in s),
-        'has_speech_disturbance': int('speech' in s),
-        'has_visual_disturbance': int('visual' in s)
-    }
+    s = _lower_text(symptoms)
+
+    flags = pd.DataFrame({
+        'has_headache': _contains(s, 'headache'),
+        'has_motor_deficit': _contains(s, 'motor_deficit', 'motor deficit'),
+        'has_seizures': _contains(s, 'seizure'),
+        'has_sensory_deficit': _contains(s, 'sensory_deficit', 'sensory deficit'),
+        'has_cognitive_decline': _contains(s, 'cognitive'),
+        'has_speech_disturbance': _contains(s, 'speech'),
+        'has_visual_disturbance': _contains(s, 'visual')
+    }).astype(int)
 
     # Count total symptoms (0 if asymptomatic)
-    if 'asymptomatic' in s:
-        symptoms['symptom_count'] = 0
-    else:
-        symptoms['symptom_count'] = sum(symptoms.values())
-
-    return symptoms
+    flags['symptom_count'] = flags.sum(axis=1).where(~_contains(s, 'asymptomatic'), 0)
 
-def fit_gompertz(times, sizes, T0):
-    """Fit Gompertz model: V(t) = T0 * (K/T0)^(1 - exp(-r*t))"""
-    def gompertz(t, r, K):
-        return T0 * (K / T0) ** (1 - np.exp(-r * t))
-
-    try:
-        p0 = [0.05, max(sizes) * 1.2]
-        bounds = ([1e-6, T0], [0.5, 20.0])
-        popt, _ = curve_fit(gompertz, times, sizes, p0=p0, bounds=bounds, maxfev=GOMPERTZ_MAXFEV)
-        return popt
-    except:
-        return [np.nan, np.nan]
+    return flags
 
 def safe_numeric_cast(df):
     for c in df.columns:
@@ -184,497 +200,1178 @@ def mape(true, pred):
     mask = np.abs(true) > 1e-3
     return np.mean(np.abs((true[mask] - pred[mask]) / true[mask])) * 100.0 if mask.sum() > 0 else np.nan
 
-# ---------- load & process data ----------
-print("\nLoading Excel:", INPUT_XLSX)
-xls = pd.ExcelFile(INPUT_XLSX)
-frames = [pd.read_excel(xls, sh).assign(stage=str(sh)) for sh in xls.sheet_names]
-df = pd.concat(frames, ignore_index=True)
-print(f"Loaded {len(xls.sheet_names)} sheets, {len(df)} rows")
-
-# Parse treatment flags (binary)
-print("Parsing treatment flags...")
-tflags = df['treatment'].apply(parse_treatment_flags).apply(pd.Series)
-df = pd.concat([df, tflags], axis=1)
-
-# Parse dosage features
-print("Extracting dosage features from treatment strings...")
-dosages = df['treatment'].apply(parse_dosage_features).apply(pd.Series)
-df = pd.concat([df, dosages], axis=1)
-
-# NEW: Parse neurological symptoms
-print("Parsing neurological symptoms...")
-neuro_symptoms = df['neurological_symptoms'].apply(parse_neurological_symptoms).apply(pd.Series)
-df = pd.concat([df, neuro_symptoms], axis=1)
-
-# Fill missing dosages with defaults based on treatment flags
-default_chemo_dose = 75.0
-default_radio_dose = 60.0
-default_radio_fractions = 30.0
-
-for idx, row in df.iterrows():
-    if row['chemo'] == 1 and row['chemo_dose_mg_per_m2'] == 0:
-        df.at[idx, 'chemo_dose_mg_per_m2'] = default_chemo_dose
-
-    if row['radio'] == 1 and row['radio_total_Gy'] == 0:
-        df.at[idx, 'radio_total_Gy'] = default_radio_dose
-        df.at[idx, 'radio_fractions'] = default_radio_fractions
-        n = default_radio_fractions
-        d = default_radio_dose / n
-        df.at[idx, 'radio_BED'] = n * d * (1 + d / 10.0)
-
-print(f"Dosage features extracted:")
-print(f"  Chemo doses: min={df['chemo_dose_mg_per_m2'].min():.1f}, max={df['chemo_dose_mg_per_m2'].max():.1f}, median={df['chemo_dose_mg_per_m2'].median():.1f}")
-print(f"  Radio doses: min={df['radio_total_Gy'].min():.1f}, max={df['radio_total_Gy'].max():.1f}, median={df['radio_total_Gy'].median():.1f}")
-print(f"  Radio BED: min={df['radio_BED'].min():.1f}, max={df['radio_BED'].max():.1f}, median={df['radio_BED'].median():.1f}")
-print(f"\nNeurological symptoms extracted:")
-print(f"  Symptom count: min={df['symptom_count'].min():.0f}, max={df['symptom_count'].max():.0f}, mean={df['symptom_count'].mean():.1f}")
-
-# ---------- fit gompertz ----------
-print("\nFitting Gompertz...")
-time_cols = [('tumor_size_2m',2), ('tumor_size_4m',4), ('tumor_size_6m',6), ('tumor_size_12m',12)]
-fit_rows = []
-
-for idx, row in df.iterrows():
-    pid = row.get('patient_id', f"idx_{idx}")
-    T0 = row.get('tumor_size_before', np.nan)
-
-    if pd.isna(T0) or T0 <= 0:
-        fit_rows.append({'patient_id': pid, 'r_fit': np.nan, 'K_fit': np.nan, 'n_obs': 0})
-        continue
-
-    times, sizes = [0.0], [float(T0)]
-    for col, t in time_cols:
-        if col in row and not pd.isna(row[col]):
-            try:
-                sizes.append(float(row[col]))
-                times.append(float(t))
-            except:
-                pass
-
-    if len(times) >= 3:
-        try:
-            r_k = fit_gompertz(times, sizes, T0)
-            fit_rows.append({'patient_id': pid, 'r_fit': r_k[0], 'K_fit': r_k[1], 'n_obs': len(times)})
-        except:
-            fit_rows.append({'patient_id': pid, 'r_fit': np.nan, 'K_fit': np.nan, 'n_obs': len(times)})
-    else:
-        fit_rows.append({'patient_id': pid, 'r_fit': np.nan, 'K_fit': np.nan, 'n_obs': len(times)})
-
-fitted_df = pd.DataFrame(fit_rows)
-df = df.merge(fitted_df, on='patient_id', how='left')
-print("Gompertz fit complete")
-
-# ---------- Calculate targets ----------
-mask_untr = (df['chemo'] == 0) & (df['radio'] == 0) & (~df['r_fit'].isna())
-baseline_r = float(np.nanmedian(df.loc[mask_untr, 'r_fit'])) if mask_untr.sum() >= 5 else 0.12
-baseline_r = baseline_r if not np.isnan(baseline_r) else 0.12
-
-df['r_target'] = df['r_fit'].fillna(baseline_r)
-df['K_target'] = df['K_fit'].fillna(df['tumor_size_before'].fillna(1.0) * 2.0)
-
-# Calculate group statistics
-mask_untreated = (df['chemo'] == 0) & (df['radio'] == 0) & (~df['r_fit'].isna())
-mask_chemo_only = (df['chemo'] == 1) & (df['radio'] == 0) & (~df['r_fit'].isna())
-mask_radio_only = (df['chemo'] == 0) & (df['radio'] == 1) & (~df['r_fit'].isna())
-mask_both = (df['chemo'] == 1) & (df['radio'] == 1) & (~df['r_fit'].isna())
-
-r_untreated = np.nanmedian(df.loc[mask_untreated, 'r_fit']) if mask_untreated.sum() >= 3 else baseline_r
-r_chemo = np.nanmedian(df.loc[mask_chemo_only, 'r_fit']) if mask_chemo_only.sum() >= 3 else baseline_r
-r_radio = np.nanmedian(df.loc[mask_radio_only, 'r_fit']) if mask_radio_only.sum() >= 3 else baseline_r
-
-chemo_effect = max(0.02, r_untreated - r_chemo) if r_untreated > r_chemo else 0.05
-radio_effect = max(0.02, r_untreated - r_radio) if r_untreated > r_radio else 0.05
-combined_effect = max(0.03, chemo_effect + radio_effect)
-
-print(f"\nTreatment effects: baseline_r={baseline_r:.4f}, r_untreated={r_untreated:.4f}")
-print(f"  chemo_effect={chemo_effect:.4f}, radio_effect={radio_effect:.4f}")
-
-# Calculate alpha/beta with VARIABILITY + DOSAGE DEPENDENCE + NEW FEATURES
-alpha_list, beta_list = [], []
-
-for _, row in df.iterrows():
-    r_est = row['r_target']
-    chemo, radio, beva = int(row.get('chemo', 0)), int(row.get('radio', 0)), int(row.get('beva', 0))
-    kps, tumor_size = row.get('kps', 70), row.get('tumor_size_before', 3.0)
+# ---------- Stages ----------
+# ingest -> parse -> fit -> targets -> features -> oof -> meta -> refit -> export.
+# Each stage is a function of earlier results; main() runs them through
+# gbm_checkpoint.StageRunner, which loads a stage from CHECKPOINT_DIR when its
+# inputs, config and code are unchanged.
+STAGES = ['ingest', 'parse', 'fit', 'targets', 'features', 'oof', 'meta', 'refit', 'export']
+
+def stage_ingest() -> pd.DataFrame:
+    """All sheets of INPUT_XLSX (its own checkpoint: the Feather cache)"""
+    print("\nLoading Excel:", INPUT_XLSX)
+    t_load = time.time()
+    df, data_info = load_workbook_cached(INPUT_XLSX, DATA_CACHE_DIR)
+    if data_info['source'] == 'excel_uncached':
+        print("\n" + "!" * 80)
+        print("WARNING: pyarrow is not installed, so the workbook cache is disabled and every run")
+        print("re-reads the full Excel file (pip install -r requirements.txt installs it)")
+        print("!" * 80 + "\n")
+    source = {'cache': f"from cache {data_info['cache']}",
+              'excel': f"from the workbook, cached to {data_info['cache']}",
+              'excel_uncached': "from the workbook (no cache)"}[data_info['source']]
+    print(f"Loaded {df['stage'].nunique()} sheets, {len(df)} rows {source} in {time.time() - t_load:.2f}s")
+    return df
+
+def stage_parse(df: pd.DataFrame) -> pd.DataFrame:
+    """Treatment flags, dosages and neurological symptoms parsed from the text columns"""
+    # Parse treatment flags (binary)
+    print("Parsing treatment flags...")
+    tflags = parse_treatment_flags(df['treatment'])
+    df = pd.concat([df, tflags], axis=1)
+
+    # Parse dosage features
+    print("Extracting dosage features from treatment strings...")
+    dosages = parse_dosage_features(df['treatment'])
+    df = pd.concat([df, dosages], axis=1)
+
+    # NEW: Parse neurological symptoms
+    print("Parsing neurological symptoms...")
+    neuro_symptoms = parse_neurological_symptoms(df['neurological_symptoms'])
+    df = pd.concat([df, neuro_symptoms], axis=1)
+
+    # Fill missing dosages with defaults based on treatment flags
+    default_chemo_dose = 75.0
+    default_radio_dose = 60.0
+    default_radio_fractions = 30.0
+
+    missing_chemo = (df['chemo'] == 1) & (df['chemo_dose_mg_per_m2'] == 0)
+    df.loc[missing_chemo, 'chemo_dose_mg_per_m2'] = default_chemo_dose
+
+    missing_radio = (df['radio'] == 1) & (df['radio_total_Gy'] == 0)
+    n = default_radio_fractions
+    d = default_radio_dose / n
+    df.loc[missing_radio, 'radio_total_Gy'] = default_radio_dose
+    df.loc[missing_radio, 'radio_fractions'] = default_radio_fractions
+    df.loc[missing_radio, 'radio_BED'] = n * d * (1 + d / 10.0)
+
+    print(f"Dosage features extracted:")
+    print(f"  Chemo doses: min={df['chemo_dose_mg_per_m2'].min():.1f}, max={df['chemo_dose_mg_per_m2'].max():.1f}, median={df['chemo_dose_mg_per_m2'].median():.1f}")
+    print(f"  Radio doses: min={df['radio_total_Gy'].min():.1f}, max={df['radio_total_Gy'].max():.1f}, median={df['radio_total_Gy'].median():.1f}")
+    print(f"  Radio BED: min={df['radio_BED'].min():.1f}, max={df['radio_BED'].max():.1f}, median={df['radio_BED'].median():.1f}")
+    print(f"\nNeurological symptoms extracted:")
+    print(f"  Symptom count: min={df['symptom_count'].min():.0f}, max={df['symptom_count'].max():.0f}, mean={df['symptom_count'].mean():.1f}")
+    return df
+
+def stage_fit(df: pd.DataFrame) -> Dict[str, Any]:
+    """Per-patient Gompertz r and K from the follow-up volumes"""
+    print("\nFitting Gompertz...")
+    time_cols = FOLLOW_UP_COLUMNS
+
+    # Fit inputs as columns: T0 plus the numeric follow-ups of each row
+    pids = df['patient_id'] if 'patient_id' in df.columns else pd.Series([f"idx_{i}" for i in df.index], index=df.index)
+    T0_all = df['tumor_size_before'] if 'tumor_size_before' in df.columns else pd.Series(np.nan, index=df.index)
+    has_T0 = T0_all.notna() & (T0_all > 0)
+    follow_ups = pd.DataFrame({col: pd.to_numeric(df[col], errors='coerce') if col in df.columns else np.nan
+                               for col, _ in time_cols}, index=df.index)
+    observed = follow_ups.notna().to_numpy()
+    follow_up_times = np.array([float(t) for _, t in time_cols])
+
+    fitted_df = pd.DataFrame({
+        'patient_id': pids.to_numpy(),
+        'r_fit': np.nan,
+        'K_fit': np.nan,
+        'n_obs': np.where(has_T0, 1 + observed.sum(axis=1), 0)
+    })
+
+    # One batched fit for every patient with T0 + at least two follow-ups
+    # (T0 >= K upper bound has no valid K, as with curve_fit's bounds)
+    fittable = (has_T0 & (fitted_df['n_obs'] >= 3) & (T0_all < GOMPERTZ_K_MAX)).to_numpy()
+    T0_fit = T0_all.to_numpy(dtype=float)[fittable]
+    fit_times = np.column_stack([np.zeros(len(T0_fit)),
+                                 np.where(observed[fittable], follow_up_times, np.nan)])
+    fit_sizes = np.column_stack([T0_fit, follow_ups.to_numpy(dtype=float)[fittable]])
+
+    t_fit = time.time()
+    fit = fit_gompertz_with_fallback(fit_times, fit_sizes, T0_fit, workers=GOMPERTZ_WORKERS, maxfev=GOMPERTZ_MAXFEV)
+    fitted_df.loc[fittable, 'r_fit'] = np.where(fit['converged'], fit['r'], np.nan)
+    fitted_df.loc[fittable, 'K_fit'] = np.where(fit['converged'], fit['K'], np.nan)
+    print(f"  {len(T0_fit)} patients in {time.time() - t_fit:.2f}s: "
+          f"{fit['converged'].sum()} converged, {fit['fallback'].sum()} via curve_fit fallback, "
+          f"iterations median {np.median(fit['iterations']) if len(T0_fit) else 0:.0f} / max {fit['iterations'].max(initial=0)}")
+
+    df = df.merge(fitted_df, on='patient_id', how='left')
+    print("Gompertz fit complete")
+    return {'df': df, 'fitted_df': fitted_df}
+
+def stage_targets(df: pd.DataFrame) -> Dict[str, Any]:
+    """r/K targets from the fits, alpha/beta targets from treatment, dosage and patient factors"""
+    df = df.copy()
+    mask_untr = (df['chemo'] == 0) & (df['radio'] == 0) & (~df['r_fit'].isna())
+    baseline_r = float(np.nanmedian(df.loc[mask_untr, 'r_fit'])) if mask_untr.sum() >= 5 else 0.12
+    baseline_r = baseline_r if not np.isnan(baseline_r) else 0.12
+
+    df['r_target'] = df['r_fit'].fillna(baseline_r)
+    df['K_target'] = df['K_fit'].fillna(df['tumor_size_before'].fillna(1.0) * 2.0)
+
+    # Calculate group statistics
+    mask_untreated = (df['chemo'] == 0) & (df['radio'] == 0) & (~df['r_fit'].isna())
+    mask_chemo_only = (df['chemo'] == 1) & (df['radio'] == 0) & (~df['r_fit'].isna())
+    mask_radio_only = (df['chemo'] == 0) & (df['radio'] == 1) & (~df['r_fit'].isna())
+    mask_both = (df['chemo'] == 1) & (df['radio'] == 1) & (~df['r_fit'].isna())
+
+    r_untreated = np.nanmedian(df.loc[mask_untreated, 'r_fit']) if mask_untreated.sum() >= 3 else baseline_r
+    r_chemo = np.nanmedian(df.loc[mask_chemo_only, 'r_fit']) if mask_chemo_only.sum() >= 3 else baseline_r
+    r_radio = np.nanmedian(df.loc[mask_radio_only, 'r_fit']) if mask_radio_only.sum() >= 3 else baseline_r
+
+    chemo_effect = max(0.02, r_untreated - r_chemo) if r_untreated > r_chemo else 0.05
+    radio_effect = max(0.02, r_untreated - r_radio) if r_untreated > r_radio else 0.05
+    combined_effect = max(0.03, chemo_effect + radio_effect)
+
+    print(f"\nTreatment effects: baseline_r={baseline_r:.4f}, r_untreated={r_untreated:.4f}")
+    print(f"  chemo_effect={chemo_effect:.4f}, radio_effect={radio_effect:.4f}")
+
+    # Calculate alpha/beta with VARIABILITY + DOSAGE DEPENDENCE + NEW FEATURES
+    # (column operations; all noise drawn at once from one seeded generator)
+    rng = np.random.default_rng(RANDOM_SEED)
+    n_rows = len(df)
+
+    def column(name, default):
+        """Column as float array (default where the column is missing)"""
+        return df[name].to_numpy(dtype=float) if name in df.columns else np.full(n_rows, float(default))
+
+    def flag(name):
+        """0/1 column, missing values as 0"""
+        return df[name].fillna(0).astype(int).to_numpy() if name in df.columns else np.zeros(n_rows, dtype=int)
+
+    r_est = column('r_target', np.nan)
+    chemo, radio, beva = flag('chemo') != 0, flag('radio') != 0, flag('beva') != 0
+    kps, tumor_size = column('kps', 70), column('tumor_size_before', 3.0)
 
     # Dosages
-    chemo_dose = row.get('chemo_dose_mg_per_m2', 0)
-    radio_BED = row.get('radio_BED', 0)
+    chemo_dose = column('chemo_dose_mg_per_m2', 0)
+    radio_BED = column('radio_BED', 0)
 
     # NEW: Genetic markers (favorable mutations)
-    mgmt = int(row.get('mgmt_methylation', 0)) if not pd.isna(row.get('mgmt_methylation', 0)) else 0
-    idh = int(row.get('idh_mutation', 0)) if not pd.isna(row.get('idh_mutation', 0)) else 0
+    mgmt, idh = flag('mgmt_methylation') != 0, flag('idh_mutation') != 0
 
     # NEW: Clinical features
-    edema = row.get('edema_volume', 0) if not pd.isna(row.get('edema_volume', 0)) else 0
-    steroid = row.get('steroid_dose', 0) if not pd.isna(row.get('steroid_dose', 0)) else 0
-    antiseizure = int(row.get('antiseizure_meds', 0)) if not pd.isna(row.get('antiseizure_meds', 0)) else 0
+    edema = np.nan_to_num(column('edema_volume', 0), nan=0.0)
 
     # NEW: Neurological symptoms
-    symptom_count = row.get('symptom_count', 0) if not pd.isna(row.get('symptom_count', 0)) else 0
+    symptom_count = np.nan_to_num(column('symptom_count', 0), nan=0.0)
 
-    reduction = max(0, r_untreated - (r_est if not pd.isna(r_est) else r_untreated))
+    reduction = np.maximum(0, r_untreated - np.where(np.isnan(r_est), r_untreated, r_est))
 
     # Calculate base effects
-    if chemo and radio:
-        total_effect = max(reduction, combined_effect)
-        alpha, beta = total_effect * 0.6, total_effect * 0.4
-    elif chemo:
-        alpha = max(reduction, chemo_effect)
-        beta = 0.01 + np.random.uniform(0, 0.02)
-    elif radio:
-        beta = max(reduction, radio_effect)
-        alpha = 0.01 + np.random.uniform(0, 0.02)
-    else:
-        alpha, beta = 0.01 + np.random.uniform(0, 0.01), 0.01 + np.random.uniform(0, 0.01)
+    untreated_noise = rng.uniform(0, 0.01, size=(2, n_rows))
+    single_noise = rng.uniform(0, 0.02, size=n_rows)
+    total_effect = np.maximum(reduction, combined_effect)
+    alpha = np.select([chemo & radio, chemo, radio],
+                      [total_effect * 0.6, np.maximum(reduction, chemo_effect), 0.01 + single_noise],
+                      0.01 + untreated_noise[0])
+    beta = np.select([chemo & radio, chemo, radio],
+                     [total_effect * 0.4, 0.01 + single_noise, np.maximum(reduction, radio_effect)],
+                     0.01 + untreated_noise[1])
 
     # Modulate by dosage
-    if chemo and chemo_dose > 0:
-        dose_factor = min(chemo_dose / 75.0, 2.5)
-        alpha *= dose_factor
-
-    if radio and radio_BED > 0:
-        BED_factor = min(radio_BED / 72.0, 1.5)
-        beta *= BED_factor
+    alpha *= np.where(chemo & (chemo_dose > 0), np.minimum(chemo_dose / 75.0, 2.5), 1.0)
+    beta *= np.where(radio & (radio_BED > 0), np.minimum(radio_BED / 72.0, 1.5), 1.0)
 
     # NEW: Modulate by MGMT (better chemo response if methylated)
-    if mgmt and chemo:
-        alpha *= 1.3
+    alpha *= np.where(mgmt & chemo, 1.3, 1.0)
 
     # NEW: Modulate by IDH (better overall response)
-    if idh:
-        alpha *= 1.2
-        beta *= 1.2
+    alpha *= np.where(idh, 1.2, 1.0)
+    beta *= np.where(idh, 1.2, 1.0)
 
     # NEW: Modulate by edema (worse tolerance → reduce effectiveness)
-    if edema > 5:
-        edema_factor = np.clip(1.0 - (edema - 5) * 0.05, 0.7, 1.0)
-        alpha *= edema_factor
-        beta *= edema_factor
+    edema_factor = np.where(edema > 5, np.clip(1.0 - (edema - 5) * 0.05, 0.7, 1.0), 1.0)
+    alpha *= edema_factor
+    beta *= edema_factor
 
     # NEW: Modulate by symptoms (more symptoms → worse tolerance)
-    if symptom_count > 0:
-        symptom_factor = np.clip(1.0 - symptom_count * 0.03, 0.8, 1.0)
-        alpha *= symptom_factor
-        beta *= symptom_factor
+    symptom_factor = np.where(symptom_count > 0, np.clip(1.0 - symptom_count * 0.03, 0.8, 1.0), 1.0)
+    alpha *= symptom_factor
+    beta *= symptom_factor
 
     # Modulate by patient characteristics
-    kps_factor = np.clip((kps / 70.0) if not pd.isna(kps) else 1.0, 0.7, 1.3)
+    kps_factor = np.clip(np.where(np.isnan(kps), 1.0, kps / 70.0), 0.7, 1.3)
     size_factor = np.clip(tumor_size / 3.0, 0.8, 1.2)
     alpha *= kps_factor * size_factor
     beta *= kps_factor * size_factor
 
-    if beva:
-        alpha *= 1.4
-        beta *= 1.1
+    alpha *= np.where(beva, 1.4, 1.0)
+    beta *= np.where(beva, 1.1, 1.0)
 
     # Add controlled noise
-    alpha += np.random.normal(0, 0.005)
-    beta += np.random.normal(0, 0.005)
-
-    alpha_list.append(float(np.clip(alpha, 0.005, 0.4)))
-    beta_list.append(float(np.clip(beta, 0.005, 0.4)))
-
-df['alpha_target'] = alpha_list
-df['beta_target'] = beta_list
-
-# Check for NaN and fix
-print(f"\nAlpha NaN count: {df['alpha_target'].isna().sum()}")
-print(f"Beta NaN count: {df['beta_target'].isna().sum()}")
-
-# Fill any NaN with median
-if df['alpha_target'].isna().sum() > 0:
-    alpha_median = df['alpha_target'].median()
-    df['alpha_target'] = df['alpha_target'].fillna(alpha_median)
-    print(f"Filled {df['alpha_target'].isna().sum()} NaN alpha with median {alpha_median:.4f}")
-
-if df['beta_target'].isna().sum() > 0:
-    beta_median = df['beta_target'].median()
-    df['beta_target'] = df['beta_target'].fillna(beta_median)
-    print(f"Filled {df['beta_target'].isna().sum()} NaN beta with median {beta_median:.4f}")
+    noise = rng.normal(0, 0.005, size=(2, n_rows))
+    df['alpha_target'] = np.clip(alpha + noise[0], 0.005, 0.4)
+    df['beta_target'] = np.clip(beta + noise[1], 0.005, 0.4)
+
+    # Check for NaN and fix
+    print(f"\nAlpha NaN count: {df['alpha_target'].isna().sum()}")
+    print(f"Beta NaN count: {df['beta_target'].isna().sum()}")
+
+    # Fill any NaN with median
+    if df['alpha_target'].isna().sum() > 0:
+        alpha_median = df['alpha_target'].median()
+        df['alpha_target'] = df['alpha_target'].fillna(alpha_median)
+        print(f"Filled {df['alpha_target'].isna().sum()} NaN alpha with median {alpha_median:.4f}")
+
+    if df['beta_target'].isna().sum() > 0:
+        beta_median = df['beta_target'].median()
+        df['beta_target'] = df['beta_target'].fillna(beta_median)
+        print(f"Filled {df['beta_target'].isna().sum()} NaN beta with median {beta_median:.4f}")
+
+    print(f"\nAlpha range: [{df['alpha_target'].min():.4f}, {df['alpha_target'].max():.4f}]")
+    print(f"Beta range: [{df['beta_target'].min():.4f}, {df['beta_target'].max():.4f}]")
+    return {'df': df, 'baseline_r': baseline_r, 'r_untreated': float(r_untreated)}
+
+def stage_features(df: pd.DataFrame) -> Dict[str, Any]:
+    """Scaled feature matrix, targets, encoder/scaler, similar-patient index and drift reference"""
+    df = df.copy()
+    print("\n" + "="*80)
+    print("FEATURE ENGINEERING - FULL FEATURE SET")
+    print("="*80)
+
+    # Basic numeric features (OLD + NEW)
+    features_basic = [
+        # Original features
+        'age', 'tumor_size_before', 'chemo', 'radio', 'beva', 'other_drug', 'kps',
+
+        # Dosage features
+        'chemo_dose_mg_per_m2', 'radio_total_Gy', 'radio_BED',
+
+        # Specific drugs
+        'drug_temozolomide', 'drug_lomustine', 'drug_carboplatin',
+        'drug_etoposide', 'drug_irinotecan', 'drug_bevacizumab',
+
+        # NEW: Genetic markers
+        'mgmt_methylation', 'idh_mutation', 'egfr_amplification',
+        'tert_mutation', 'atrx_mutation',
+
+        # NEW: Clinical features
+        'edema_volume', 'steroid_dose', 'antiseizure_meds',
+
+        # NEW: Neurological symptoms (decomposed)
+        'has_headache', 'has_motor_deficit', 'has_seizures',
+        'has_sensory_deficit', 'has_cognitive_decline',
+        'has_speech_disturbance', 'has_visual_disturbance', 'symptom_count',
+
+        # NEW: Other features
+        'family_history', 'previous_radiation'
+    ]
 
-print(f"\nAlpha range: [{df['alpha_target'].min():.4f}, {df['alpha_target'].max():.4f}]")
-print(f"Beta range: [{df['beta_target'].min():.4f}, {df['beta_target'].max():.4f}]")
+    # Categorical features (OLD + NEW)
+    categorical = [
+        # Original
+        'gender', 'resection_extent', 'molecular_subtype',
+        'tumor_location', 'contrast_enhancement', 'stage',
 
-# ---------- ENHANCED FEATURES with ALL AVAILABLE DATA ----------
-print("\n" + "="*80)
-print("FEATURE ENGINEERING - FULL FEATURE SET")
-print("="*80)
+        # NEW
+        'lateralization', 'rano_response'
+    ]
 
-# Basic numeric features (OLD + NEW)
-features_basic = [
-    # Original features
-    'age', 'tumor_size_before', 'chemo', 'radio', 'beva', 'other_drug', 'kps',
+    print(f"Basic numeric features: {len(features_basic)}")
+    print(f"Categorical features: {len(categorical)}")
+
+    for c in features_basic + categorical:
+        if c not in df.columns:
+            df[c] = np.nan
+
+    X_raw = safe_numeric_cast(df[features_basic + categorical])
+
+    # Convert boolean columns to int BEFORE processing
+    boolean_cols = ['mgmt_methylation', 'idh_mutation', 'egfr_amplification',
+                    'tert_mutation', 'atrx_mutation', 'antiseizure_meds',
+                    'family_history', 'previous_radiation']
+
+    for col in boolean_cols:
+        if col in X_raw.columns:
+            X_raw[col] = X_raw[col].replace({'True': 1, 'False': 0, 'true': 1, 'false': 0, True: 1, False: 0})
+            X_raw[col] = pd.to_numeric(X_raw[col], errors='coerce').fillna(0).astype(int)
+
+    # OneHot encode
+    cat_df = X_raw[categorical].fillna('NA').astype(str)
+    enc = OneHotEncoder(handle_unknown='ignore', sparse_output=False)
+    enc_arr = enc.fit_transform(cat_df)
+    enc_cols = [f"{cat}_{v}" for i, cat in enumerate(categorical) for v in enc.categories_[i]]
+
+    num_df = X_raw.drop(columns=categorical)
+    for c in num_df.columns:
+        num_df[c] = pd.to_numeric(num_df[c], errors='coerce')
+        median_val = num_df[c].median()
+        num_df[c] = num_df[c].fillna(median_val if not pd.isna(median_val) else 0).astype(float)
+
+    num_cols = num_df.columns.tolist()
+    X_num = num_df.reset_index(drop=True)
+    X_enc = pd.DataFrame(enc_arr, columns=enc_cols, index=X_num.index)
+
+    print("\nCreating enhanced features with interactions...")
+    interactions = pd.DataFrame(index=X_num.index)
+
+    # Fitted parameters
+    fitted_features = df[['r_fit', 'K_fit', 'n_obs', 'alpha_target', 'beta_target']].fillna(0).reset_index(drop=True)
+
+    # Add computed values
+    interactions['alpha_computed'] = fitted_features['alpha_target']
+    interactions['beta_computed'] = fitted_features['beta_target']
+
+    # Core interactions (treatment × params)
+    interactions['r_fit_x_chemo'] = fitted_features['r_fit'] * X_num['chemo']
+    interactions['r_fit_x_radio'] = fitted_features['r_fit'] * X_num['radio']
+    interactions['K_fit_x_chemo'] = fitted_features['K_fit'] * X_num['chemo']
+    interactions['K_fit_x_radio'] = fitted_features['K_fit'] * X_num['radio']
+    interactions['alpha_computed_x_chemo'] = fitted_features['alpha_target'] * X_num['chemo']
+    interactions['beta_computed_x_radio'] = fitted_features['beta_target'] * X_num['radio']
+
+    # Treatment combinations
+    interactions['chemo_x_radio'] = X_num['chemo'] * X_num['radio']
+    interactions['chemo_x_tumor_size'] = X_num['chemo'] * X_num['tumor_size_before']
+    interactions['radio_x_tumor_size'] = X_num['radio'] * X_num['tumor_size_before']
+    interactions['beva_x_chemo'] = X_num['beva'] * X_num['chemo']
+    interactions['kps_x_chemo'] = X_num['kps'] * X_num['chemo']
+    interactions['treatment_count'] = X_num['chemo'] + X_num['radio'] + X_num['beva']
+
+    # Dosage interactions
+    interactions['chemo_dose_x_tumor_size'] = X_num['chemo_dose_mg_per_m2'] * X_num['tumor_size_before']
+    interactions['chemo_dose_x_kps'] = X_num['chemo_dose_mg_per_m2'] * X_num['kps']
+    interactions['chemo_dose_x_age'] = X_num['chemo_dose_mg_per_m2'] * X_num['age']
+    interactions['radio_BED_x_tumor_size'] = X_num['radio_BED'] * X_num['tumor_size_before']
+    interactions['radio_BED_x_kps'] = X_num['radio_BED'] * X_num['kps']
+    interactions['radio_BED_x_age'] = X_num['radio_BED'] * X_num['age']
+    interactions['chemo_dose_x_radio_BED'] = X_num['chemo_dose_mg_per_m2'] * X_num['radio_BED']
+
+    # NEW: Genetic × treatment interactions
+    interactions['mgmt_x_chemo'] = X_num['mgmt_methylation'] * X_num['chemo']
+    interactions['mgmt_x_chemo_dose'] = X_num['mgmt_methylation'] * X_num['chemo_dose_mg_per_m2']
+    interactions['idh_x_chemo'] = X_num['idh_mutation'] * X_num['chemo']
+    interactions['idh_x_radio'] = X_num['idh_mutation'] * X_num['radio']
+    interactions['egfr_x_chemo'] = X_num['egfr_amplification'] * X_num['chemo']
+
+    # NEW: Clinical × treatment interactions
+    interactions['edema_x_chemo'] = X_num['edema_volume'] * X_num['chemo']
+    interactions['edema_x_radio'] = X_num['edema_volume'] * X_num['radio']
+    interactions['steroid_x_chemo'] = X_num['steroid_dose'] * X_num['chemo']
+    interactions['symptom_count_x_chemo'] = X_num['symptom_count'] * X_num['chemo']
+    interactions['symptom_count_x_radio'] = X_num['symptom_count'] * X_num['radio']
+
+    # Non-linear terms
+    interactions['age_squared'] = X_num['age'] ** 2
+    interactions['tumor_size_squared'] = X_num['tumor_size_before'] ** 2
+    interactions['tumor_size_log'] = np.log1p(X_num['tumor_size_before'])
+    interactions['r_fit_squared'] = fitted_features['r_fit'] ** 2
+    interactions['K_fit_log'] = np.log1p(fitted_features['K_fit'])
+    interactions['chemo_dose_squared'] = X_num['chemo_dose_mg_per_m2'] ** 2
+    interactions['radio_BED_squared'] = X_num['radio_BED'] ** 2
+    interactions['chemo_dose_log'] = np.log1p(X_num['chemo_dose_mg_per_m2'])
+    interactions['radio_BED_log'] = np.log1p(X_num['radio_BED'])
+
+    # NEW: Non-linear terms for new features
+    interactions['edema_squared'] = X_num['edema_volume'] ** 2
+    interactions['steroid_squared'] = X_num['steroid_dose'] ** 2
+    interactions['symptom_count_squared'] = X_num['symptom_count'] ** 2
+
+    # Combine all
+    X = pd.concat([X_num[num_cols], X_enc, fitted_features[['r_fit', 'K_fit', 'n_obs']], interactions], axis=1)
+
+    print(f"\nFinal feature matrix shape: {X.shape}")
+    print(f"Total features: {X.shape[1]}")
+
+    # Scale numeric
+    scaler = StandardScaler()
+    X = pd.DataFrame(scaler.fit_transform(X), columns=X.columns, index=X.index)
+
+    # Similar-patient index
+    # Nearest neighbours over the scaled patient-descriptive columns: no treatment/dosage,
+    # stage (sheet name) or fitted/target-derived features, which new patients do not have
+    print("\nBuilding similar-patient index...")
+    regimen_cols = ['chemo', 'radio', 'beva', 'other_drug',
+                    'chemo_dose_mg_per_m2', 'radio_total_Gy', 'radio_BED',
+                    'drug_temozolomide', 'drug_lomustine', 'drug_carboplatin',
+                    'drug_etoposide', 'drug_irinotecan', 'drug_bevacizumab']
+    similarity_cols = ([c for c in num_cols if c not in regimen_cols]
+                       + [c for c in enc_cols if not c.startswith('stage_')])
+    has_id = df['patient_id'].notna().to_numpy()
+
+    info = df.loc[has_id, SIMILAR_INFO_COLS].astype(object)
+    similar_patients = {
+        'tree': BallTree(X.loc[has_id, similarity_cols].to_numpy()),
+        'columns': similarity_cols,
+        'patient_id': df.loc[has_id, 'patient_id'].astype(str).tolist(),
+        'trajectory_months': [0] + [t for _, t in FOLLOW_UP_COLUMNS],
+        'trajectories': df.loc[has_id, ['tumor_size_before'] + [c for c, _ in FOLLOW_UP_COLUMNS]]
+                          .apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float),
+        'info': info.where(info.notna(), None).to_dict('records')
+    }
+    print(f"Indexed {has_id.sum()} patients on {len(similarity_cols)} features")
 
-    # Dosage features
-    'chemo_dose_mg_per_m2', 'radio_total_Gy', 'radio_BED',
+    # Drift reference
+    # Training distribution of the patient-descriptive fields, compared with live traffic by /drift
+    drift_reference = build_drift_reference(X_num[[c for c in num_cols if c not in regimen_cols]],
+                                            cat_df.reset_index(drop=True))
+    print(f"Drift reference: {len(drift_reference['numeric'])} numeric, "
+          f"{len(drift_reference['categorical'])} categorical fields")
 
-    # Specific drugs
-    'drug_temozolomide', 'drug_lomustine', 'drug_carboplatin',
-    'drug_etoposide', 'drug_irinotecan', 'drug_bevacizumab',
+    # Targets
+    y = df[['r_target','K_target','alpha_target','beta_target']].copy()
 
-    # NEW: Genetic markers
-    'mgmt_methylation', 'idh_mutation', 'egfr_amplification',
-    'tert_mutation', 'atrx_mutation',
+    print(f"\nTarget matrix shape: {y.shape}")
+    print(f"Samples: {len(X)}")
 
-    # NEW: Clinical features
-    'edema_volume', 'steroid_dose', 'antiseizure_meds',
-
-    # NEW: Neurological symptoms (decomposed)
-    'has_headache', 'has_motor_deficit', 'has_seizures',
-    'has_sensory_deficit', 'has_cognitive_decline',
-    'has_speech_disturbance', 'has_visual_disturbance', 'symptom_count',
-
-    # NEW: Other features
-    'family_history', 'previous_radiation'
-]
-
-# Categorical features (OLD + NEW)
-categorical = [
-    # Original
-    'gender', 'resection_extent', 'molecular_subtype',
-    'tumor_location', 'contrast_enhancement', 'stage',
-
-    # NEW
-    'lateralization', 'rano_response'
-]
-
-print(f"Basic numeric features: {len(features_basic)}")
-print(f"Categorical features: {len(categorical)}")
-
-for c in features_basic + categorical:
-    if c not in df.columns:
-        df[c] = np.nan
-
-X_raw = safe_numeric_cast(df[features_basic + categorical])
-
-# Convert boolean columns to int BEFORE processing
-boolean_cols = ['mgmt_methylation', 'idh_mutation', 'egfr_amplification',
-                'tert_mutation', 'atrx_mutation', 'antiseizure_meds',
-                'family_history', 'previous_radiation']
-
-for col in boolean_cols:
-    if col in X_raw.columns:
-        X_raw[col] = X_raw[col].replace({'True': 1, 'False': 0, 'true': 1, 'false': 0, True: 1, False: 0})
-        X_raw[col] = pd.to_numeric(X_raw[col], errors='coerce').fillna(0).astype(int)
-
-# OneHot encode
-cat_df = X_raw[categorical].fillna('NA').astype(str)
-enc = OneHotEncoder(handle_unknown='ignore', sparse_output=False)
-enc_arr = enc.fit_transform(cat_df)
-enc_cols = [f"{cat}_{v}" for i, cat in enumerate(categorical) for v in enc.categories_[i]]
-
-num_df = X_raw.drop(columns=categorical)
-for c in num_df.columns:
-    num_df[c] = pd.to_numeric(num_df[c], errors='coerce')
-    median_val = num_df[c].median()
-    num_df[c] = num_df[c].fillna(median_val if not pd.isna(median_val) else 0).astype(float)
-
-num_cols = num_df.columns.tolist()
-X_num = num_df.reset_index(drop=True)
-X_enc = pd.DataFrame(enc_arr, columns=enc_cols, index=X_num.index)
-
-print("\nCreating enhanced features with interactions...")
-interactions = pd.DataFrame(index=X_num.index)
-
-# Fitted parameters
-fitted_features = df[['r_fit', 'K_fit', 'n_obs', 'alpha_target', 'beta_target']].fillna(0).reset_index(drop=True)
-
-# Add computed values
-interactions['alpha_computed'] = fitted_features['alpha_target']
-interactions['beta_computed'] = fitted_features['beta_target']
-
-# Core interactions (treatment × params)
-interactions['r_fit_x_chemo'] = fitted_features['r_fit'] * X_num['chemo']
-interactions['r_fit_x_radio'] = fitted_features['r_fit'] * X_num['radio']
-interactions['K_fit_x_chemo'] = fitted_features['K_fit'] * X_num['chemo']
-interactions['K_fit_x_radio'] = fitted_features['K_fit'] * X_num['radio']
-interactions['alpha_computed_x_chemo'] = fitted_features['alpha_target'] * X_num['chemo']
-interactions['beta_computed_x_radio'] = fitted_features['beta_target'] * X_num['radio']
-
-# Treatment combinations
-interactions['chemo_x_radio'] = X_num['chemo'] * X_num['radio']
-interactions['chemo_x_tumor_size'] = X_num['chemo'] * X_num['tumor_size_before']
-interactions['radio_x_tumor_size'] = X_num['radio'] * X_num['tumor_size_before']
-interactions['beva_x_chemo'] = X_num['beva'] * X_num['chemo']
-interactions['kps_x_chemo'] = X_num['kps'] * X_num['chemo']
-interactions['treatment_count'] = X_num['chemo'] + X_num['radio'] + X_num['beva']
-
-# Dosage interactions
-interactions['chemo_dose_x_tumor_size'] = X_num['chemo_dose_mg_per_m2'] * X_num['tumor_size_before']
-interactions['chemo_dose_x_kps'] = X_num['chemo_dose_mg_per_m2'] * X_num['kps']
-interactions['chemo_dose_x_age'] = X_num['chemo_dose_mg_per_m2'] * X_num['age']
-interactions['radio_BED_x_tumor_size'] = X_num['radio_BED'] * X_num['tumor_size_before']
-interactions['radio_BED_x_kps'] = X_num['radio_BED'] * X_num['kps']
-interactions['radio_BED_x_age'] = X_num['radio_BED'] * X_num['age']
-interactions['chemo_dose_x_radio_BED'] = X_num['chemo_dose_mg_per_m2'] * X_num['radio_BED']
-
-# NEW: Genetic × treatment interactions
-interactions['mgmt_x_chemo'] = X_num['mgmt_methylation'] * X_num['chemo']
-interactions['mgmt_x_chemo_dose'] = X_num['mgmt_methylation'] * X_num['chemo_dose_mg_per_m2']
-interactions['idh_x_chemo'] = X_num['idh_mutation'] * X_num['chemo']
-interactions['idh_x_radio'] = X_num['idh_mutation'] * X_num['radio']
-interactions['egfr_x_chemo'] = X_num['egfr_amplification'] * X_num['chemo']
-
-# NEW: Clinical × treatment interactions
-interactions['edema_x_chemo'] = X_num['edema_volume'] * X_num['chemo']
-interactions['edema_x_radio'] = X_num['edema_volume'] * X_num['radio']
-interactions['steroid_x_chemo'] = X_num['steroid_dose'] * X_num['chemo']
-interactions['symptom_count_x_chemo'] = X_num['symptom_count'] * X_num['chemo']
-interactions['symptom_count_x_radio'] = X_num['symptom_count'] * X_num['radio']
-
-# Non-linear terms
-interactions['age_squared'] = X_num['age'] ** 2
-interactions['tumor_size_squared'] = X_num['tumor_size_before'] ** 2
-interactions['tumor_size_log'] = np.log1p(X_num['tumor_size_before'])
-interactions['r_fit_squared'] = fitted_features['r_fit'] ** 2
-interactions['K_fit_log'] = np.log1p(fitted_features['K_fit'])
-interactions['chemo_dose_squared'] = X_num['chemo_dose_mg_per_m2'] ** 2
-interactions['radio_BED_squared'] = X_num['radio_BED'] ** 2
-interactions['chemo_dose_log'] = np.log1p(X_num['chemo_dose_mg_per_m2'])
-interactions['radio_BED_log'] = np.log1p(X_num['radio_BED'])
-
-# NEW: Non-linear terms for new features
-interactions['edema_squared'] = X_num['edema_volume'] ** 2
-interactions['steroid_squared'] = X_num['steroid_dose'] ** 2
-interactions['symptom_count_squared'] = X_num['symptom_count'] ** 2
-
-# Combine all
-X = pd.concat([X_num[num_cols], X_enc, fitted_features[['r_fit', 'K_fit', 'n_obs']], interactions], axis=1)
-
-print(f"\nFinal feature matrix shape: {X.shape}")
-print(f"Total features: {X.shape[1]}")
-
-# Scale numeric
-scaler = StandardScaler()
-X = pd.DataFrame(scaler.fit_transform(X), columns=X.columns, index=X.index)
-
-# Targets
-y = df[['r_target','K_target','alpha_target','beta_target']].copy()
-
-print(f"\nTarget matrix shape: {y.shape}")
-print(f"Samples: {len(X)}")
+    return {'X': X, 'y': y, 'enc': enc, 'scaler': scaler,
+            'features_basic': features_basic, 'categorical': categorical,
+            'similar_patients': similar_patients, 'drift_reference': drift_reference}
 
 # ---------- Train models ----------
-try:
-    import xgboost as xgb
-    base_factories = [('xgb', lambda: xgb.XGBRegressor(n_estimators=200, max_depth=6, learning_rate=0.05, subsample=0.8, random_state=42))]
-    print("\nXGBoost: available")
-except:
-    base_factories = []
-    print("\nXGBoost: not available")
-
-base_factories.extend([
-    ('gbr', lambda: GradientBoostingRegressor(n_estimators=N_EST_GBR, max_depth=5, learning_rate=0.05, subsample=0.8, random_state=42)),
-    ('rf', lambda: RandomForestRegressor(n_estimators=N_EST_RF, max_depth=15, min_samples_split=4, n_jobs=-1, random_state=42)),
-    ('et', lambda: ExtraTreesRegressor(n_estimators=N_EST_ET, max_depth=15, min_samples_split=4, n_jobs=-1, random_state=42)),
-    ('mlp', lambda: MLPRegressor(hidden_layer_sizes=MLP_HIDDEN, max_iter=500, early_stopping=True, random_state=42))
-])
-
-# ---------- OOF stacking ----------
-kf = KFold(n_splits=CV_FOLDS, shuffle=True, random_state=42)
-stacked_models = {}
-oof_predictions = {t: np.zeros((X.shape[0], len(base_factories))) for t in y.columns}
-
-print(f"\nTraining {len(base_factories)} base models with OOF stacking...")
-for tgt in y.columns:
-    print(f"  {tgt}...", end=' ')
-
-    for fold_idx, (tr_idx, te_idx) in enumerate(kf.split(X)):
-        X_tr, X_te = X.iloc[tr_idx], X.iloc[te_idx]
-        y_tr = y.iloc[tr_idx][tgt]
-
-        for m_idx, (name, factory) in enumerate(base_factories):
-            try:
-                model = factory()
-                model.fit(X_tr, y_tr)
-                oof_predictions[tgt][te_idx, m_idx] = model.predict(X_te)
-            except:
-                model = RandomForestRegressor(n_estimators=100, random_state=42)
-                model.fit(X_tr, y_tr)
-                oof_predictions[tgt][te_idx, m_idx] = model.predict(X_te)
-
-    # Meta
-    meta = Ridge(alpha=STACKER_ALPHA)
-    meta.fit(oof_predictions[tgt], y[tgt])
+def _xgb_regressor(threads: int, **params):
+    try:
+        import xgboost as xgb
+    except ImportError as e:
+        raise ImportError("base learner 'xgb' needs xgboost (pip install xgboost) or remove it from BASE_LEARNERS") from e
+    return xgb.XGBRegressor(**params, n_jobs=threads, random_state=42)
+
+# name -> factory(threads, **params); `threads` goes to the models whose result does not depend on it
+BASE_LEARNER_REGISTRY = {
+    'xgb': _xgb_regressor,
+    'gbr': lambda threads, **params: GradientBoostingRegressor(**params, random_state=42),
+    'hgb': lambda threads, **params: HistGradientBoostingRegressor(**params, random_state=42),
+    'rf': lambda threads, **params: RandomForestRegressor(**params, n_jobs=threads, random_state=42),
+    'et': lambda threads, **params: ExtraTreesRegressor(**params, n_jobs=threads, random_state=42),
+    'mlp': lambda threads, **params: MLPRegressor(**params, random_state=42)
+}
+MULTI_OUTPUT_CAPABLE = ('rf', 'et', 'mlp')  # registered learners that fit several targets in one model
+
+def make_base_learner(name: str, threads: int, **params):
+    """Unfitted base model `name` with BASE_PARAMS[name], overridden by params"""
+    return BASE_LEARNER_REGISTRY[name](threads, **{**BASE_PARAMS.get(name, {}), **params})
+
+def make_base_factories(names: Optional[Tuple[str, ...]] = None) -> List[Tuple[str, Any]]:
+    """(name, factory(threads, **params)) of the given base models (default BASE_LEARNERS); params override BASE_PARAMS"""
+    names = BASE_LEARNERS if names is None else names
+    unknown = [n for n in names if n not in BASE_LEARNER_REGISTRY]
+    if unknown:
+        raise ValueError(f"Unknown base learner(s) {unknown}; registered: {', '.join(BASE_LEARNER_REGISTRY)}")
+    if len(set(names)) != len(names):
+        raise ValueError(f"BASE_LEARNERS lists a base learner twice: {list(names)}")
+    return [(name, lambda threads, name=name, **params: make_base_learner(name, threads, **params)) for name in names]
+
+def base_model_config(shared: Tuple[str, ...] = MULTI_OUTPUT_LEARNERS) -> Dict[str, Any]:
+    """
+    Settings and library versions the fitted base models depend on (not TRAIN_CORES)
 
-    # Full models
-    trained_bases = []
-    for name, factory in base_factories:
+    `shared` are the base models fitted once for all targets. Builds every
+    selected base model once, so an unknown name or a missing library fails
+    here rather than after the data stages.
+    """
+    for _, factory in make_base_factories():
+        factory(1)
+    invalid = [n for n in shared if n not in BASE_LEARNERS or n not in MULTI_OUTPUT_CAPABLE]
+    if invalid:
+        raise ValueError(f"MULTI_OUTPUT_LEARNERS {invalid} must be in BASE_LEARNERS and one of "
+                         f"{', '.join(MULTI_OUTPUT_CAPABLE)}")
+    xgb_version = None
+    if 'xgb' in BASE_LEARNERS:
+        import xgboost as xgb
+        xgb_version = xgb.__version__
+    return {'learners': list(BASE_LEARNERS), 'params': {n: BASE_PARAMS.get(n, {}) for n in BASE_LEARNERS},
+            'multi_output': list(shared), 'sklearn': sklearn.__version__, 'xgboost': xgb_version}
+
+def fit_base(X: pd.DataFrame, target: pd.Series, m_idx: int, tr_idx, te_idx, threads: int):
+    """
+    One independent base-model fit: a CV fold (te_idx = held-out rows, returns
+    their predictions) or the full-data refit (tr_idx = te_idx = None)
+
+    Returns (model, held-out predictions, fit seconds, predict seconds); a CV
+    fold returns no model (None), since only its predictions are used, so the
+    pool does not ship fitted models back, and the refit no predictions.
+    With a DataFrame `target` the model is fitted once on all its (standardized)
+    columns; it is returned as one OutputColumn per target and the predictions
+    have one column per target. The seconds are wall time inside the worker,
+    so they include contention with the fits running next to it.
+
+    Every model has a fixed random_state. Only the forests and XGBoost, whose
+    results do not depend on their thread count, get `threads`; BLAS (the
+    MLP) is pinned to one thread because its sums do, and OpenMP (the
+    histogram booster) is capped at `threads`. So the result is the same
+    whatever the worker/thread split.
+
+    A failing fit raises (naming the base model and target) instead of
+    being replaced by another model.
+    """
+    warnings.filterwarnings("ignore")  # pool workers do not inherit the script's filter
+    X_tr = X if tr_idx is None else X.iloc[tr_idx]
+    y_tr = target if tr_idx is None else target.iloc[tr_idx]
+    name, factory = make_base_factories()[m_idx]
+    shared = isinstance(target, pd.DataFrame)
+    with threadpool_limits(limits=1, user_api='blas'), threadpool_limits(limits=threads, user_api='openmp'):
+        t_start = time.perf_counter()
         try:
-            m = factory()
-            m.fit(X, y[tgt])
-            trained_bases.append((name, m))
-        except:
-            m = RandomForestRegressor(n_estimators=100, random_state=42)
-            m.fit(X, y[tgt])
-            trained_bases.append((name, m))
+            model = factory(threads)
+            if shared:
+                offset, factor = fit_standardized(model, X_tr, y_tr)
+            else:
+                model.fit(X_tr, y_tr)
+        except Exception as e:
+            fitted = 'all targets' if shared else target.name
+            raise RuntimeError(f"base model '{name}' failed to fit {fitted}: {type(e).__name__}: {e}") from e
+        fit_seconds = time.perf_counter() - t_start
+
+        t_start = time.perf_counter()
+        preds = None if te_idx is None else model.predict(X.iloc[te_idx])
+        predict_seconds = time.perf_counter() - t_start
+    if te_idx is not None:
+        return None, (offset + factor * preds if shared else preds), fit_seconds, predict_seconds
+    return (output_columns(model, offset, factor) if shared else model), None, fit_seconds, predict_seconds
+
+def core_split(n_jobs: int) -> Tuple[int, int]:
+    """(workers, threads per fit) sharing the TRAIN_CORES budget among n_jobs independent fits"""
+    cores = TRAIN_CORES or os.cpu_count() or 1
+    workers = max(1, min(cores, n_jobs))
+    return workers, max(1, cores // workers)
+
+def make_folds(X: pd.DataFrame) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """The (train, held-out) row indices shared by OOF stacking and --search"""
+    return list(KFold(n_splits=CV_FOLDS, shuffle=True, random_state=42).split(X))
+
+def run_base_fits(X: pd.DataFrame, y: pd.DataFrame, jobs: List[Tuple[str, Any, Any, int]]) -> List[Tuple[Any, Any, float, float]]:
+    """
+    Independent (target, tr_idx, te_idx, m_idx) fits over a process pool
+    (target None = one multi-output fit for all targets)
 
-    stacked_models[tgt] = {'bases': trained_bases, 'meta': meta}
-    print("Done")
+    The TRAIN_CORES budget is split between workers and the threads inside
+    each fit so the two levels never oversubscribe. Results come back in job
+    order whatever the schedule.
+    """
+    workers, threads = core_split(len(jobs))
+    print(f"  {len(jobs)} fits, {workers} worker(s) x {threads} thread(s)...")
+    return Parallel(n_jobs=workers, backend='loky')(
+        delayed(fit_base)(X, y if tgt is None else y[tgt], m_idx, tr_idx, te_idx, threads)
+        for tgt, tr_idx, te_idx, m_idx in jobs
+    )
+
+def base_timing_summary(timing: Dict[str, Dict[str, Dict[str, List[float]]]], n_rows: int) -> Dict[str, Dict[str, float]]:
+    """
+    Per base model: mean fit seconds per fold and predict microseconds per row, over targets and folds
 
-# ---------- Metrics ----------
-print("\n" + "="*80)
-print("FINAL RESULTS - ENHANCED MODEL v3.0 (ALL FEATURES)")
-print("="*80)
+    Wall time of fits running in parallel (see fit_base), not the cost of one
+    fit on an otherwise idle machine.
+    """
+    targets = list(timing)
+    return {name: {'fit_seconds_per_fold': float(np.mean([timing[t][name]['fit_seconds'] for t in targets])),
+                   'predict_us_per_row': float(np.sum([timing[t][name]['predict_seconds'] for t in targets])
+                                               / (len(targets) * n_rows) * 1e6)}
+            for name in timing[targets[0]]}
+
+def base_fit_jobs(y: pd.DataFrame, base_names: List[str], shared: Tuple[str, ...], folds) -> List[Tuple[Any, Any, Any, int]]:
+    """(target, tr_idx, te_idx, m_idx) per fold: one per target, or one with target None for a shared base"""
+    return ([(tgt, tr_idx, te_idx, m_idx) for tgt in y.columns for tr_idx, te_idx in folds
+             for m_idx, name in enumerate(base_names) if name not in shared]
+            + [(None, tr_idx, te_idx, m_idx) for tr_idx, te_idx in folds
+               for m_idx, name in enumerate(base_names) if name in shared])
+
+def stage_oof(X: pd.DataFrame, y: pd.DataFrame, shared: Tuple[str, ...] = MULTI_OUTPUT_LEARNERS) -> Dict[str, Any]:
+    """
+    Out-of-fold predictions of every base model (targets x folds x bases fits,
+    or folds x bases for the `shared` ones, fitted once for all targets)
+    """
+    base_names = [name for name, _ in make_base_factories()]
+    folds = make_folds(X)
+    oof_predictions = {t: np.zeros((X.shape[0], len(base_names))) for t in y.columns}
+
+    labels = [f"{name}*" if name in shared else name for name in base_names]
+    print(f"\nTraining {len(base_names)} base models with OOF stacking ({', '.join(labels)})"
+          + (" (* = one model for all targets)" if shared else "") + "...")
+    t_fit = time.time()
+    # timing[tgt][base] = fit / predict wall seconds per fold under the pool's load
+    # (a shared base's split evenly over the targets)
+    timing = {t: {name: {'fit_seconds': [], 'predict_seconds': []} for name in base_names} for t in y.columns}
+    jobs = base_fit_jobs(y, base_names, shared, folds)
+    for (tgt, _, te_idx, m_idx), (_, preds, fit_s, predict_s) in zip(jobs, run_base_fits(X, y, jobs)):
+        if tgt is None:
+            for i, t in enumerate(y.columns):
+                oof_predictions[t][te_idx, m_idx] = preds[:, i]
+                timing[t][base_names[m_idx]]['fit_seconds'].append(fit_s / len(y.columns))
+                timing[t][base_names[m_idx]]['predict_seconds'].append(predict_s / len(y.columns))
+            continue
+        oof_predictions[tgt][te_idx, m_idx] = preds
+        timing[tgt][base_names[m_idx]]['fit_seconds'].append(fit_s)
+        timing[tgt][base_names[m_idx]]['predict_seconds'].append(predict_s)
+    print(f"  Done in {time.time() - t_fit:.1f}s")
+    print("  Wall time per base model while sharing the cores with the other fits (not standalone cost):")
+    for name, t in base_timing_summary(timing, len(X)).items():
+        print(f"  {name}: fit {t['fit_seconds_per_fold']:.2f}s per fold, predict {t['predict_us_per_row']:.1f}us per row")
+    return {'oof_predictions': oof_predictions, 'folds': folds, 'base_names': base_names, 'timing': timing,
+            'shared': list(shared)}
+
+def stage_meta(oof_predictions: Dict[str, np.ndarray], y: pd.DataFrame) -> Dict[str, Ridge]:
+    """Ridge stacker per target on the out-of-fold predictions"""
+    metas = {}
+    for tgt in y.columns:
+        meta = Ridge(alpha=STACKER_ALPHA)
+        meta.fit(oof_predictions[tgt], y[tgt])
+        metas[tgt] = meta
+    return metas
+
+def stage_refit(X: pd.DataFrame, y: pd.DataFrame, shared: Tuple[str, ...] = MULTI_OUTPUT_LEARNERS) -> Dict[str, Any]:
+    """
+    Every base model refitted on the full data, per target (plus fit seconds)
 
-for tgt in y.columns:
-    oof_final = stacked_models[tgt]['meta'].predict(oof_predictions[tgt])
-    true = y[tgt].values
+    A `shared` base is fitted once; each target's bases hold an OutputColumn
+    of that one model.
+    """
+    base_names = [name for name, _ in make_base_factories()]
+    print(f"\nRefitting {len(base_names)} base models on the full data...")
+    t_fit = time.time()
+    jobs = base_fit_jobs(y, base_names, shared, [(None, None)])
+    bases = {tgt: [None] * len(base_names) for tgt in y.columns}
+    fit_seconds = {tgt: {} for tgt in y.columns}
+    for (tgt, _, _, m_idx), (model, _, fit_s, _) in zip(jobs, run_base_fits(X, y, jobs)):
+        name = base_names[m_idx]
+        if tgt is None:
+            for t, column in zip(y.columns, model):
+                bases[t][m_idx] = (name, column)
+                fit_seconds[t][name] = fit_s / len(y.columns)
+            continue
+        bases[tgt][m_idx] = (name, model)
+        fit_seconds[tgt][name] = fit_s
+    print(f"  Done in {time.time() - t_fit:.1f}s")
+    return {'bases': bases, 'fit_seconds': fit_seconds}
 
-    r2 = r2_score(true, oof_final)
-    rmse = np.sqrt(np.mean((true - oof_final) ** 2))
-    mae = mean_absolute_error(true, oof_final)
-    mape_val = mape(true, oof_final)
+# ---------- Metrics ----------
+def report_metrics(stacked_models: Dict[str, Any], oof_predictions: Dict[str, np.ndarray], y: pd.DataFrame) -> Dict[str, float]:
+    """Out-of-fold R2/RMSE/MAE/MAPE of the stacked models; returns R2 per target"""
+    print("\n" + "="*80)
+    print("FINAL RESULTS - ENHANCED MODEL v3.0 (ALL FEATURES)")
+    print("="*80)
+
+    for tgt in y.columns:
+        oof_final = stacked_models[tgt]['meta'].predict(oof_predictions[tgt])
+        true = y[tgt].values
+
+        r2 = r2_score(true, oof_final)
+        rmse = np.sqrt(np.mean((true - oof_final) ** 2))
+        mae = mean_absolute_error(true, oof_final)
+        mape_val = mape(true, oof_final)
+
+        status = "[OK]" if r2 >= 0.90 else "[CLOSE]" if r2 >= 0.85 else "[LOW]"
+
+        print(f"\n{tgt}: R2 = {r2:.4f} ({r2*100:.2f}%) {status}")
+        print(f"  RMSE: {rmse:.4f} | MAE: {mae:.4f} | MAPE: {mape_val:.2f}%")
+
+        comp = pd.DataFrame({'true': true[:5], 'pred': oof_final[:5]})
+        print(f"  Sample: {comp.to_string(index=False, float_format=lambda x: f'{x:.5f}', header=False)}")
+
+    # Summary
+    print("\n" + "="*80)
+    results = {tgt: r2_score(y[tgt], stacked_models[tgt]['meta'].predict(oof_predictions[tgt])) for tgt in y.columns}
+    achieved = sum(1 for r2 in results.values() if r2 >= 0.90)
+    print(f"SUMMARY: {achieved}/{len(results)} parameters achieved >90%")
+    for tgt, r2 in results.items():
+        print(f"  {tgt}: {r2*100:.2f}%")
+    print("="*80)
+    return results
 
-    status = "[OK]" if r2 >= 0.90 else "[CLOSE]" if r2 >= 0.85 else "[LOW]"
+# ---------- Save ----------
+def stage_export(stacked_models, features: Dict[str, Any], fitted_df: pd.DataFrame,
+                 targets: Dict[str, Any], results: Dict[str, float],
+                 oof: Dict[str, Any], refit: Dict[str, Any]) -> None:
+    """Model artifacts into OUTDIR (always runs: the files are its checkpoint)"""
+    X = features['X']
+    print(f"\nSaving to {OUTDIR}...")
+    os.makedirs(OUTDIR, exist_ok=True)
+    dump(stacked_models, os.path.join(OUTDIR, "stacked_models.joblib"))
+    dump(features['enc'], os.path.join(OUTDIR, "onehot_encoder.joblib"))
+    dump(features['scaler'], os.path.join(OUTDIR, "scaler.joblib"))
+    dump(features['similar_patients'], os.path.join(OUTDIR, "similar_patients.joblib"))
+    dump(features['drift_reference'], os.path.join(OUTDIR, "drift_reference.joblib"))
+    with open(os.path.join(OUTDIR, "feature_columns.json"), "w") as f:
+        json.dump(list(X.columns), f)
+    fitted_df.to_csv(os.path.join(OUTDIR, "fitted_params.csv"), index=False)
+
+    # Inputs of the meta-learner, for --meta-only experiments without refitting any base model
+    dump({
+        'targets': list(features['y'].columns),
+        'base_names': oof['base_names'],
+        'shared': oof['shared'],
+        'oof_predictions': oof['oof_predictions'],
+        'y': features['y'].to_numpy(),
+        'fold_test_indices': [te_idx for _, te_idx in oof['folds']],
+        'timing': {'oof': oof['timing'], 'refit_fit_seconds': refit['fit_seconds']}
+    }, os.path.join(OUTDIR, OOF_FILE))
+
+    with open(os.path.join(OUTDIR, "metadata.json"), "w") as f:
+        json.dump({
+            'version': '3.0',
+            'baseline_r': targets['baseline_r'],
+            'r_untreated': float(targets['r_untreated']),
+            'results': {k: float(v) for k, v in results.items()},
+            'stackers': {k: f"ridge(alpha={STACKER_ALPHA:g})" for k in results},
+            'base_models': {name: {**t, 'refit_seconds': float(np.mean([refit['fit_seconds'][tgt][name]
+                                                                         for tgt in refit['fit_seconds']])),
+                                   'shared': name in oof['shared']}
+                            for name, t in base_timing_summary(oof['timing'], len(X)).items()},
+            'base_model_timing': 'wall seconds of fits sharing TRAIN_CORES in parallel, not standalone fit cost',
+            'n_features': len(X.columns),
+            'n_samples': len(X),
+            'dosage_aware': True,
+            'full_features': True,  # NEW flag
+            'feature_groups': {
+                'basic': features['features_basic'],
+                'categorical': features['categorical'],
+                'total': len(X.columns)
+            }
+        }, f, indent=2)
+
+# ---------- Meta-only retraining ----------
+def stacker_candidates(base_names: List[str]) -> Dict[str, Tuple[List[int], Any]]:
+    """
+    Stackers compared by --meta-only: name -> (base columns, meta factory)
 
-    print(f"\n{tgt}: R2 = {r2:.4f} ({r2*100:.2f}%) {status}")
-    print(f"  RMSE: {rmse:.4f} | MAE: {mae:.4f} | MAPE: {mape_val:.2f}%")
+    All linear (coef_/intercept_), as serving and the attributions expect.
+    """
+    all_cols = list(range(len(base_names)))
+    candidates = {f"ridge(alpha={a:g})": (all_cols, lambda a=a: Ridge(alpha=a)) for a in STACKER_ALPHAS}
+    candidates['nonnegative_linear'] = (all_cols, lambda: LinearRegression(positive=True))
+    if len(base_names) > 1:
+        for i, name in enumerate(base_names):
+            candidates[f"ridge(alpha={STACKER_ALPHA:g}) without {name}"] = (
+                [j for j in all_cols if j != i], lambda: Ridge(alpha=STACKER_ALPHA))
+            candidates[f"{name} only"] = ([i], lambda: LinearRegression())
+    return candidates
+
+def cross_val_stacker(P: np.ndarray, true: np.ndarray, fold_test_indices, factory) -> np.ndarray:
+    """Held-out predictions of a stacker refitted on the OOF matrix without each fold in turn"""
+    n = len(true)
+    pred = np.empty(n)
+    for te_idx in fold_test_indices:
+        train = np.ones(n, dtype=bool)
+        train[te_idx] = False
+        pred[te_idx] = factory().fit(P[train], true[train]).predict(P[te_idx])
+    return pred
+
+def evaluate_stackers(data: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Leaderboard per target: every candidate cross-validated on the saved OOF
+    matrix over the saved folds (best CV R2 first)
 
-    comp = pd.DataFrame({'true': true[:5], 'pred': oof_final[:5]})
-    print(f"  Sample: {comp.to_string(index=False, float_format=lambda x: f'{x:.5f}', header=False)}")
+    predict_us_per_row is the summed base-model inference time of the
+    candidate's bases, from the OOF timings.
+    """
+    base_names, folds = data['base_names'], data['fold_test_indices']
+    candidates = stacker_candidates(base_names)
+    n = len(data['y'])
+    leaderboard = {}
+
+    for t_idx, tgt in enumerate(data['targets']):
+        P, true = data['oof_predictions'][tgt], data['y'][:, t_idx]
+        predict_us = {b: np.sum(data['timing']['oof'][tgt][b]['predict_seconds']) / n * 1e6 for b in base_names}
+        rows = []
+        for name, (cols, factory) in candidates.items():
+            t_start = time.perf_counter()
+            pred = cross_val_stacker(P[:, cols], true, folds, factory)
+            rows.append({
+                'stacker': name,
+                'bases': [base_names[c] for c in cols],
+                'cv_r2': float(r2_score(true, pred)),
+                'cv_rmse': float(np.sqrt(np.mean((true - pred) ** 2))),
+                'predict_us_per_row': float(sum(predict_us[base_names[c]] for c in cols)),
+                'eval_ms': (time.perf_counter() - t_start) * 1000
+            })
+        leaderboard[tgt] = sorted(rows, key=lambda r: -r['cv_r2'])
+    return leaderboard
+
+def run_meta_only(stacker: Optional[str]) -> None:
+    """
+    Compare stackers on the saved OOF predictions; with `stacker` (a
+    leaderboard name or 'best' per target), refit it on the full OOF matrix
+    and rewrite the metas (and, for base subsets, the bases) in OUTDIR
+    """
+    path = os.path.join(OUTDIR, OOF_FILE)
+    if not os.path.exists(path):
+        sys.exit(f"{path} not found: run a full training first")
+    data = load(path)
+
+    print(f"Meta-only: {len(data['base_names'])} base models ({', '.join(data['base_names'])}), "
+          f"{len(data['y'])} rows, {len(data['fold_test_indices'])} folds from {path}")
+    t_start = time.perf_counter()
+    leaderboard = evaluate_stackers(data)
+    n_candidates = len(next(iter(leaderboard.values())))
+    print(f"Evaluated {n_candidates} stackers x {len(leaderboard)} targets in "
+          f"{(time.perf_counter() - t_start) * 1000:.0f}ms")
+
+    current = f"ridge(alpha={STACKER_ALPHA:g})"
+    for tgt, rows in leaderboard.items():
+        print(f"\n{tgt}:")
+        print(f"  {'#':>3} {'stacker':<36} {'CV R2':>8} {'CV RMSE':>10} {'us/row':>8}")
+        for rank, row in enumerate(rows, 1):
+            mark = ' *' if row['stacker'] == current else ''
+            print(f"  {rank:>3} {row['stacker']:<36} {row['cv_r2']:>8.4f} {row['cv_rmse']:>10.5f} "
+                  f"{row['predict_us_per_row']:>8.1f}{mark}")
+    print(f"\n* = configured stacker (STACKER_ALPHA={STACKER_ALPHA:g})")
+
+    with open(os.path.join(OUTDIR, "stacker_leaderboard.json"), "w") as f:
+        json.dump(leaderboard, f, indent=2)
+    if stacker is None:
+        return
+
+    candidates = stacker_candidates(data['base_names'])
+    stacked_models = load(os.path.join(OUTDIR, "stacked_models.joblib"))
+    with open(os.path.join(OUTDIR, "metadata.json")) as f:
+        metadata = json.load(f)
+
+    for t_idx, tgt in enumerate(data['targets']):
+        name = leaderboard[tgt][0]['stacker'] if stacker == 'best' else stacker
+        if name not in candidates:
+            sys.exit(f"Unknown stacker '{name}' (names as in the leaderboard, or 'best')")
+        cols, factory = candidates[name]
+        fitted = dict(stacked_models[tgt]['bases'])
+        keep = [data['base_names'][c] for c in cols]
+        if any(b not in fitted for b in keep):
+            sys.exit(f"{tgt}: base models dropped by an earlier --meta-only run; "
+                     f"run the training script again to restore them")
+
+        P, true = data['oof_predictions'][tgt][:, cols], data['y'][:, t_idx]
+        meta = factory().fit(P, true)
+        stacked_models[tgt] = {'bases': [(b, fitted[b]) for b in keep], 'meta': meta}
+        metadata['results'][tgt] = float(r2_score(true, meta.predict(P)))
+        metadata.setdefault('stackers', {})[tgt] = name
+        print(f"{tgt}: {name} (OOF R2 {metadata['results'][tgt]:.4f})")
+
+    dump(stacked_models, os.path.join(OUTDIR, "stacked_models.joblib"))
+    with open(os.path.join(OUTDIR, "metadata.json"), "w") as f:
+        json.dump(metadata, f, indent=2)
+    print(f"Saved to {OUTDIR}/")
+
+# ---------- Hyperparameter search ----------
+def search_fit(X: pd.DataFrame, target: pd.Series, learner: str, params: Dict[str, Any], tr_idx, te_idx, threads: int):
+    """One candidate on one fold: (held-out predictions, fit seconds, predict seconds) or the error text"""
+    warnings.filterwarnings("ignore")
+    with threadpool_limits(limits=1, user_api='blas'), threadpool_limits(limits=threads, user_api='openmp'):
+        try:
+            t_start = time.perf_counter()
+            model = make_base_learner(learner, threads, **params)
+            model.fit(X.iloc[tr_idx], target.iloc[tr_idx])
+            fit_seconds = time.perf_counter() - t_start
+            t_start = time.perf_counter()
+            preds = model.predict(X.iloc[te_idx])
+            return preds, fit_seconds, time.perf_counter() - t_start
+        except Exception as e:
+            return f"{type(e).__name__}: {e}"
+
+def search_rungs() -> List[int]:
+    """Folds evaluated per successive-halving rung: 1, ETA, ETA^2, ... up to CV_FOLDS"""
+    rungs = [1]
+    while rungs[-1] < CV_FOLDS:
+        rungs.append(min(CV_FOLDS, rungs[-1] * SEARCH_ETA))
+    return rungs
+
+def run_search(X: pd.DataFrame, y: pd.DataFrame, budget_seconds: float) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Successive halving over SEARCH_SPACE, per target and base model
+
+    Every registered base model is searched, also those not in BASE_LEARNERS,
+    so a candidate learner can be compared before it is stacked. Every setting starts on one fold of the OOF split; at each rung the best
+    1/SEARCH_ETA (by R2 over the rows evaluated so far) of each
+    (target, base model) bracket go on to more folds, keeping the folds
+    already done. All fits of a rung run in one pool under the TRAIN_CORES
+    budget. The wall-clock budget is checked between batches of fits; once
+    it runs out the remaining fits are skipped and every setting is
+    reported with the folds it got.
+    """
+    folds = make_folds(X)
+    learners = list(BASE_LEARNER_REGISTRY)
+    candidates = []
+    for tgt in y.columns:
+        for learner in learners:
+            space = SEARCH_SPACE.get(learner, {})
+            for slot, values in enumerate(itertools.product(*space.values())):
+                candidates.append({'target': tgt, 'learner': learner, 'params': dict(zip(space, values)), 'slot': slot,
+                                   'te_idx': [], 'preds': [], 'fit_seconds': [], 'predict_seconds': 0.0,
+                                   'rung': 0, 'alive': True, 'error': None})
+
+    rungs = search_rungs()
+    deadline = time.time() + budget_seconds
+    print(f"\nSearching {len(candidates)} settings ({len(y.columns)} targets x {len(learners)} base models), "
+          f"rungs of {rungs} folds, budget {budget_seconds:.0f}s")
+
+    def r2_of(c):
+        idx = np.concatenate(c['te_idx'])
+        return r2_score(y[c['target']].to_numpy()[idx], np.concatenate(c['preds']))
+
+    out_of_time = False
+    for rung, n_folds in enumerate(rungs):
+        # Interleaved across targets and base models, so a budget cut leaves every bracket scored
+        jobs = sorted([(c, f) for c in candidates if c['alive'] for f in range(len(c['te_idx']), n_folds)],
+                      key=lambda job: (job[1], job[0]['slot']))
+        workers, threads = core_split(len(jobs))
+        print(f"  Rung {rung}: {sum(c['alive'] for c in candidates)} settings on {n_folds} fold(s), "
+              f"{len(jobs)} fits, {workers} worker(s) x {threads} thread(s)...")
+        batch = 2 * workers
+        for start in range(0, len(jobs), batch):
+            if time.time() > deadline:
+                out_of_time = True
+                break
+            chunk = jobs[start:start + batch]
+            results = Parallel(n_jobs=workers, backend='loky')(
+                delayed(search_fit)(X, y[c['target']], c['learner'], c['params'],
+                                    folds[f][0], folds[f][1], threads)
+                for c, f in chunk
+            )
+            for (c, f), result in zip(chunk, results):
+                if isinstance(result, str):
+                    c['error'], c['alive'] = result, False
+                    continue
+                preds, fit_s, predict_s = result
+                c['te_idx'].append(folds[f][1])
+                c['preds'].append(preds)
+                c['fit_seconds'].append(fit_s)
+                c['predict_seconds'] += predict_s
+        if out_of_time:
+            print(f"  Budget of {budget_seconds:.0f}s reached during rung {rung}")
+            break
 
-# Summary
-print("\n" + "="*80)
-results = {tgt: r2_score(y[tgt], stacked_models[tgt]['meta'].predict(oof_predictions[tgt])) for tgt in y.columns}
-achieved = sum(1 for r2 in results.values() if r2 >= 0.90)
-print(f"SUMMARY: {achieved}/{len(results)} parameters achieved >90%")
-for tgt, r2 in results.items():
-    print(f"  {tgt}: {r2*100:.2f}%")
-print("="*80)
+        for c in candidates:
+            if c['alive']:
+                c['rung'] = rung
+        if rung == len(rungs) - 1:
+            break
+        # Promote the best 1/ETA of each (target, base model) bracket
+        for tgt in y.columns:
+            for learner in learners:
+                alive = [c for c in candidates if c['alive'] and c['target'] == tgt and c['learner'] == learner]
+                alive.sort(key=lambda c: -r2_of(c))
+                for c in alive[max(1, -(-len(alive) // SEARCH_ETA)):]:
+                    c['alive'] = False
+
+    current = {}
+    for name in learners:
+        try:
+            current[name] = make_base_learner(name, 1).get_params()
+        except ImportError:
+            current[name] = {}  # its fits failed and carry the error
+    leaderboard = {}
+    for tgt in y.columns:
+        rows = []
+        for c in (c for c in candidates if c['target'] == tgt):
+            n_rows = sum(len(i) for i in c['te_idx'])
+            defaults = {k: current[c['learner']].get(k) for k in c['params']}
+            rows.append({
+                'learner': c['learner'],
+                'params': c['params'],
+                'folds': len(c['te_idx']),
+                'rung': c['rung'],
+                'finalist': c['alive'] and not out_of_time and len(c['te_idx']) == CV_FOLDS,
+                'cv_r2': float(r2_of(c)) if n_rows else None,
+                'cv_rmse': float(np.sqrt(np.mean((y[tgt].to_numpy()[np.concatenate(c['te_idx'])]
+                                                  - np.concatenate(c['preds'])) ** 2))) if n_rows else None,
+                'fit_seconds_per_fold': float(np.mean(c['fit_seconds'])) if n_rows else None,
+                'predict_us_per_row': c['predict_seconds'] / n_rows * 1e6 if n_rows else None,
+                'is_default': c['params'] == defaults,
+                'selected': c['learner'] in BASE_LEARNERS,
+                'error': c['error']
+            })
+        # Most folds first (scores on more folds are comparable), then accuracy
+        rows.sort(key=lambda r: (-r['folds'], -(r['cv_r2'] if r['cv_r2'] is not None else -np.inf)))
+        leaderboard[tgt] = rows
+    return leaderboard
+
+def report_search(leaderboard: Dict[str, List[Dict[str, Any]]], top: int = 3) -> None:
+    """Per target and base model: the best settings with accuracy and latency"""
+    print("\n" + "="*80)
+    print("SEARCH LEADERBOARD (per target and base model, most folds first;\n"
+          " * = current BASE_PARAMS, - = not in BASE_LEARNERS)")
+    print("="*80)
+    for tgt, rows in leaderboard.items():
+        print(f"\n{tgt}:")
+        print(f"  {'model':<5} {'folds':>5} {'CV R2':>8} {'CV RMSE':>10} {'fit s':>7} {'us/row':>8}  params")
+        for learner in dict.fromkeys(r['learner'] for r in rows):
+            for r in [r for r in rows if r['learner'] == learner and r['cv_r2'] is not None][:top]:
+                mark = ' *' if r['is_default'] else ''
+                name = learner if r['selected'] else f"{learner}-"
+                print(f"  {name:<5} {r['folds']:>5} {r['cv_r2']:>8.4f} {r['cv_rmse']:>10.5f} "
+                      f"{r['fit_seconds_per_fold']:>7.2f} {r['predict_us_per_row']:>8.1f}  {r['params']}{mark}")
+        failed = [r for r in rows if r['error']]
+        if failed:
+            print(f"  {len(failed)} setting(s) failed, e.g. {failed[0]['learner']} {failed[0]['params']}: {failed[0]['error']}")
+
+# ---------- Layout comparison ----------
+def evaluate_layout(X: pd.DataFrame, y: pd.DataFrame, oof: Dict[str, Any], refit: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Accuracy and cost of one base-model layout
 
-# ---------- Save ----------
-print(f"\nSaving to {OUTDIR}...")
-dump(stacked_models, os.path.join(OUTDIR, "stacked_models.joblib"))
-dump(enc, os.path.join(OUTDIR, "onehot_encoder.joblib"))
-dump(scaler, os.path.join(OUTDIR, "scaler.joblib"))
-with open(os.path.join(OUTDIR, "feature_columns.json"), "w") as f:
-    json.dump(list(X.columns), f)
-fitted_df.to_csv(os.path.join(OUTDIR, "fitted_params.csv"), index=False)
-
-with open(os.path.join(OUTDIR, "metadata.json"), "w") as f:
-    json.dump({
-        'version': '3.0',
-        'baseline_r': baseline_r,
-        'r_untreated': float(r_untreated),
-        'results': {k: float(v) for k, v in results.items()},
-        'n_features': len(X.columns),
-        'n_samples': len(X),
-        'dosage_aware': True,
-        'full_features': True,  # NEW flag
-        'feature_groups': {
-            'basic': features_basic,
-            'categorical': categorical,
-            'total': len(X.columns)
-        }
-    }, f, indent=2)
-
-elapsed = time.time() - t0
-print(f"\nTotal time: {elapsed:.1f}s ({elapsed/60:.1f}m)")
-print("\n" + "="*80)
-print("TRAINING COMPLETE - ENHANCED MODEL v3.0")
-print("="*80)
-print(f"Model saved to: {OUTDIR}/")
-print(f"Features: {len(X.columns)} (OLD: 76 → NEW: {len(X.columns)})")
-print("="*80)
+    Accuracy is the CV R2/RMSE per target of the configured Ridge stacker
+    over the OOF folds. Cost is the fit seconds summed over all base fits
+    (OOF and refit), the pickled size of the refitted bases and their
+    inference time for all four targets, each fitted model predicted once.
+    """
+    folds = [te_idx for _, te_idx in oof['folds']]
+    accuracy = {}
+    for tgt in y.columns:
+        true = y[tgt].to_numpy()
+        pred = cross_val_stacker(oof['oof_predictions'][tgt], true, folds, lambda: Ridge(alpha=STACKER_ALPHA))
+        accuracy[tgt] = {'cv_r2': float(r2_score(true, pred)), 'cv_rmse': float(np.sqrt(np.mean((true - pred) ** 2)))}
+
+    models = {}
+    for tgt in y.columns:
+        for _, m in refit['bases'][tgt]:
+            model = m.model if isinstance(m, OutputColumn) else m
+            models[id(model)] = model
+    buf = io.BytesIO()
+    dump(refit['bases'], buf)
+    with threadpool_limits(limits=1, user_api='blas'):
+        t_start = time.perf_counter()
+        for model in models.values():
+            model.predict(X)
+        predict_seconds = time.perf_counter() - t_start
+
+    fit_seconds = sum(np.sum(times['fit_seconds']) for per_base in oof['timing'].values() for times in per_base.values())
+    fit_seconds += sum(s for per_base in refit['fit_seconds'].values() for s in per_base.values())
+    return {'shared': oof['shared'], 'accuracy': accuracy, 'fitted_models': len(models),
+            'fit_seconds': float(fit_seconds), 'artifact_bytes': buf.tell(),
+            'predict_us_per_row': predict_seconds / len(X) * 1e6}
+
+def report_layouts(results: Dict[str, Dict[str, Any]]) -> None:
+    """Per-target vs shared layout: accuracy per target, then cost with the shared/per-target ratio"""
+    per, shared = results['per_target'], results['shared']
+    print("\n" + "="*80)
+    print(f"LAYOUT COMPARISON (shared: {', '.join(shared['shared'])} fitted once for all targets)")
+    print("="*80)
+    print(f"  {'target':<14} {'per-target R2':>14} {'shared R2':>10} {'per-target RMSE':>16} {'shared RMSE':>12}")
+    for tgt, a in per['accuracy'].items():
+        b = shared['accuracy'][tgt]
+        print(f"  {tgt:<14} {a['cv_r2']:>14.4f} {b['cv_r2']:>10.4f} {a['cv_rmse']:>16.5f} {b['cv_rmse']:>12.5f}")
+    print(f"\n  {'':<22} {'per-target':>12} {'shared':>12} {'ratio':>7}")
+    for key, label, fmt in (('fitted_models', 'fitted base models', '{:.0f}'),
+                            ('fit_seconds', 'fit seconds (sum)', '{:.1f}'),
+                            ('artifact_bytes', 'artifact MB', '{:.2f}'),
+                            ('predict_us_per_row', 'predict us/row', '{:.1f}')):
+        scale = 1e-6 if key == 'artifact_bytes' else 1
+        print(f"  {label:<22} {fmt.format(per[key] * scale):>12} {fmt.format(shared[key] * scale):>12} "
+              f"{shared[key] / per[key]:>7.2f}")
+
+# ---------- Main ----------
+def main():
+    parser = argparse.ArgumentParser(description='Train the v3.0 stacked Gompertz-parameter models')
+    parser.add_argument('--from', dest='from_stage', choices=STAGES,
+                       help='Recompute this stage and every later one, ignoring their checkpoints')
+    parser.add_argument('--no-checkpoints', action='store_true',
+                       help=f'Neither read nor write {CHECKPOINT_DIR}/')
+    parser.add_argument('--meta-only', action='store_true',
+                       help=f'Only compare stackers on {OUTDIR}/{OOF_FILE} (no base model is fitted)')
+    parser.add_argument('--stacker', metavar='NAME',
+                       help="With --meta-only: refit this leaderboard stacker ('best' = per target) and save it")
+    parser.add_argument('--search', action='store_true',
+                       help='Successive-halving search over SEARCH_SPACE instead of training (leaderboard only)')
+    parser.add_argument('--compare-layouts', action='store_true',
+                       help='Train the per-target and the shared multi-output base-model layouts and compare them '
+                            '(no models saved)')
+    parser.add_argument('--budget', type=float, default=SEARCH_BUDGET_SECONDS,
+                       help=f'Wall-clock seconds for --search (default: {SEARCH_BUDGET_SECONDS})')
+    args = parser.parse_args()
+    if args.stacker and not args.meta_only:
+        parser.error('--stacker needs --meta-only')
+    if args.meta_only:
+        run_meta_only(args.stacker)
+        return
+
+    np.random.seed(42)
+    t0 = time.time()
+
+    print("="*80)
+    print("GBM TREATMENT OPTIMIZATION - ENHANCED TRAINING v3.0")
+    print("="*80)
+    print(f"NEW: All available features (neurological, genetic, clinical)")
+    print(f"Output directory: {OUTDIR}")
+    print("="*80)
+
+    rerun = STAGES[STAGES.index(args.from_stage):] if args.from_stage else []
+    rerun += [f"{stage}_{layout}" for stage in rerun if stage in ('oof', 'refit') for layout in ('per_target', 'shared')]
+    runner = StageRunner(None if args.no_checkpoints else CHECKPOINT_DIR, rerun=rerun)
+    base_config = base_model_config()
+
+    raw, _ = runner.run('ingest', stage_ingest, {'checksum': file_checksum(INPUT_XLSX)}, checkpoint=False)
+    parsed, _ = runner.run(
+        'parse', lambda: stage_parse(raw), upstream=['ingest'],
+        code=[stage_parse, parse_treatment_flags, parse_dosage_features, parse_neurological_symptoms,
+              _lower_text, _contains, _first_match])
+    fitted, _ = runner.run(
+        'fit', lambda: stage_fit(parsed), {'maxfev': GOMPERTZ_MAXFEV}, upstream=['parse'],
+        code=[stage_fit, gbm_gompertz_fit])
+    targets, _ = runner.run(
+        'targets', lambda: stage_targets(fitted['df']), {'seed': RANDOM_SEED}, upstream=['fit'],
+        code=[stage_targets])
+    features, _ = runner.run(
+        'features', lambda: stage_features(targets['df']),
+        {'similar_info_cols': SIMILAR_INFO_COLS, 'sklearn': sklearn.__version__}, upstream=['targets'],
+        code=[stage_features, safe_numeric_cast, gbm_drift_monitor])
+    X, y = features['X'], features['y']
+
+    if args.search:
+        t_search = time.time()
+        leaderboard = run_search(X, y, args.budget)
+        report_search(leaderboard)
+        os.makedirs(OUTDIR, exist_ok=True)
+        with open(os.path.join(OUTDIR, "search_leaderboard.json"), "w") as f:
+            json.dump(leaderboard, f, indent=2)
+        print(f"\nSearch took {time.time() - t_search:.1f}s; full leaderboard in {OUTDIR}/search_leaderboard.json")
+        print("Copy chosen settings into BASE_PARAMS and train to use them.")
+        return
+
+    print(f"\nBase models: {', '.join(BASE_LEARNERS)}"
+          + (f" (xgboost {base_config['xgboost']})" if base_config['xgboost'] else ""))
+    fit_code = ([run_base_fits, fit_base, base_fit_jobs, make_base_factories, make_base_learner, make_folds,
+                 gbm_multi_output] + [BASE_LEARNER_REGISTRY[n] for n in BASE_LEARNERS])
+
+    def fit_stages(shared: Tuple[str, ...], suffix: str = ''):
+        config = base_model_config(shared)
+        oof, _ = runner.run(
+            f'oof{suffix}', lambda: stage_oof(X, y, shared), {'cv_folds': CV_FOLDS, **config},
+            upstream=['features'], code=[stage_oof, base_timing_summary] + fit_code)
+        refit, _ = runner.run(
+            f'refit{suffix}', lambda: stage_refit(X, y, shared), config, upstream=['features'],
+            code=[stage_refit] + fit_code)
+        return oof, refit
+
+    if args.compare_layouts:
+        shared = tuple(n for n in BASE_LEARNERS if n in MULTI_OUTPUT_CAPABLE)
+        if not shared:
+            sys.exit(f"--compare-layouts: none of BASE_LEARNERS is one of {', '.join(MULTI_OUTPUT_CAPABLE)}")
+        results = {}
+        for label, layout in (('per_target', ()), ('shared', shared)):
+            # The configured layout reuses the training checkpoints
+            suffix = '' if layout == tuple(MULTI_OUTPUT_LEARNERS) else f'_{label}'
+            results[label] = evaluate_layout(X, y, *fit_stages(layout, suffix))
+        report_layouts(results)
+        os.makedirs(OUTDIR, exist_ok=True)
+        with open(os.path.join(OUTDIR, "layout_comparison.json"), "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved to {OUTDIR}/layout_comparison.json; set MULTI_OUTPUT_LEARNERS and train to use a layout.")
+        return
+
+    oof, refit = fit_stages(MULTI_OUTPUT_LEARNERS)
+    metas, _ = runner.run(
+        'meta', lambda: stage_meta(oof['oof_predictions'], y), {'stacker_alpha': STACKER_ALPHA},
+        upstream=['oof'], code=[stage_meta])
+
+    stacked_models = {tgt: {'bases': refit['bases'][tgt], 'meta': metas[tgt]} for tgt in y.columns}
+    results = report_metrics(stacked_models, oof['oof_predictions'], y)
+
+    runner.run('export', lambda: stage_export(stacked_models, features, fitted['fitted_df'], targets, results, oof, refit),
+               upstream=['fit', 'targets', 'features', 'meta', 'refit'], checkpoint=False)
+
+    stages = ', '.join(f"{e['stage']} {e['status']} {e['seconds']:.1f}s" for e in runner.log)
+    print(f"\nStages: {stages}")
+
+    elapsed = time.time() - t0
+    print(f"\nTotal time: {elapsed:.1f}s ({elapsed/60:.1f}m)")
+    print("\n" + "="*80)
+    print("TRAINING COMPLETE - ENHANCED MODEL v3.0")
+    print("="*80)
+    print(f"Model saved to: {OUTDIR}/")
+    print(f"Features: {len(X.columns)} (OLD: 76 → NEW: {len(X.columns)})")
+    print("="*80)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the checkpointed training stages (gbm_checkpoint.py)
+
+Uses a temporary checkpoint directory:
+    python test_checkpoint.py
+"""
+
+import os
+import sys
+import tempfile
+
+from gbm_checkpoint import StageRunner, stage_key
+
+def double(x):
+    return 2 * x
+
+def triple(x):
+    return 3 * x
+
+def run_pipeline(directory, alpha, calls, rerun=()):
+    """Two stages: 'data' (config alpha) and 'model' reading it"""
+    def data():
+        calls.append('data')
+        return [alpha, alpha + 1]
+
+    def model():
+        calls.append('model')
+        return [double(v) for v in values]
+
+    runner = StageRunner(directory, rerun=rerun)
+    values, _ = runner.run('data', data, {'alpha': alpha})
+    result, _ = runner.run('model', model, upstream=['data'], code=[double])
+    return result, runner
+
+def test_unchanged_stages_are_loaded():
+    with tempfile.TemporaryDirectory() as tmp:
+        calls = []
+        first, _ = run_pipeline(tmp, 1, calls)
+        second, runner = run_pipeline(tmp, 1, calls)
+        assert first == second == [2, 4]
+        assert calls == ['data', 'model'], calls
+        assert [e['status'] for e in runner.log] == ['loaded', 'loaded']
+    print("✓ PASSED: unchanged stages are loaded")
+
+def test_config_change_invalidates_downstream():
+    """A new config recomputes the stage and, through its key, every stage after it"""
+    with tempfile.TemporaryDirectory() as tmp:
+        calls = []
+        run_pipeline(tmp, 1, calls)
+        result, _ = run_pipeline(tmp, 5, calls)
+        assert result == [10, 12]
+        assert calls == ['data', 'model', 'data', 'model'], calls
+        assert sorted(f.split('-')[0] for f in os.listdir(tmp)) == ['data', 'model']
+    print("✓ PASSED: config change invalidates downstream stages")
+
+def test_rerun_and_code_change():
+    with tempfile.TemporaryDirectory() as tmp:
+        calls = []
+        run_pipeline(tmp, 1, calls)
+        run_pipeline(tmp, 1, calls, rerun=['model'])
+        assert calls == ['data', 'model', 'model'], calls
+    assert stage_key('model', {}, code=[double]) != stage_key('model', {}, code=[triple])
+    assert stage_key('model', {'a': 1}) != stage_key('model', {'a': 2})
+    assert stage_key('model', {}, upstream=['k1']) != stage_key('model', {}, upstream=['k2'])
+    print("✓ PASSED: forced rerun and code changes")
+
+def test_disabled_directory_always_computes():
+    calls = []
+    run_pipeline(None, 1, calls)
+    run_pipeline(None, 1, calls)
+    assert calls == ['data', 'model'] * 2, calls
+    print("✓ PASSED: no checkpoint directory always computes")
+
+def main():
+    tests = [
+        test_unchanged_stages_are_loaded,
+        test_config_change_invalidates_downstream,
+        test_rerun_and_code_change,
+        test_disabled_directory_always_computes
+    ]
+
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            failed += 1
+            print(f"✗ FAILED: {test.__name__}: {e}")
+
+    print(f"\nPassed: {len(tests) - failed}/{len(tests)}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the Feather cache of the training workbook (gbm_dataset_cache.py)
+
+Writes small workbooks to a temporary directory:
+    python test_dataset_cache.py
+"""
+
+import os
+import sys
+import tempfile
+import numpy as np
+import pandas as pd
+
+from gbm_dataset_cache import load_workbook_cached, read_workbook, PYARROW_AVAILABLE
+
+def write_workbook(path, ages):
+    with pd.ExcelWriter(path) as writer:
+        for sheet, offset in (('Stage 3', 0), ('Stage 4', 100)):
+            pd.DataFrame({
+                'patient_id': [f"P{offset + i}" for i in range(len(ages))] + [np.nan],
+                'age': list(ages) + [50.0],
+                'mgmt_methylation': [i % 2 == 0 for i in range(len(ages))] + [np.nan],
+                'treatment': ['TMZ 75 mg/m2'] * len(ages) + [np.nan]
+            }).to_excel(writer, sheet_name=sheet, index=False)
+
+def test_cache_round_trip():
+    """The cached frame equals read_excel's, including missing values and `stage`"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path, cache_dir = os.path.join(tmp, 'data.xlsx'), os.path.join(tmp, 'cache')
+        write_workbook(path, [55.0, 61.0, 70.0])
+        first, info = load_workbook_cached(path, cache_dir)
+        second, cached = load_workbook_cached(path, cache_dir)
+        assert info['source'] == 'excel' and cached['source'] == 'cache'
+        assert os.path.exists(cached['cache'])
+        pd.testing.assert_frame_equal(second, read_workbook(path))
+        assert list(second['stage'].unique()) == ['Stage 3', 'Stage 4']
+        assert second['patient_id'].isna().sum() == 2 and second['patient_id'].iloc[-1] is not None
+    print("✓ PASSED: cache round trip")
+
+def test_changed_workbook_rebuilds():
+    """A new checksum rebuilds the cache and removes the stale file"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path, cache_dir = os.path.join(tmp, 'data.xlsx'), os.path.join(tmp, 'cache')
+        write_workbook(path, [55.0, 61.0])
+        _, old = load_workbook_cached(path, cache_dir)
+        write_workbook(path, [55.0, 61.0, 80.0])
+        df, new = load_workbook_cached(path, cache_dir)
+        assert new['source'] == 'excel' and new['checksum'] != old['checksum']
+        assert len(df) == 8 and df['age'].max() == 80.0
+        assert os.listdir(cache_dir) == [os.path.basename(new['cache'])]
+    print("✓ PASSED: changed workbook rebuilds the cache")
+
+def main():
+    if not PYARROW_AVAILABLE:
+        print("pyarrow not installed: the workbook is always read directly, nothing to test")
+        sys.exit(0)
+
+    tests = [
+        test_cache_round_trip,
+        test_changed_workbook_rebuilds
+    ]
+
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            failed += 1
+            print(f"✗ FAILED: {test.__name__}: {e}")
+
+    print(f"\nPassed: {len(tests) - failed}/{len(tests)}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
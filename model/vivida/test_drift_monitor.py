@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the streaming drift monitor (gbm_drift_monitor.py)
+
+Runs on synthetic traffic, no trained model directory needed:
+    python test_drift_monitor.py
+"""
+
+import sys
+import numpy as np
+import pandas as pd
+
+from gbm_drift_monitor import build_drift_reference, DriftMonitor, CountMinSketch, SpaceSaving
+
+LOCATIONS = ['frontal_lobe', 'temporal_lobe', 'parietal_lobe']
+
+def make_patients(n, seed, age_mean=58.0, locations=LOCATIONS):
+    rng = np.random.default_rng(seed)
+    numeric = pd.DataFrame({
+        'age': rng.normal(age_mean, 10, n),
+        'has_headache': rng.integers(0, 2, n).astype(float)
+    })
+    categorical = pd.DataFrame({'tumor_location': rng.choice(locations, n)})
+    return numeric, categorical
+
+def replay(monitor, numeric, categorical):
+    for num, cat in zip(numeric.to_dict('records'), categorical.to_dict('records')):
+        monitor.update(num, cat)
+
+def test_same_distribution_is_stable():
+    """Traffic drawn like the training data stays below the moderate threshold"""
+    monitor = DriftMonitor(build_drift_reference(*make_patients(5000, seed=0)))
+    replay(monitor, *make_patients(2000, seed=1))
+    report = monitor.report()
+    assert report['requests'] == 2000
+    assert report['drifted'] == [], report['drifted']
+    assert abs(report['numeric']['age']['quantiles'][1] - 58.0) < 1.0
+    print("✓ PASSED: same distribution is stable")
+
+def test_shift_and_unseen_categories_are_flagged():
+    """A shifted numeric field and an unseen category are reported as significant"""
+    monitor = DriftMonitor(build_drift_reference(*make_patients(5000, seed=0)))
+    replay(monitor, *make_patients(500, seed=2, age_mean=75.0, locations=LOCATIONS + ['cerebellum']))
+    report = monitor.report()
+    drifted = {d['feature']: d['status'] for d in report['drifted']}
+    assert drifted.get('age') == 'significant', drifted
+    assert 'has_headache' not in drifted
+    location = report['categorical']['tumor_location']
+    assert location['status'] == 'significant'
+    assert location['top_unseen'][0]['value'] == 'cerebellum'
+    assert abs(location['unseen_fraction'] - 0.25) < 0.06
+    print("✓ PASSED: shifts and unseen categories are flagged")
+
+def test_too_little_traffic_is_not_judged():
+    monitor = DriftMonitor(build_drift_reference(*make_patients(1000, seed=0)))
+    replay(monitor, *make_patients(10, seed=3, age_mean=90.0))
+    assert monitor.report()['numeric']['age']['status'] == 'insufficient_data'
+    monitor.reset()
+    assert monitor.report()['requests'] == 0
+    print("✓ PASSED: too little traffic is not judged")
+
+def test_rarely_sent_field_is_not_listed():
+    """A field present in few requests is judged on its own count, not the request count"""
+    monitor = DriftMonitor(build_drift_reference(*make_patients(1000, seed=0)))
+    numeric, categorical = make_patients(500, seed=5)
+    numeric.loc[10:, 'age'] = np.nan
+    numeric.loc[:9, 'age'] = 90.0
+    replay(monitor, numeric, categorical)
+    report = monitor.report()
+    assert report['numeric']['age']['status'] == 'insufficient_data'
+    assert all(d['feature'] != 'age' for d in report['drifted']), report['drifted']
+    print("✓ PASSED: rarely sent fields are judged on their own count")
+
+def test_sketches():
+    """Count-min never underestimates; space-saving keeps the heavy hitters in fixed memory"""
+    rng = np.random.default_rng(4)
+    keys = [f"k{i}" for i in rng.zipf(1.5, 5000) % 500]
+    cms, top = CountMinSketch(width=256, depth=4), SpaceSaving(capacity=5)
+    for k in keys:
+        cms.add(k)
+        top.add(k)
+    truth = pd.Series(keys).value_counts()
+    assert all(cms.estimate(k) >= c for k, c in truth.items())
+    assert len(top.counts) == 5
+    assert top.top()[0]['value'] == truth.index[0]
+    print("✓ PASSED: count-min and space-saving sketches")
+
+def main():
+    tests = [
+        test_same_distribution_is_stable,
+        test_shift_and_unseen_categories_are_flagged,
+        test_too_little_traffic_is_not_judged,
+        test_rarely_sent_field_is_not_listed,
+        test_sketches
+    ]
+
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            failed += 1
+            print(f"✗ FAILED: {test.__name__}: {e}")
+
+    print(f"\nPassed: {len(tests) - failed}/{len(tests)}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Equivalence tests for the per-patient fast inference paths
+(gbm_fast_inference_v3.py) against the libraries' own predict()
+
+Runs on small synthetic models, no trained model directory needed:
+    python test_fast_inference.py
+"""
+
+import sys
+import itertools
+from math import factorial
+import numpy as np
+from sklearn.ensemble import GradientBoostingRegressor, RandomForestRegressor, ExtraTreesRegressor
+
+from sklearn.neural_network import MLPRegressor
+
+from gbm_fast_inference_v3 import (
+    pack_tree_ensemble, IncrementalMLP, supports_incremental_mlp,
+    PathTreeShap, mlp_integrated_gradients
+)
+
+N_FEATURES = 12
+DYNAMIC = [0, 3, 7]  # "treatment" columns that vary between candidates
+
+def make_data(n=400, seed=0):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n, N_FEATURES))
+    y = X[:, 0] * 2 + np.sin(X[:, 3]) + X[:, 1] * X[:, 7] + 0.5 * X[:, 2] + rng.normal(0, 0.1, n)
+    return X, y
+
+def make_candidates(X, n=64, seed=1):
+    """Rows sharing one patient's static features, varying only DYNAMIC columns"""
+    rng = np.random.default_rng(seed)
+    cand = np.repeat(X[:1], n, axis=0)
+    cand[:, DYNAMIC] = rng.normal(size=(n, len(DYNAMIC)))
+    return cand
+
+def tree_models():
+    models = [
+        GradientBoostingRegressor(n_estimators=40, max_depth=4, random_state=0),
+        RandomForestRegressor(n_estimators=25, max_depth=10, random_state=0),
+        ExtraTreesRegressor(n_estimators=25, max_depth=10, random_state=0)
+    ]
+    try:
+        import xgboost as xgb
+        models.append(xgb.XGBRegressor(n_estimators=40, max_depth=5, learning_rate=0.1, random_state=0))
+    except ImportError:
+        pass
+    return models
+
+def test_packed_forest_matches_predict():
+    """Packed (unspecialized) ensembles reproduce predict()"""
+    X, y = make_data()
+    for model in tree_models():
+        model.fit(X, y)
+        packed = pack_tree_ensemble(model)
+        assert packed is not None, type(model).__name__
+        np.testing.assert_allclose(packed.predict(X), model.predict(X), rtol=1e-6, atol=1e-6,
+                                   err_msg=type(model).__name__)
+    print("✓ PASSED: packed ensembles match predict()")
+
+def test_specialized_forest_matches_predict():
+    """Specialized ensembles reproduce predict() on candidates and are smaller"""
+    X, y = make_data()
+    cand = make_candidates(X)
+    static_mask = np.ones(N_FEATURES, dtype=bool)
+    static_mask[DYNAMIC] = False
+
+    for model in tree_models():
+        model.fit(X, y)
+        packed = pack_tree_ensemble(model)
+        special = packed.specialize(cand[0], static_mask)
+        np.testing.assert_allclose(special.predict(cand), model.predict(cand), rtol=1e-6, atol=1e-6,
+                                   err_msg=type(model).__name__)
+        assert special.n_nodes < packed.n_nodes, type(model).__name__
+        assert np.all(static_mask[special.feature[special.left >= 0]] == False)
+    print("✓ PASSED: specialized ensembles match predict()")
+
+def test_fully_static_forest_is_constant():
+    """With every feature fixed the specialized ensemble collapses to a constant"""
+    X, y = make_data()
+    model = RandomForestRegressor(n_estimators=10, random_state=0).fit(X, y)
+    special = pack_tree_ensemble(model).specialize(X[5], np.ones(N_FEATURES, dtype=bool))
+    assert special.n_nodes == 1
+    np.testing.assert_allclose(special.predict(X[5:6]), model.predict(X[5:6]))
+    print("✓ PASSED: fully static ensemble is a constant")
+
+def test_unsupported_model_returns_none():
+    from sklearn.linear_model import Ridge
+    X, y = make_data()
+    assert pack_tree_ensemble(Ridge().fit(X, y)) is None
+    print("✓ PASSED: unsupported learners fall back to predict()")
+
+def test_incremental_mlp_matches_predict():
+    """IncrementalMLP reproduces MLPRegressor.predict on candidates"""
+    X, y = make_data()
+    cand = make_candidates(X)
+    static_mask = np.ones(N_FEATURES, dtype=bool)
+    static_mask[DYNAMIC] = False
+
+    for activation in ('relu', 'tanh', 'logistic'):
+        model = MLPRegressor(hidden_layer_sizes=(32, 16, 8), activation=activation,
+                             max_iter=200, random_state=0).fit(X, y)
+        assert supports_incremental_mlp(model)
+        fast = IncrementalMLP(model, cand[0], static_mask)
+        np.testing.assert_allclose(fast.predict(cand), model.predict(cand), rtol=1e-10, atol=1e-10,
+                                   err_msg=activation)
+    print("✓ PASSED: incremental MLP matches MLPRegressor.predict()")
+
+def test_incremental_mlp_multi_output():
+    X, y = make_data()
+    Y = np.column_stack([y, -y])
+    cand = make_candidates(X)
+    static_mask = np.ones(N_FEATURES, dtype=bool)
+    static_mask[DYNAMIC] = False
+
+    model = MLPRegressor(hidden_layer_sizes=(16,), max_iter=200, random_state=0).fit(X, Y)
+    fast = IncrementalMLP(model, cand[0], static_mask)
+    np.testing.assert_allclose(fast.predict(cand), model.predict(cand), rtol=1e-10, atol=1e-10)
+    print("✓ PASSED: incremental MLP matches multi-output predict()")
+
+def _conditional_expectation(forest, x, known):
+    """Path-dependent E[f(x) | x_known]: unknown splits follow both children by cover"""
+    def walk(n):
+        if forest.left[n] < 0:
+            return forest.value[n, 0]
+        if forest.feature[n] in known:
+            xf = np.float64(np.float32(x[forest.feature[n]]))
+            return walk(forest.left[n] if forest._go_left(xf, n) else forest.right[n])
+        l, r = forest.left[n], forest.right[n]
+        return (walk(l) * forest.cover[l] + walk(r) * forest.cover[r]) / forest.cover[n]
+    return forest.init[0] + forest.scale * sum(walk(root) for root in forest.roots)
+
+def _brute_force_shap(forest, x):
+    """Shapley values by enumerating every subset of the split features"""
+    features = sorted(set(forest.feature[forest.left >= 0].tolist()))
+    value = {}
+    for size in range(len(features) + 1):
+        for S in itertools.combinations(features, size):
+            value[S] = _conditional_expectation(forest, x, set(S))
+
+    phi = np.zeros(N_FEATURES)
+    M = len(features)
+    for f in features:
+        others = [j for j in features if j != f]
+        for size in range(M):
+            w = factorial(size) * factorial(M - size - 1) / factorial(M)
+            for S in itertools.combinations(others, size):
+                phi[f] += w * (value[tuple(sorted(S + (f,)))] - value[S])
+    return phi
+
+def test_tree_shap_matches_brute_force():
+    """PathTreeShap equals brute-force path-dependent Shapley values and adds up to predict()"""
+    X, y = make_data()
+    small = [type(m)(**{**m.get_params(), 'n_estimators': 6, 'max_depth': 4}) for m in tree_models()]
+    for model in small:
+        model.fit(X, y)
+        forest = pack_tree_ensemble(model)
+        explainer = PathTreeShap(forest, N_FEATURES)
+        for x in X[:3]:
+            phi = explainer.shap_values(x)
+            np.testing.assert_allclose(phi, _brute_force_shap(forest, x), atol=1e-9,
+                                       err_msg=type(model).__name__)
+            np.testing.assert_allclose(explainer.expected_value + phi.sum(), model.predict(x[None])[0],
+                                       rtol=1e-5, atol=1e-5, err_msg=type(model).__name__)
+    print("✓ PASSED: TreeSHAP matches brute-force Shapley values")
+
+def test_mlp_integrated_gradients_complete():
+    """Integrated gradients sum to f(x) - f(baseline)"""
+    X, y = make_data()
+    for activation in ('relu', 'tanh', 'logistic'):
+        model = MLPRegressor(hidden_layer_sizes=(32, 16), activation=activation,
+                             max_iter=200, random_state=0).fit(X, y)
+        for x in X[:3]:
+            ig = mlp_integrated_gradients(model, x, steps=512)
+            gap = model.predict(x[None])[0] - model.predict(np.zeros((1, N_FEATURES)))[0]
+            np.testing.assert_allclose(ig.sum(), gap, rtol=1e-2, atol=1e-2, err_msg=activation)
+    print("✓ PASSED: MLP integrated gradients are complete")
+
+def main():
+    tests = [
+        test_packed_forest_matches_predict,
+        test_specialized_forest_matches_predict,
+        test_fully_static_forest_is_constant,
+        test_unsupported_model_returns_none,
+        test_incremental_mlp_matches_predict,
+        test_incremental_mlp_multi_output,
+        test_tree_shap_matches_brute_force,
+        test_mlp_integrated_gradients_complete
+    ]
+
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            failed += 1
+            print(f"✗ FAILED: {test.__name__}: {e}")
+
+    print(f"\nPassed: {len(tests) - failed}/{len(tests)}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the fast Gompertz fit (gbm_gompertz_fit.py) against scipy's
+curve_fit with the model, start point and bounds of the former
+per-patient training fit
+
+Runs on synthetic follow-ups, no trained model directory needed:
+    python test_gompertz_fit.py
+"""
+
+import sys
+import warnings
+import numpy as np
+from scipy.optimize import curve_fit
+
+from gbm_gompertz_fit import (
+    fit_gompertz_batch, fit_gompertz_fast, fit_gompertz_with_fallback, gompertz_curve,
+    follow_up_observations, refit_from_follow_up, K_MAX
+)
+
+TIMES = np.array([0.0, 2.0, 4.0, 6.0, 12.0])
+
+def make_follow_ups(n=200, seed=0):
+    """Growing and shrinking trajectories with measurement noise"""
+    rng = np.random.default_rng(seed)
+    T0 = rng.uniform(2.0, 8.0, n)
+    r = rng.uniform(0.02, 0.4, n)
+    K = np.minimum(T0 * rng.uniform(0.4, 3.0, n), 12.0)
+    sizes = gompertz_curve(TIMES[None, :], T0[:, None], r[:, None], K[:, None])
+    sizes = np.round(sizes * rng.normal(1.0, 0.05, sizes.shape), 1)
+    sizes[:, 0] = T0
+    return T0, sizes
+
+def fit_curve_fit(times, sizes, T0):
+    """The training script's fit_gompertz()"""
+    def gompertz(t, r, K):
+        return T0 * (K / T0) ** (1 - np.exp(-r * t))
+    p0 = [0.05, max(sizes) * 1.2]
+    bounds = ([1e-6, T0], [0.5, 20.0])
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return curve_fit(gompertz, times, sizes, p0=p0, bounds=bounds, maxfev=5000)[0]
+
+def sse(r, K, T0, sizes):
+    return np.sum((gompertz_curve(TIMES, T0, r, K) - sizes) ** 2)
+
+def test_batch_matches_curve_fit():
+    """Batched LM reaches curve_fit's least-squares optimum"""
+    T0, sizes = make_follow_ups()
+    fit = fit_gompertz_batch(np.tile(TIMES, (len(T0), 1)), sizes, T0)
+    assert fit['converged'].all()
+    assert fit['iterations'].max() <= 100
+    for i in range(len(T0)):
+        ref = fit_curve_fit(TIMES, sizes[i], T0[i])
+        ours, theirs = sse(fit['r'][i], fit['K'][i], T0[i], sizes[i]), sse(*ref, T0[i], sizes[i])
+        assert ours <= theirs * (1 + 1e-6) + 1e-12, (i, ours, theirs)
+    print("✓ PASSED: batched fit matches curve_fit")
+
+def test_single_fit_recovers_parameters():
+    """Noise-free follow-ups give back the generating parameters"""
+    sizes = gompertz_curve(TIMES, 3.0, 0.15, 9.0)
+    r, K = fit_gompertz_fast(TIMES, sizes, 3.0)
+    np.testing.assert_allclose([r, K], [0.15, 9.0], rtol=1e-5)
+    print("✓ PASSED: single fit recovers parameters")
+
+def test_missing_observations_are_ignored():
+    """NaN entries are masked out of the fit"""
+    T0, sizes = make_follow_ups(n=20, seed=1)
+    with_gap = sizes.copy()
+    with_gap[:, 2] = np.nan
+    times = np.tile(TIMES, (len(T0), 1))
+    masked = fit_gompertz_batch(times, with_gap, T0)
+    dropped = fit_gompertz_batch(np.delete(times, 2, axis=1), np.delete(sizes, 2, axis=1), T0)
+    np.testing.assert_allclose(masked['r'], dropped['r'])
+    np.testing.assert_allclose(masked['K'], dropped['K'])
+    print("✓ PASSED: missing observations are ignored")
+
+def test_fallback_fits_unconverged_rows():
+    """Rows the batched fit leaves unconverged are refitted with curve_fit"""
+    T0, sizes = make_follow_ups(n=40, seed=2)
+    times = np.tile(TIMES, (len(T0), 1))
+    fit = fit_gompertz_with_fallback(times, sizes, T0, max_iter=1)
+    assert fit['fallback'].any() and fit['converged'].all()
+    for i in np.flatnonzero(fit['fallback']):
+        ref = fit_curve_fit(TIMES, sizes[i], T0[i])
+        ours, theirs = sse(fit['r'][i], fit['K'][i], T0[i], sizes[i]), sse(*ref, T0[i], sizes[i])
+        assert ours <= theirs * (1 + 1e-6) + 1e-12, (i, ours, theirs)
+    print("✓ PASSED: curve_fit fallback for unconverged rows")
+
+def test_refit_from_follow_up():
+    """Request follow-ups: training columns and follow_up list, minimum count"""
+    patient = {'tumor_size_before': 3.0, 'tumor_size_2m': 3.6,
+               'follow_up': [{'months': 5, 'tumor_size': 4.4}]}
+    assert follow_up_observations(patient) == ([2.0, 5.0], [3.6, 4.4])
+    fit = refit_from_follow_up(patient)
+    assert fit['n_obs'] == 3 and fit['converged']
+    assert refit_from_follow_up({'tumor_size_before': 3.0, 'tumor_size_2m': 3.6}) is None
+    # T0 at or above K_MAX has no valid K; training leaves it unfitted (NaN) as well
+    assert refit_from_follow_up({'tumor_size_before': K_MAX, 'tumor_size_2m': 21.0, 'tumor_size_4m': 22.0}) is None
+
+    for bad in ({'follow_up': [{'months': 0, 'tumor_size': 2.0}]}, {'follow_up': [{'months': 3}]},
+                {'follow_up': [{'months': 'x', 'tumor_size': 2.0}]}, {'follow_up': [3]},
+                {'follow_up': {'months': 3, 'tumor_size': 2.0}}, {'tumor_size_2m': 'big'}):
+        try:
+            follow_up_observations(bad)
+        except ValueError:
+            continue
+        raise AssertionError(f"follow-up {bad} accepted")
+    print("✓ PASSED: refit from request follow-ups")
+
+def main():
+    tests = [
+        test_batch_matches_curve_fit,
+        test_single_fit_recovers_parameters,
+        test_missing_observations_are_ignored,
+        test_fallback_fits_unconverged_rows,
+        test_refit_from_follow_up
+    ]
+
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            failed += 1
+            print(f"✗ FAILED: {test.__name__}: {e}")
+
+    print(f"\nPassed: {len(tests) - failed}/{len(tests)}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
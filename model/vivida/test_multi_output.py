@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the shared multi-output base models (gbm_multi_output.py) and
+their fast inference paths (gbm_fast_inference_v3.py)
+
+Runs on small synthetic models, no trained model directory needed:
+    python test_multi_output.py
+"""
+
+import io
+import sys
+import numpy as np
+from joblib import dump, load
+from sklearn.ensemble import RandomForestRegressor, ExtraTreesRegressor
+from sklearn.neural_network import MLPRegressor
+
+from gbm_multi_output import OutputColumn, fit_standardized, output_columns
+from gbm_fast_inference_v3 import (
+    pack_tree_ensemble, IncrementalMLP, supports_incremental_mlp,
+    PathTreeShap, mlp_integrated_gradients
+)
+
+N_FEATURES = 10
+DYNAMIC = [0, 4]
+
+def make_data(n=300, seed=0):
+    """Four targets on very different scales, like r/K/alpha/beta"""
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n, N_FEATURES))
+    base = X[:, 0] * 2 + np.sin(X[:, 4]) + X[:, 1] * X[:, 2]
+    Y = np.column_stack([0.01 * base, 500 + 80 * base + 5 * X[:, 3], 0.2 * np.tanh(base), 0.01 * X[:, 5]])
+    return X, Y
+
+def static_mask():
+    mask = np.ones(N_FEATURES, dtype=bool)
+    mask[DYNAMIC] = False
+    return mask
+
+def test_columns_are_in_target_units():
+    """Each column predicts its target in original units; standardization keeps every target fitted"""
+    X, Y = make_data()
+    model = RandomForestRegressor(n_estimators=20, max_depth=8, random_state=0)
+    offset, factor = fit_standardized(model, X, Y)
+    columns = output_columns(model, offset, factor)
+    assert len(columns) == Y.shape[1]
+    for i, col in enumerate(columns):
+        assert col.model is model
+        np.testing.assert_allclose(col.predict(X), offset[i] + factor[i] * model.predict(X)[:, i])
+        # The small-scale targets are learnt too, not swamped by K's variance
+        assert np.corrcoef(col.predict(X), Y[:, i])[0, 1] > 0.9, i
+    print("✓ PASSED: output columns predict each target in its units")
+
+def test_constant_target_is_kept():
+    X, Y = make_data()
+    Y[:, 3] = 7.0
+    model = ExtraTreesRegressor(n_estimators=10, random_state=0)
+    offset, factor = fit_standardized(model, X, Y)
+    np.testing.assert_allclose(OutputColumn(model, 3, offset[3], factor[3]).predict(X), 7.0)
+    print("✓ PASSED: a constant target stays constant")
+
+def test_shared_model_pickled_once():
+    """Four columns of one model cost one model on disk, and stay shared after loading"""
+    X, Y = make_data()
+    model = RandomForestRegressor(n_estimators=20, random_state=0)
+    columns = output_columns(model, *fit_standardized(model, X, Y))
+
+    def size(obj):
+        buf = io.BytesIO()
+        dump(obj, buf)
+        return buf.tell()
+
+    assert size(columns) < 1.1 * size(model)
+    buf = io.BytesIO()
+    dump(columns, buf)
+    buf.seek(0)
+    loaded = load(buf)
+    assert all(c.model is loaded[0].model for c in loaded)
+    print("✓ PASSED: a shared model is pickled once")
+
+def test_packed_column_matches_predict():
+    """Packed and specialized forests of a column reproduce its predict(), with exact TreeSHAP"""
+    X, Y = make_data()
+    cand = np.repeat(X[:1], 32, axis=0)
+    cand[:, DYNAMIC] = np.random.default_rng(1).normal(size=(32, len(DYNAMIC)))
+    for model in (RandomForestRegressor(n_estimators=15, max_depth=8, random_state=0),
+                  ExtraTreesRegressor(n_estimators=15, max_depth=8, random_state=0)):
+        for col in output_columns(model, *fit_standardized(model, X, Y)):
+            packed = pack_tree_ensemble(col)
+            assert packed is not None and packed.n_outputs == 1
+            np.testing.assert_allclose(packed.predict(X), col.predict(X), rtol=1e-6, atol=1e-9)
+            np.testing.assert_allclose(packed.specialize(cand[0], static_mask()).predict(cand),
+                                       col.predict(cand), rtol=1e-6, atol=1e-9)
+            explainer = PathTreeShap(packed, N_FEATURES)
+            phi = explainer.shap_values(X[0])
+            np.testing.assert_allclose(explainer.expected_value + phi.sum(), col.predict(X[:1])[0],
+                                       rtol=1e-6, atol=1e-9)
+    print("✓ PASSED: packed output columns match predict()")
+
+def test_shared_forest_packed_once():
+    """One multi-output pack, specialized once, gives every column (the serving path)"""
+    X, Y = make_data()
+    cand = np.repeat(X[:1], 32, axis=0)
+    cand[:, DYNAMIC] = np.random.default_rng(1).normal(size=(32, len(DYNAMIC)))
+    model = RandomForestRegressor(n_estimators=15, max_depth=8, random_state=0)
+    columns = output_columns(model, *fit_standardized(model, X, Y))
+    packed = pack_tree_ensemble(model)
+    assert packed.n_outputs == Y.shape[1]
+    out = packed.specialize(cand[0], static_mask()).predict(cand)
+    for col in columns:
+        np.testing.assert_allclose(col.offset + col.factor * out[:, col.column], col.predict(cand),
+                                   rtol=1e-6, atol=1e-9)
+    print("✓ PASSED: a shared forest packed once serves every column")
+
+def test_incremental_mlp_column():
+    """IncrementalMLP and integrated gradients of an MLP column"""
+    X, Y = make_data()
+    cand = np.repeat(X[:1], 32, axis=0)
+    cand[:, DYNAMIC] = np.random.default_rng(1).normal(size=(32, len(DYNAMIC)))
+    model = MLPRegressor(hidden_layer_sizes=(16, 8), max_iter=300, random_state=0)
+    for col in output_columns(model, *fit_standardized(model, X, Y)):
+        assert supports_incremental_mlp(col)
+        fast = IncrementalMLP(col, cand[0], static_mask())
+        np.testing.assert_allclose(fast.predict(cand), col.predict(cand), rtol=1e-10, atol=1e-12)
+        ig = mlp_integrated_gradients(col, X[0], steps=512)
+        gap = col.predict(X[:1])[0] - col.predict(np.zeros((1, N_FEATURES)))[0]
+        np.testing.assert_allclose(ig.sum(), gap, rtol=1e-2, atol=1e-2 * col.factor)
+    print("✓ PASSED: incremental MLP and integrated gradients of an output column")
+
+def main():
+    tests = [
+        test_columns_are_in_target_units,
+        test_constant_target_is_kept,
+        test_shared_model_pickled_once,
+        test_packed_column_matches_predict,
+        test_shared_forest_packed_once,
+        test_incremental_mlp_column
+    ]
+
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            failed += 1
+            print(f"✗ FAILED: {test.__name__}: {e}")
+
+    print(f"\nPassed: {len(tests) - failed}/{len(tests)}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the schedule-aware Gompertz simulation (gbm_optimize_treatment_dosage_v3.py)
+
+Imports the optimization module, so the trained models must be present
+(as for test_all_patients.py):
+    python test_schedule_simulation.py
+"""
+
+import sys
+import numpy as np
+
+from gbm_optimize_treatment_dosage_v3 import (
+    treatment_schedule, simulate_gompertz_schedule, simulate_schedule_horizons
+)
+
+def make_candidates():
+    """A few regimens with kill rates large enough to matter"""
+    schedules = [treatment_schedule(c, r, radio_fractions=f)
+                 for c, r, f in ((1, 0, 30), (0, 1, 30), (1, 1, 30), (1, 1, 15), (0, 0, 30))]
+    n = len(schedules)
+    params = {
+        'r': np.full(n, 0.08),
+        'K': np.full(n, 60.0),
+        'alpha': np.linspace(0.05, 0.25, n),
+        'beta': np.linspace(0.3, 0.1, n)
+    }
+    return np.full(n, 3.5), params, schedules
+
+def test_volume_independent_of_other_times():
+    """The 3-month volume is the same whether or not later times are requested"""
+    T0, params, schedules = make_candidates()
+    alone = simulate_gompertz_schedule(T0, params, schedules, [3])[:, 0]
+    for times in ([3, 12], [1, 3, 24], [3, 6]):
+        with_later = simulate_gompertz_schedule(T0, params, schedules, times)[:, times.index(3)]
+        np.testing.assert_allclose(with_later, alone, rtol=1e-12)
+    print("✓ PASSED: volumes do not depend on the other requested times")
+
+def test_horizons_match_schedule():
+    """simulate_schedule_horizons reads the same volumes as simulate_gompertz_schedule"""
+    T0, params, schedules = make_candidates()
+    horizons = [3, 6, 12, 24]
+    sim = simulate_schedule_horizons(T0, params, schedules, horizons, curve_points=5)
+    np.testing.assert_allclose(sim['volumes'],
+                               simulate_gompertz_schedule(T0, params, schedules, horizons), rtol=1e-12)
+    assert sim['curve'].shape == (len(schedules), 5)
+    assert np.all(sim['auc'] > 0)
+    print("✓ PASSED: horizon volumes match the schedule simulation")
+
+def main():
+    tests = [
+        test_volume_independent_of_other_times,
+        test_horizons_match_schedule
+    ]
+
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            failed += 1
+            print(f"✗ FAILED: {test.__name__}: {e}")
+
+    print(f"\nPassed: {len(tests) - failed}/{len(tests)}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the multi-stage planner (gbm_optimize_treatment_sequence_v3.py)
+
+Imports the optimization modules, so the trained models must be present
+(as for test_all_patients.py):
+    python test_sequence_planner.py
+"""
+
+import io
+import sys
+import json
+import contextlib
+import numpy as np
+
+with contextlib.redirect_stdout(io.StringIO()):
+    from gbm_optimize_treatment_sequence_v3 import (
+        optimize_treatment_sequence, parse_stages, StageTransitions, DEFAULT_STAGES
+    )
+
+PATIENT_FILE = 'example_patient.json'
+
+def brute_force(patient, specs):
+    """Final volume of every stage sequence, rolled forward exactly (no volume grid)"""
+    stages = parse_stages(specs)
+    transitions = StageTransitions(patient, [o for s in stages for o in s['options']])
+    volumes = np.array([max(float(patient.get('tumor_size_before', 3.0)), 0.1)])
+    for stage in stages:
+        rows = transitions.rows(stage['options'])
+        volumes = transitions.simulate(np.repeat(volumes, len(rows)), np.tile(rows, len(volumes)),
+                                       stage['months'])
+    return stages, volumes
+
+def test_dp_matches_brute_force():
+    """The DP plan reaches the best final volume of all sequences, and its plan is a real sequence"""
+    with open(PATIENT_FILE, 'r', encoding='utf-8') as f:
+        patient = json.load(f)
+    stages, volumes = brute_force(patient, DEFAULT_STAGES)
+    assert len(volumes) == int(np.prod([len(s['options']) for s in stages]))
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = optimize_treatment_sequence(patient, DEFAULT_STAGES)
+    np.testing.assert_allclose(result['final_volume'], volumes.min(), rtol=1e-9)
+
+    # The returned plan's final volume is that of its own sequence in the enumeration
+    index = 0
+    for stage, step in zip(stages, result['plan']):
+        keys = [(o['treatment'], o['chemo_dose_mg_per_m2'], o['radio_total_Gy'], o['radio_fractions'])
+                for o in stage['options']]
+        r = step['regimen']
+        index = index * len(keys) + keys.index((r['treatment'], r['chemo_dose_mg_per_m2'],
+                                                r['radio_total_Gy'], r['radio_fractions']))
+    np.testing.assert_allclose(volumes[index], result['final_volume'], rtol=1e-12)
+    assert result['search_stats']['sequences'] == len(volumes)
+    print(f"✓ PASSED: DP plan matches brute force over {len(volumes)} sequences")
+
+def test_invalid_radio_schemes_rejected():
+    """Non-numeric and fractional radio schemes are a ValueError, not a TypeError"""
+    for schemes in ([["a", 5]], [[60, "30"]], [[60, 30.5]], [[60]]):
+        spec = [{'name': 'rt', 'months': 2, 'modalities': ['radiation'], 'radio_schemes': schemes}]
+        try:
+            parse_stages(spec)
+        except ValueError:
+            continue
+        raise AssertionError(f"radio_schemes {schemes} accepted")
+    spec = [{'name': 'rt', 'months': 2, 'modalities': ['radiation'], 'radio_schemes': [[60, 30.0]]}]
+    assert parse_stages(spec)[0]['options'][0]['radio_fractions'] == 30
+    print("✓ PASSED: invalid radio schemes rejected")
+
+def main():
+    tests = [
+        test_dp_matches_brute_force,
+        test_invalid_radio_schemes_rejected
+    ]
+
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            failed += 1
+            print(f"✗ FAILED: {test.__name__}: {e}")
+
+    print(f"\nPassed: {len(tests) - failed}/{len(tests)}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()